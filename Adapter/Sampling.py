@@ -3,29 +3,50 @@ from diffusers import DDPMScheduler, AutoencoderKL
 import torch
 from pytorch_lightning import seed_everything
 import tqdm
-import copy
 import random
 from basicsr.utils import tensor2img
 import numpy as np
 import cv2
 import os
 
+from Adapter.placement import PlacementPolicy
+from Adapter.prompt_cache import PromptEmbeddingCache
+from Adapter.schedulers import build_scheduler, resolve_steps, step_kwargs
 from Adapter.utils import import_model_class_from_model_name_or_path
 from models.unet import UNet
 
+DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
 class diffusion_inference:
-    def __init__(self, model_id):
+    def __init__(self, model_id, prompt_cache_size=64, placement='encoder_offload', memory_budget=None,
+                 vae_slicing=True, vae_tile_size=None, dtype='fp32', upcast_vae=True, scheduler='ddpm'):
+        """
+        placement / memory_budget: see `PlacementPolicy`, the default keeps the UNet and the VAE on the GPU and only
+        brings the text encoders over for prompts that are not cached.
+        vae_slicing / vae_tile_size: see `set_vae_decode`.
+        dtype: 'fp32', 'fp16' or 'bf16' for the UNet, the text encoders and everything fed to the UNet (prompt
+            embeds, adapter features); the latents and the scheduler stay in fp32.
+        upcast_vae: keep the VAE in fp32 with a half dtype, the SDXL VAE overflows in fp16.
+        scheduler: default entry of `Adapter.schedulers.SCHEDULERS`, every request can pick another one.
+        """
         self.device = 'cuda'
         self.model_id = model_id
+        self.dtype = DTYPES[dtype]
+        self.placement = PlacementPolicy(placement, device=self.device, memory_budget=memory_budget)
 
         # load unet model
-        self.scheduler = DDPMScheduler.from_pretrained(model_id, subfolder="scheduler")
-        self.model = UNet.from_pretrained(model_id, subfolder="unet").to(self.device)
+        self.scheduler_config = DDPMScheduler.load_config(model_id, subfolder="scheduler")
+        self.schedulers = {}
+        self.scheduler_name = scheduler
+        self.scheduler = self.get_scheduler(scheduler)
+        self.model = UNet.from_pretrained(model_id, subfolder="unet", torch_dtype=self.dtype)
+        self.placement.register('unet', self.model)
         try:
             self.model.enable_xformers_memory_efficient_attention()
         except:
             print('The current xformers is not compatible, please reinstall xformers to speed up.')
-        self.scheduler.set_timesteps(50)
+        self.scheduler.set_timesteps(resolve_steps(scheduler))
 
         tokenizer_one = AutoTokenizer.from_pretrained(
             self.model_id, subfolder="tokenizer", revision=None, use_fast=False
@@ -44,25 +65,66 @@ class diffusion_inference:
 
         # Load scheduler and models
         text_encoder_one = text_encoder_cls_one.from_pretrained(
-            self.model_id, subfolder="text_encoder", revision=None
+            self.model_id, subfolder="text_encoder", revision=None, torch_dtype=self.dtype
         )
         text_encoder_two = text_encoder_cls_two.from_pretrained(
-            self.model_id, subfolder="text_encoder_2", revision=None
+            self.model_id, subfolder="text_encoder_2", revision=None, torch_dtype=self.dtype
         )
-        # self.text_encoders = [text_encoder_one.to(self.device), text_encoder_two.to(self.device)]
         self.text_encoders = [text_encoder_one, text_encoder_two]
         self.tokenizers = [tokenizer_one, tokenizer_two]
         self.vae = AutoencoderKL.from_pretrained(
                 self.model_id,
                 subfolder="vae",
                 revision=None,
-            )#.to(self.device)
+                torch_dtype=torch.float32 if upcast_vae else self.dtype,
+            )
+        self.placement.register('text_encoders', self.text_encoders)
+        self.placement.register('vae', self.vae)
+        self.set_vae_decode(slicing=vae_slicing, tile_size=vae_tile_size)
+
+        # repeated prompts (and the empty negative prompt) skip the text encoders
+        self.prompt_cache = PromptEmbeddingCache(maxsize=prompt_cache_size)
+        self.prompt_cache.warmup(self.tokenizers, self.text_encoders, self._encode_captions)
+
+    def set_vae_decode(self, slicing=True, tile_size=None, tile_overlap=0.25):
+        """
+        slicing: decode a batch one sample at a time, so the peak memory does not grow with the batch size.
+        tile_size: decode images larger than `tile_size` px in overlapping tiles with blended seams (the AutoencoderKL
+            tiling), so the peak memory is set by the tile and not by the output resolution. None decodes in one go.
+        """
+        if slicing:
+            self.vae.enable_slicing()
+        else:
+            self.vae.disable_slicing()
+        if tile_size is None:
+            self.vae.disable_tiling()
+            return
+        self.vae.enable_tiling()
+        self.vae.tile_sample_min_size = tile_size
+        self.vae.tile_latent_min_size = tile_size // 2 ** (len(self.vae.config.block_out_channels) - 1)
+        self.vae.tile_overlap_factor = tile_overlap
 
-    def reset_schedule(self, timesteps):
-        self.scheduler.set_timesteps(timesteps)
+    def get_scheduler(self, name=None):
+        """one instance per scheduler name, built from the checkpoint's scheduler config on first use"""
+        name = self.scheduler_name if name is None else name
+        if name not in self.schedulers:
+            self.schedulers[name] = build_scheduler(name, self.scheduler_config)
+        return self.schedulers[name]
 
-    def inference(self, prompt, size, prompt_n='', adapter_features=None, guidance_scale=7.5, seed=-1, steps=50,
-                  cond_tau=0.5, batch_size=1, additional_scale=1.0):
+    def reset_schedule(self, timesteps, scheduler=None):
+        """`timesteps` None uses the step preset of the scheduler, returns the scheduler"""
+        name = self.scheduler_name if scheduler is None else scheduler
+        scheduler = self.get_scheduler(name)
+        scheduler.set_timesteps(resolve_steps(name, timesteps))
+        return scheduler
+
+    def inference(self, prompt, size, prompt_n='', adapter_features=None, guidance_scale=7.5, seed=-1, steps=None,
+                  cond_tau=0.5, batch_size=1, additional_scale=1.0, scheduler=None, guidance_interval=(0., 1.)):
+        """
+        steps: None uses the preset of the scheduler (`Adapter.schedulers.STEP_PRESETS`).
+        scheduler: name of the scheduler for this request, None uses the default one.
+        guidance_interval: see `denoise`.
+        """
         prompt_batch = [prompt_n, prompt]
         prompt_embeds, unet_added_cond_kwargs = self.compute_embeddings(
             prompt_batch=prompt_batch,
@@ -70,43 +132,115 @@ class diffusion_inference:
             size=size,
             batch_size=batch_size,
         )
-        self.reset_schedule(steps)
+        scheduler = self.reset_schedule(steps, scheduler)
         if seed != -1:
             seed_everything(seed)
-        noisy_latents = torch.randn((batch_size, 4, size[0]//8, size[1]//8)).to("cuda")
-
-        total_steps = self.scheduler.timesteps.shape[0]
-        with torch.no_grad():
-            for i, t in enumerate(tqdm.tqdm(self.scheduler.timesteps)):
-                index = total_steps - i - 1
-                with torch.no_grad():
-                    input = torch.cat([noisy_latents]*2)
+        noisy_latents = torch.randn((batch_size, 4, size[0]//8, size[1]//8)).to("cuda") * scheduler.init_noise_sigma
+
+        noisy_latents = self.denoise(
+            noisy_latents, prompt_embeds, unet_added_cond_kwargs, adapter_features, guidance_scale, additional_scale,
+            scheduler=scheduler, guidance_interval=guidance_interval,
+        )
+        return self.decode(noisy_latents)
+
+    def inference_batch(self, requests, size, steps=None, scheduler=None, guidance_interval=(0., 1.)):
+        """
+        Run several independent requests as one UNet batch. Every request is a dict with the `inference` arguments
+        prompt, prompt_n, adapter_features, guidance_scale, seed and additional_scale, and gets its own prompt embeds,
+        adapter features, guidance scale and generator, so its image does not depend on the rest of the batch.
+        The step count, the scheduler and the guidance interval are shared by the batch. Returns one image per request.
+        """
+        num = len(requests)
+        prompt_batch = [r.get('prompt_n', '') for r in requests] + [r['prompt'] for r in requests]
+        prompt_embeds, unet_added_cond_kwargs = self.compute_embeddings(
+            prompt_batch=prompt_batch,
+            proportion_empty_prompts=0,
+            size=size,
+            batch_size=1,
+        )
+        scheduler = self.reset_schedule(steps, scheduler)
+
+        # per-request generators: the initial noise on the host as in `inference`, the scheduler noise on the device
+        seeds = [r.get('seed', -1) for r in requests]
+        seeds = [seed if seed != -1 else random.randint(0, 2**32 - 1) for seed in seeds]
+        noisy_latents = torch.cat([
+            torch.randn((1, 4, size[0]//8, size[1]//8), generator=torch.Generator().manual_seed(seed))
+            for seed in seeds
+        ]).to("cuda") * scheduler.init_noise_sigma
+        generator = [torch.Generator("cuda").manual_seed(seed) for seed in seeds]
+
+        adapter_features = None
+        if requests[0].get('adapter_features') is not None:
+            # the strength is folded into each request's features once, the UNet then adds them unscaled
+            scaled = [
+                [feature * r.get('additional_scale', 1.0) for feature in r['adapter_features']] for r in requests
+            ]
+            adapter_features = [torch.cat(list(levels) * 2) for levels in zip(*scaled)]
+        guidance_scale = torch.tensor(
+            [r.get('guidance_scale', 7.5) for r in requests], device="cuda").view(num, 1, 1, 1)
+
+        noisy_latents = self.denoise(
+            noisy_latents, prompt_embeds, unet_added_cond_kwargs, adapter_features, guidance_scale,
+            generator=generator, scheduler=scheduler, guidance_interval=guidance_interval,
+        )
+        return self.decode(noisy_latents)
+
+    def denoise(self, noisy_latents, prompt_embeds, unet_added_cond_kwargs, adapter_features=None,
+                guidance_scale=7.5, additional_scale=1.0, generator=None, scheduler=None, guidance_interval=(0., 1.)):
+        """
+        The prompt embeds and the added cond kwargs hold the negative half first, adapter features either match that
+        doubled batch or broadcast over it.
+        guidance_interval: (start, end) fraction of the steps that run classifier-free guidance. The other steps, and
+            all of them with a guidance scale of 1, run only the conditional half of the batch, at half the UNet cost.
+        """
+        scheduler = self.scheduler if scheduler is None else scheduler
+        if adapter_features is not None:
+            adapter_features = [feature.to(self.dtype) for feature in adapter_features]
+
+        # conditional half of every UNet input, for the unguided steps
+        num = noisy_latents.shape[0]
+        cond_embeds = prompt_embeds["prompt_embeds"].chunk(2)[1]
+        cond_added_cond_kwargs = {k: v.chunk(2)[1] for k, v in unet_added_cond_kwargs.items()}
+        cond_adapter_features = None if adapter_features is None else [
+            feature[num:] if feature.shape[0] == 2 * num else feature for feature in adapter_features
+        ]
+        unit_scale = bool((torch.as_tensor(guidance_scale) == 1).all())
+        start, end = guidance_interval
+        timesteps = scheduler.timesteps
+
+        with torch.no_grad(), self.placement.use('unet'):
+            for i, t in enumerate(tqdm.tqdm(timesteps)):
+                guided = not unit_scale and start <= i / len(timesteps) < end
+                if guided:
+                    input = scheduler.scale_model_input(torch.cat([noisy_latents]*2), t).to(self.dtype)
                     noise_pred = self.model(
                             input,
                             t,
                             encoder_hidden_states=prompt_embeds["prompt_embeds"],
                             added_cond_kwargs=unet_added_cond_kwargs,
-                            down_block_additional_residuals=copy.deepcopy(adapter_features),
-                            # down_block_additional_residuals=None if index >= int(
-                            #               (1 - cond_tau) * total_steps) else copy.deepcopy(adapter_features),
-                            # down_block_additional_residuals=None,
-                            # additional_scale=additional_scale,
-                        )[0]
+                            down_block_additional_residuals=adapter_features,
+                            additional_scale=additional_scale,
+                        )[0].float()
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
-                    noisy_latents = self.scheduler.step(noise_pred, t, noisy_latents)[0]
-
-                    # # debug
-                    # images = self.vae.decode(noisy_latents.cpu() / self.vae.config.scaling_factor, return_dict=False)[0]
-                    # images = (images / 2 + 0.5).clamp(0, 1)
-                    # for image in images:
-                    #     image = tensor2img(image)
-                    #     save_path = os.path.join(r'/home/mingjiahui/data/', f"debug_step-{index}.jpg")
-                    #     #
-                    #     cv2.imwrite(save_path, image)
-
-        images = self.vae.decode(noisy_latents.cpu() / self.vae.config.scaling_factor, return_dict=False)[0]
-        images = (images / 2 + 0.5).clamp(0, 1)
+                else:
+                    input = scheduler.scale_model_input(noisy_latents, t).to(self.dtype)
+                    noise_pred = self.model(
+                            input,
+                            t,
+                            encoder_hidden_states=cond_embeds,
+                            added_cond_kwargs=cond_added_cond_kwargs,
+                            down_block_additional_residuals=cond_adapter_features,
+                            additional_scale=additional_scale,
+                        )[0].float()
+                noisy_latents = scheduler.step(noise_pred, t, noisy_latents, **step_kwargs(scheduler, generator))[0]
+        return noisy_latents
+
+    def decode(self, latents):
+        with torch.no_grad(), self.placement.use('vae'):
+            latents = latents.to(self.vae.dtype)
+            images = self.vae.decode(latents / self.vae.config.scaling_factor, return_dict=False)[0]
+        images = (images / 2 + 0.5).clamp(0, 1).float()
         outputs = []
         for image in images:
             image = tensor2img(image)
@@ -115,8 +249,6 @@ class diffusion_inference:
 
 
     def encode_prompt(self, prompt_batch, proportion_empty_prompts, is_train=True):
-        prompt_embeds_list = []
-
         captions = []
         for caption in prompt_batch:
             if random.random() < proportion_empty_prompts:
@@ -127,7 +259,11 @@ class diffusion_inference:
                 # take a random caption if there are multiple
                 captions.append(random.choice(caption) if is_train else caption[0])
 
-        with torch.no_grad():
+        return self.prompt_cache.encode(self.tokenizers, self.text_encoders, captions, self._encode_captions)
+
+    def _encode_captions(self, captions):
+        prompt_embeds_list = []
+        with torch.no_grad(), self.placement.use('text_encoders'):
             for tokenizer, text_encoder in zip(self.tokenizers, self.text_encoders):
                 text_inputs = tokenizer(
                     captions,
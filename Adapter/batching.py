@@ -0,0 +1,76 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from Adapter.schedulers import resolve_steps
+
+
+class BatchingEngine:
+    """
+    Dynamic request batching in front of `diffusion_inference.inference_batch`. Callers block in `submit` while a
+    single worker thread collects requests for up to `window` seconds, runs the compatible ones (same size, scheduler,
+    step count, guidance interval and with / without adapter features) as one UNet batch of at most
+    `max_batch_size`, and hands every caller its own image back. Requests that do not fit the current batch wait for
+    the next one, oldest first.
+    """
+
+    def __init__(self, sampler, max_batch_size=4, window=0.05):
+        self.sampler = sampler
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt, size, prompt_n='', adapter_features=None, guidance_scale=7.5, seed=-1, steps=None,
+               additional_scale=1.0, scheduler=None, guidance_interval=(0., 1.)):
+        """same arguments as `diffusion_inference.inference` for one image, returns that image"""
+        scheduler = self.sampler.scheduler_name if scheduler is None else scheduler
+        steps = resolve_steps(scheduler, steps)
+        request = {
+            'prompt': prompt,
+            'prompt_n': prompt_n,
+            'adapter_features': adapter_features,
+            'guidance_scale': guidance_scale,
+            'seed': seed,
+            'additional_scale': additional_scale,
+            'key': (tuple(size), scheduler, steps, tuple(guidance_interval), adapter_features is None),
+            'future': Future(),
+        }
+        self.queue.put(request)
+        return request['future'].result()
+
+    def _collect(self, pending):
+        if not pending:
+            pending.append(self.queue.get())
+        key = pending[0]['key']
+        deadline = time.monotonic() + self.window
+        while sum(r['key'] == key for r in pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        batch = [r for r in pending if r['key'] == key][:self.max_batch_size]
+        return batch, [r for r in pending if not any(r is b for b in batch)]
+
+    def _run(self):
+        pending = []
+        while True:
+            batch, pending = self._collect(pending)
+            size, scheduler, steps, guidance_interval, _ = batch[0]['key']
+            try:
+                with torch.no_grad():
+                    images = self.sampler.inference_batch(
+                        batch, size=size, steps=steps, scheduler=scheduler, guidance_interval=guidance_interval)
+            except Exception as e:
+                for request in batch:
+                    request['future'].set_exception(e)
+                continue
+            for request, image in zip(batch, images):
+                request['future'].set_result(image)
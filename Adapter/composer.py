@@ -0,0 +1,93 @@
+import copy
+import functools
+import weakref
+from collections import OrderedDict
+
+import torch
+from torch.func import functional_call, stack_module_state
+
+from Adapter.models.adapters import Adapter_XL
+
+
+class AdapterComposer:
+    """
+    Multi-condition counterpart of `get_adapter_feature` for the SDXL adapters: takes the same inputs and adapter
+    dicts ({'model': Adapter_XL, 'cond_weight': float}) and returns one pyramid, the `cond_weight` weighted sum of the
+    adapters' pyramids, to pass to the UNet as a single set of `adapter_features`.
+
+    Adapters with the same architecture (parameter shapes and dtypes) and inputs of the same shape run as one batched
+    pass: their weights are stacked once (cached for the `max_stacks` most recent adapter combinations) and the forward
+    is vmapped over them, i.e. runs as grouped convolutions. The others, and exported adapters, run one by one.
+    """
+
+    def __init__(self, batched=True, max_stacks=4):
+        self.batched = batched
+        self.max_stacks = max_stacks
+        self.stacks = OrderedDict()     # adapter ids => (weakrefs, stacked params, stacked buffers, meta module)
+
+    @staticmethod
+    def group_key(input, model):
+        if type(model) is not Adapter_XL:
+            return None
+        return tuple(input.shape), tuple((k, tuple(v.shape), v.dtype) for k, v in model.state_dict().items())
+
+    def _drop(self, key, ref):
+        entry = self.stacks.get(key)
+        # dead weakrefs only compare equal to themselves, a newer entry under a reused id is kept
+        if entry is not None and ref in entry[0]:
+            del self.stacks[key]
+
+    def _stack(self, models):
+        key = tuple(id(model) for model in models)
+        entry = self.stacks.get(key)
+        if entry is not None and all(ref() is model for ref, model in zip(entry[0], models)):
+            self.stacks.move_to_end(key)
+            return entry[1:]
+        params, buffers = stack_module_state(models)
+        params = {k: v.detach() for k, v in params.items()}
+        meta = copy.deepcopy(models[0]).to('meta')
+        # weak references: the cache does not keep unloaded adapters alive, and the stack of a freed adapter is dropped
+        # with it, so a new adapter allocated at the same address never picks up its weights
+        refs = tuple(weakref.ref(model, functools.partial(self._drop, key)) for model in models)
+        self.stacks[key] = (refs, params, buffers, meta)
+        while len(self.stacks) > self.max_stacks:
+            self.stacks.popitem(last=False)
+        return params, buffers, meta
+
+    def _run_group(self, inputs, models):
+        if len(models) == 1 or not self.batched:
+            return [model(input) for input, model in zip(inputs, models)]
+        params, buffers, meta = self._stack(models)
+
+        def forward(p, b, x):
+            return functional_call(meta, (p, b), (x,))
+
+        features = torch.vmap(forward)(params, buffers, torch.stack(inputs))
+        return [[level[i] for level in features] for i in range(len(models))]
+
+    def __call__(self, inputs, adapters):
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+            adapters = [adapters]
+        sizes = [tuple(input.shape[-2:]) for input in inputs]
+        if len(set(sizes)) > 1:
+            raise ValueError(f'the pyramids of all adapters are summed, their inputs need the same size, got {sizes}')
+
+        groups = OrderedDict()
+        for i, (input, adapter) in enumerate(zip(inputs, adapters)):
+            key = self.group_key(input, adapter['model'])
+            groups.setdefault(i if key is None else key, []).append(i)
+
+        pyramids = [None] * len(adapters)
+        for indices in groups.values():
+            features = self._run_group([inputs[i] for i in indices], [adapters[i]['model'] for i in indices])
+            for i, feature in zip(indices, features):
+                pyramids[i] = feature
+
+        fused = None
+        for pyramid, adapter in zip(pyramids, adapters):
+            if fused is None:
+                fused = [level * adapter['cond_weight'] for level in pyramid]
+            else:
+                fused = [acc.add_(level, alpha=adapter['cond_weight']) for acc, level in zip(fused, pyramid)]
+        return fused
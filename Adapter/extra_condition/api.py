@@ -23,11 +23,9 @@ class ExtraCondition(Enum):
 
 def get_cond_model(opt, cond_type: ExtraCondition):
     if cond_type == ExtraCondition.sketch:
-        from Adapter.extra_condition.model_edge import pidinet
-        model = pidinet()
-        # ckp = torch.load('checkpoints/table5_pidinet.pth', map_location='cpu')['state_dict']
-        ckp = torch.load('/mnt/nfs/file_server/public/mingjiahui/models/T2IAdapter/table5_pidinet.pth', map_location='cpu')['state_dict']
-        model.load_state_dict({k.replace('module.', ''): v for k, v in ckp.items()}, strict=True)
+        from Adapter.extra_condition.model_edge import load_pidinet
+        # model = load_pidinet('checkpoints/table5_pidinet.pth')
+        model = load_pidinet('/mnt/nfs/file_server/public/mingjiahui/models/T2IAdapter/table5_pidinet.pth')
         model.to(opt.device)
         return model
     elif cond_type == ExtraCondition.seg:
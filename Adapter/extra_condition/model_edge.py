@@ -635,11 +635,80 @@ def config_model(model):
 
     return pdcs
 
-def pidinet():
-    pdcs = config_model('carv4')
+def config_model_converted(model):
+    model_options = list(nets.keys())
+    assert model in model_options, \
+        'unrecognized model, please choose from %s' % str(model_options)
+
+    pdcs = []
+    for i in range(16):
+        layer_name = 'layer%d' % i
+        op = nets[model][layer_name]
+        pdcs.append(op)
+
+    return pdcs
+
+def convert_pdc(op, weight):
+    """
+    fold a pixel difference conv weight into the vanilla conv weight with the same output:
+    cd and ad => 3x3, rd => 5x5 (the 3x3 rd taps spread over a 5x5 ring)
+    """
+    if op == 'cv':
+        return weight
+    shape = weight.shape
+    weight = weight.reshape(shape[0], shape[1], -1)
+    if op == 'cd':
+        weight = weight.clone()
+        weight[:, :, 4] = weight[:, :, 4] - weight.sum(dim=2)
+        return weight.view(shape)
+    elif op == 'ad':
+        return (weight - weight[:, :, [3, 0, 1, 6, 4, 2, 7, 8, 5]]).view(shape) # clock-wise
+    elif op == 'rd':
+        buffer = weight.new_zeros(shape[0], shape[1], 5 * 5)
+        buffer[:, :, [0, 2, 4, 10, 14, 20, 22, 24]] = weight[:, :, 1:]
+        buffer[:, :, [6, 7, 8, 11, 13, 16, 17, 18]] = -weight[:, :, 1:]
+        return buffer.view(shape[0], shape[1], 5, 5)
+    raise ValueError('unknown op type: %s' % str(op))
+
+def pdc_layer_index(pname):
+    """index into the `nets` config of the pdc conv a PiDiNet parameter belongs to, None for the other parameters"""
+    if pname == 'init_block.weight':
+        return 0
+    stage_offsets = {'1': 0, '2': 3, '3': 7, '4': 11}
+    parts = pname.split('.')
+    if len(parts) == 3 and parts[0].startswith('block') and parts[1:] == ['conv1', 'weight']:
+        stage, block = parts[0][len('block'):].split('_')
+        return stage_offsets[stage] + int(block)
+    return None
+
+def convert_pidinet(state_dict, config='carv4'):
+    """state dict of PiDiNet with pdc convs => state dict of PiDiNet(convert=True) with the same outputs"""
+    pdcs = config_model_converted(config)
+    new_dict = {}
+    for pname, p in state_dict.items():
+        pname = pname.replace('module.', '')
+        layer = pdc_layer_index(pname)
+        new_dict[pname] = p if layer is None else convert_pdc(pdcs[layer], p)
+    return new_dict
+
+def pidinet(convert=False):
     dil = 24 #if args.dil else None
+    if convert:
+        # vanilla convs only, load weights converted by `convert_pidinet`
+        return PiDiNet(60, config_model_converted('carv4'), dil=dil, sa=True, convert=True)
+    pdcs = config_model('carv4')
     return PiDiNet(60, pdcs, dil=dil, sa=True)
 
+def load_pidinet(ckpt_path, convert=True):
+    """pidinet from a table5_pidinet.pth style checkpoint, by default converted to the faster vanilla conv form"""
+    ckp = torch.load(ckpt_path, map_location='cpu')['state_dict']
+    state_dict = {k.replace('module.', ''): v for k, v in ckp.items()}
+    if convert:
+        state_dict = convert_pidinet(state_dict)
+    model = pidinet(convert=convert)
+    model.load_state_dict(state_dict, strict=True)
+    return model.eval()
+
 
 if __name__ == '__main__':
     model = pidinet()
@@ -5,12 +5,138 @@ import matplotlib.pyplot as plt
 import numpy as np
 import time
 import torch
-from scipy.ndimage.filters import gaussian_filter
+import torch.nn.functional as F
+from scipy.ndimage import gaussian_filter
 from torchvision import transforms
 
 from . import util
 from .model import bodypose_model
 
+# find connection in the specified sequence, center 29 is in the position 15
+limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
+           [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
+           [1, 16], [16, 18], [3, 17], [6, 18]]
+# the middle joints heatmap correpondence
+mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
+          [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
+          [55, 56], [37, 38], [45, 46]]
+
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    """the taps of scipy.ndimage.gaussian_filter"""
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    phi_x = np.exp(-0.5 / (sigma * sigma) * x ** 2)
+    return phi_x / phi_x.sum()
+
+
+def reflect_indices(n, radius):
+    """indices padding an axis of length n by `radius` in scipy's 'reflect' mode (d c b a | a b c d | d c b a)"""
+    idx = np.arange(-radius, n + radius) % (2 * n)
+    return torch.from_numpy(np.where(idx >= n, 2 * n - 1 - idx, idx))
+
+
+def gaussian_blur(maps, sigma=3):
+    """scipy.ndimage.gaussian_filter of every channel of a (C, H, W) tensor, as two depthwise 1d convs"""
+    C, H, W = maps.shape
+    kernel = torch.from_numpy(gaussian_kernel1d(sigma)).to(maps)
+    radius = (kernel.numel() - 1) // 2
+    x = maps[:, reflect_indices(H, radius)].unsqueeze(0)
+    x = F.conv2d(x, kernel.view(1, 1, -1, 1).expand(C, 1, -1, 1), groups=C)
+    x = x[:, :, :, reflect_indices(W, radius)]
+    x = F.conv2d(x, kernel.view(1, 1, 1, -1).expand(C, 1, 1, -1), groups=C)
+    return x[0]
+
+
+def find_peaks(heatmap_avg, thre1, sigma=3, device=None):
+    """
+    Keypoint candidates of the 18 parts: local maxima (>= their 4 neighbours) of the blurred heatmaps above `thre1`.
+    All parts are blurred and suppressed at once: with a torch `device` (the gpu) the blur is `gaussian_blur` and the
+    suppression a max-pool over a vertical and a horizontal 3-window, without (None) a single scipy filter over the
+    stacked maps and shifted comparisons, which is faster on cpu. Returns per part a list of (x, y, score, id), in
+    row-major order with consecutive ids.
+    """
+    if device is None:
+        # sigma 0 leaves the part axis alone, same values as filtering every map by itself
+        one_heatmap = gaussian_filter(heatmap_avg[:, :, :18], sigma=(sigma, sigma, 0)).transpose(2, 0, 1)
+        peaks_binary = one_heatmap > thre1
+        peaks_binary[:, 1:] &= one_heatmap[:, 1:] >= one_heatmap[:, :-1]
+        peaks_binary[:, :-1] &= one_heatmap[:, :-1] >= one_heatmap[:, 1:]
+        peaks_binary[:, :, 1:] &= one_heatmap[:, :, 1:] >= one_heatmap[:, :, :-1]
+        peaks_binary[:, :, :-1] &= one_heatmap[:, :, :-1] >= one_heatmap[:, :, 1:]
+        parts, ys, xs = np.nonzero(peaks_binary)
+    else:
+        maps = torch.from_numpy(np.ascontiguousarray(heatmap_avg[:, :, :18].transpose(2, 0, 1))).to(device)
+        one_heatmap = gaussian_blur(maps, sigma).unsqueeze(0)
+        map_v = F.max_pool2d(one_heatmap, (3, 1), stride=1, padding=(1, 0))
+        map_h = F.max_pool2d(one_heatmap, (1, 3), stride=1, padding=(0, 1))
+        peaks_binary = (one_heatmap >= map_v) & (one_heatmap >= map_h) & (one_heatmap > thre1)
+        parts, ys, xs = [t.cpu().numpy() for t in peaks_binary[0].nonzero(as_tuple=True)]
+    scores = heatmap_avg[ys, xs, parts]
+
+    all_peaks = [[] for _ in range(18)]
+    for peak_id, (part, x, y, score) in enumerate(zip(parts, xs, ys, scores)):
+        all_peaks[part].append((x, y, score, peak_id))
+    return all_peaks
+
+
+def score_limbs(all_peaks, paf_avg, image_height, thre2, mid_num=10):
+    """
+    Score every (candA, candB) pair of every limb by the line integral of its PAF, sampled at `mid_num` points,
+    for all pairs of a limb at once, and greedily keep the best non-conflicting connections.
+    Returns connection_all (per limb a (n, 5) array of idA, idB, score, i, j) and special_k (limbs without pairs).
+    """
+    connection_all = []
+    special_k = []
+
+    for k in range(len(mapIdx)):
+        paf_x, paf_y = [x - 19 for x in mapIdx[k]]
+        candA = all_peaks[limbSeq[k][0] - 1]
+        candB = all_peaks[limbSeq[k][1] - 1]
+        nA = len(candA)
+        nB = len(candB)
+        if (nA == 0 or nB == 0):
+            special_k.append(k)
+            connection_all.append([])
+            continue
+
+        start = np.array([c[:2] for c in candA], dtype=np.float64)[:, None, :]     # nA x 1 x 2, (x, y)
+        end = np.array([c[:2] for c in candB], dtype=np.float64)[None, :, :]       # 1 x nB x 2
+        vec = end - start
+        norm = np.maximum(np.sqrt(vec[..., 0] * vec[..., 0] + vec[..., 1] * vec[..., 1]), 0.001)
+        vec = vec / norm[..., None]
+
+        # np.linspace(start, end, num=mid_num) of every pair, rounded to pixels: nA x nB x mid_num x 2
+        steps = np.arange(mid_num, dtype=np.float64)[:, None]
+        startend = steps * ((end - start) / (mid_num - 1))[:, :, None, :] + start[:, :, None, :]
+        startend[:, :, -1] = np.broadcast_to(end, vec.shape)
+        startend = np.rint(startend).astype(int)
+
+        ys, xs = startend[..., 1], startend[..., 0]                                  # nA x nB x mid_num
+        score_midpts = paf_avg[ys, xs, paf_x] * vec[..., 0:1] + paf_avg[ys, xs, paf_y] * vec[..., 1:2]
+        score_sum = np.zeros(norm.shape)
+        for I in range(mid_num):     # summed in sample order
+            score_sum = score_sum + score_midpts[..., I]
+        score_with_dist_prior = score_sum / mid_num + np.minimum(0.5 * image_height / norm - 1, 0)
+        criterion1 = np.count_nonzero(score_midpts > thre2, axis=-1) > 0.8 * mid_num
+        criterion2 = score_with_dist_prior > 0
+
+        candidate_i, candidate_j = np.nonzero(criterion1 & criterion2)
+        candidate_score = score_with_dist_prior[candidate_i, candidate_j]
+        connection = []
+        used_i, used_j = set(), set()
+        for c in np.argsort(-candidate_score, kind='stable'):
+            i, j = int(candidate_i[c]), int(candidate_j[c])
+            if i not in used_i and j not in used_j:
+                connection.append([candA[i][3], candB[j][3], candidate_score[c], i, j])
+                used_i.add(i)
+                used_j.add(j)
+                if (len(connection) >= min(nA, nB)):
+                    break
+        connection_all.append(np.array(connection, dtype=np.float64).reshape(-1, 5))
+
+    return connection_all, special_k
+
 
 class Body(object):
 
@@ -67,91 +193,8 @@ class Body(object):
             heatmap_avg += heatmap_avg + heatmap / len(multiplier)
             paf_avg += +paf / len(multiplier)
 
-        all_peaks = []
-        peak_counter = 0
-
-        for part in range(18):
-            map_ori = heatmap_avg[:, :, part]
-            one_heatmap = gaussian_filter(map_ori, sigma=3)
-
-            map_left = np.zeros(one_heatmap.shape)
-            map_left[1:, :] = one_heatmap[:-1, :]
-            map_right = np.zeros(one_heatmap.shape)
-            map_right[:-1, :] = one_heatmap[1:, :]
-            map_up = np.zeros(one_heatmap.shape)
-            map_up[:, 1:] = one_heatmap[:, :-1]
-            map_down = np.zeros(one_heatmap.shape)
-            map_down[:, :-1] = one_heatmap[:, 1:]
-
-            peaks_binary = np.logical_and.reduce((one_heatmap >= map_left, one_heatmap >= map_right,
-                                                  one_heatmap >= map_up, one_heatmap >= map_down, one_heatmap > thre1))
-            peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
-            peaks_with_score = [x + (map_ori[x[1], x[0]], ) for x in peaks]
-            peak_id = range(peak_counter, peak_counter + len(peaks))
-            peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i], ) for i in range(len(peak_id))]
-
-            all_peaks.append(peaks_with_score_and_id)
-            peak_counter += len(peaks)
-
-        # find connection in the specified sequence, center 29 is in the position 15
-        limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
-                   [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
-                   [1, 16], [16, 18], [3, 17], [6, 18]]
-        # the middle joints heatmap correpondence
-        mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
-                  [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
-                  [55, 56], [37, 38], [45, 46]]
-
-        connection_all = []
-        special_k = []
-        mid_num = 10
-
-        for k in range(len(mapIdx)):
-            score_mid = paf_avg[:, :, [x - 19 for x in mapIdx[k]]]
-            candA = all_peaks[limbSeq[k][0] - 1]
-            candB = all_peaks[limbSeq[k][1] - 1]
-            nA = len(candA)
-            nB = len(candB)
-            indexA, indexB = limbSeq[k]
-            if (nA != 0 and nB != 0):
-                connection_candidate = []
-                for i in range(nA):
-                    for j in range(nB):
-                        vec = np.subtract(candB[j][:2], candA[i][:2])
-                        norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1])
-                        norm = max(0.001, norm)
-                        vec = np.divide(vec, norm)
-
-                        startend = list(zip(np.linspace(candA[i][0], candB[j][0], num=mid_num), \
-                                            np.linspace(candA[i][1], candB[j][1], num=mid_num)))
-
-                        vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0] \
-                                          for I in range(len(startend))])
-                        vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1] \
-                                          for I in range(len(startend))])
-
-                        score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
-                        score_with_dist_prior = sum(score_midpts) / len(score_midpts) + min(
-                            0.5 * oriImg.shape[0] / norm - 1, 0)
-                        criterion1 = len(np.nonzero(score_midpts > thre2)[0]) > 0.8 * len(score_midpts)
-                        criterion2 = score_with_dist_prior > 0
-                        if criterion1 and criterion2:
-                            connection_candidate.append(
-                                [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
-
-                connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
-                connection = np.zeros((0, 5))
-                for c in range(len(connection_candidate)):
-                    i, j, s = connection_candidate[c][0:3]
-                    if (i not in connection[:, 3] and j not in connection[:, 4]):
-                        connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
-                        if (len(connection) >= min(nA, nB)):
-                            break
-
-                connection_all.append(connection)
-            else:
-                special_k.append(k)
-                connection_all.append([])
+        all_peaks = find_peaks(heatmap_avg, thre1, device='cuda' if torch.cuda.is_available() else None)
+        connection_all, special_k = score_limbs(all_peaks, paf_avg, oriImg.shape[0], thre2)
 
         # last number in each row is the total parts number of that person
         # the second last number in each row is the score of the overall configuration
@@ -2,6 +2,9 @@ import argparse
 import torch
 from omegaconf import OmegaConf
 
+from Adapter.models.adapter_export import EXPORT_BACKENDS
+from Adapter.schedulers import SCHEDULERS
+
 # DEFAULT_NEGATIVE_PROMPT = 'worst quality, normal quality, low quality, low res, blurry, text, watermark, logo, banner, ' \
 #                  'extra digits, cropped, jpeg artifacts, signature, username, error, sketch ,duplicate, ugly, '
 # DEFAULT_NEGATIVE_PROMPT = 'extra digit, fewer digits, cropped, worst quality, low quality'
@@ -49,16 +52,33 @@ def get_base_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         '--sampler',
         type=str,
-        default='ddim',
-        choices=['ddim', 'plms'],
-        help='sampling algorithm, currently, only ddim and plms are supported, more are on the way',
+        default='ddpm',
+        choices=list(SCHEDULERS),
+        help='sampling algorithm, see Adapter.schedulers.SCHEDULERS',
     )
 
     parser.add_argument(
         '--steps',
         type=int,
-        default=50,
-        help='number of sampling steps',
+        default=None,
+        help='number of sampling steps, by default the preset of the sampler (Adapter.schedulers.STEP_PRESETS)',
+    )
+
+    parser.add_argument(
+        '--adapter_export',
+        type=str,
+        default=None,
+        choices=EXPORT_BACKENDS,
+        help='run the adapter through its inference export (Adapter.models.adapter_export) with this backend',
+    )
+
+    parser.add_argument(
+        '--guidance_interval',
+        type=float,
+        nargs=2,
+        default=(0., 1.),
+        help='start and end fraction of the steps with classifier-free guidance, the other steps only run the '
+        'conditional branch at half the UNet cost',
     )
 
     parser.add_argument(
@@ -107,9 +127,11 @@ def get_base_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         '--cond_weight',
         type=float,
-        default=1.0,
+        nargs='+',
+        default=[1.0],
         help='the adapter features are multiplied by the cond_weight. The larger the cond_weight, the more aligned '
-        'the generated image and condition will be, but the generated quality may be reduced',
+        'the generated image and condition will be, but the generated quality may be reduced. One value per adapter '
+        'when several are composed',
     )
 
     parser.add_argument(
@@ -125,5 +147,42 @@ def get_base_argument_parser() -> argparse.ArgumentParser:
         help='# of samples to generate',
     )
 
+    parser.add_argument(
+        '--placement',
+        type=str,
+        default='encoder_offload',
+        choices=['all_on_device', 'encoder_offload', 'sequential_offload'],
+        help='where the SDXL text encoders, UNet and VAE live: all on the GPU, text encoders on the CPU, or only the '
+        'component in use on the GPU',
+    )
+
+    parser.add_argument(
+        '--memory_budget_gb',
+        type=float,
+        default=None,
+        help='GPU memory budget for the SDXL components, least recently used ones are offloaded beyond it',
+    )
+
+    parser.add_argument(
+        '--vae_tile_size',
+        type=int,
+        default=None,
+        help='decode images larger than this many pixels per side in overlapping VAE tiles to bound the peak memory',
+    )
+
+    parser.add_argument(
+        '--dtype',
+        type=str,
+        default='fp32',
+        choices=['fp32', 'fp16', 'bf16'],
+        help='precision of the SDXL UNet, text encoders and adapter',
+    )
+
+    parser.add_argument(
+        '--no_vae_upcast',
+        action='store_true',
+        help='run the VAE in --dtype too instead of fp32 (the original SDXL VAE overflows in fp16)',
+    )
+
     return parser
 
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+import torch
+from omegaconf import OmegaConf
+
+from Adapter.extra_condition.api import ExtraCondition, get_cond_model
+from Adapter.models.adapter_export import export_adapter_xl
+from configs.utils import instantiate_from_config
+
+
+def model_nbytes(model):
+    """bytes held by the parameters and buffers of a module, a dict of modules, or None"""
+    if model is None:
+        return 0
+    if isinstance(model, dict):
+        return sum(model_nbytes(m) for m in model.values())
+    if isinstance(model, torch.nn.Module):
+        return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    return 0
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of the adapters and condition models used by app.py. Every model is loaded once on first use
+    and kept resident. With `vram_budget` (bytes) set, the least recently used models are evicted before a new one
+    would exceed the budget; a request still holding an evicted model keeps it alive until it returns. Adapters are
+    cast to `dtype` and, with `adapter_export` set, served through `export_adapter_xl` with that backend; the
+    condition models keep their own precision.
+    """
+
+    def __init__(self, opt, vram_budget=None, config_pattern='configs/inference/Adapter-XL-{}.yaml',
+                 dtype=torch.float32, adapter_export=None):
+        self.opt = opt
+        self.vram_budget = vram_budget
+        self.dtype = dtype
+        self.adapter_export = adapter_export
+        self.config_pattern = config_pattern
+        self.lock = threading.RLock()
+        self.models = OrderedDict()     # key => (model, nbytes), most recently used last
+
+    def _get(self, key, loader):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key][0]
+
+            model = loader()
+            nbytes = model_nbytes(model)
+            self._evict(nbytes)
+            self.models[key] = (model, nbytes)
+            print(f'[registry] loaded {key}: {nbytes / 2**20:.0f} MiB, '
+                  f'resident {self.resident_bytes() / 2**20:.0f} MiB')
+            return model
+
+    def _evict(self, incoming):
+        if self.vram_budget is None:
+            return
+        evicted = False
+        while self.models and self.resident_bytes() + incoming > self.vram_budget:
+            key, _ = self.models.popitem(last=False)
+            print(f'[registry] evicted {key}')
+            evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def resident_bytes(self):
+        return sum(nbytes for _, nbytes in self.models.values())
+
+    def _load_adapter(self, cond_name):
+        adapter_config = OmegaConf.load(self.config_pattern.format(cond_name)).model.params.adapter_config
+        adapter = instantiate_from_config(adapter_config)
+        adapter.load_state_dict(torch.load(adapter_config.pretrained, map_location='cpu'))
+        adapter = adapter.to(self.opt.device, dtype=self.dtype).eval()
+        if self.adapter_export is not None:
+            adapter = export_adapter_xl(adapter, backend=self.adapter_export)
+        return adapter
+
+    def get_adapter(self, cond_name):
+        return self._get(('adapter', cond_name), lambda: self._load_adapter(cond_name))
+
+    def get_cond_model(self, cond_name):
+        return self._get(
+            ('cond_model', cond_name), lambda: get_cond_model(self.opt, getattr(ExtraCondition, cond_name)))
+
+    def preload(self, cond_names):
+        for cond_name in cond_names:
+            self.get_cond_model(cond_name)
+            self.get_adapter(cond_name)
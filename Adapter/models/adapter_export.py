@@ -0,0 +1,105 @@
+import copy
+from typing import List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from Adapter.models.adapters import Adapter_XL, ResnetBlock
+
+
+EXPORT_BACKENDS = ('eager', 'script', 'compile')
+
+
+class ExportedResnetBlock(nn.Module):
+    """
+    Inference-only `ResnetBlock`. A 1x1 `in_conv` in front of the 3x3 `block1` (ksize=1, the shipped configs) is folded
+    into `block1`, which then runs on the narrower input. `in_conv` still produces the residual branch. The folded
+    conv sees the zero padding of the block input instead of `in_conv` of it, i.e. misses the `in_conv` bias on the
+    taps that fall into the padding; `tap_bias` adds the bias of the valid taps back, exactly.
+    """
+
+    def __init__(self, block: ResnetBlock):
+        super().__init__()
+        self.down_opt = block.down_opt if block.down else nn.Identity()
+        self.in_conv = block.in_conv if block.in_conv is not None else nn.Identity()
+        self.skep = block.skep if block.skep is not None else nn.Identity()
+        self.act = nn.ReLU(inplace=True)
+        self.block2 = block.block2
+
+        block1 = block.block1
+        in_conv = block.in_conv
+        self.fold = in_conv is not None and in_conv.kernel_size == (1, 1) and block1.padding == (1, 1)
+        if self.fold:
+            with torch.no_grad():
+                w_in = in_conv.weight[:, :, 0, 0]
+                self.block1 = nn.Conv2d(in_conv.in_channels, block1.out_channels, 3, 1, 1).to(block1.weight)
+                self.block1.weight.copy_(torch.einsum('omyx,mc->ocyx', block1.weight, w_in))
+                self.block1.bias.copy_(block1.bias)
+                tap_bias = torch.einsum('omyx,m->oyx', block1.weight, in_conv.bias).unsqueeze(1)
+        else:
+            self.block1 = block1
+            tap_bias = block1.weight.new_zeros(block1.out_channels, 1, 3, 3)
+        self.register_buffer('tap_bias', tap_bias, persistent=False)
+
+    def forward(self, x):
+        x = self.down_opt(x)
+        if self.fold:
+            valid = x.new_ones((1, 1, x.shape[-2], x.shape[-1]))
+            h = self.block1(x) + F.conv2d(valid, self.tap_bias, padding=1)
+            x = self.in_conv(x)
+        else:
+            x = self.in_conv(x)
+            h = self.block1(x)
+        h = self.block2(self.act(h))
+        return h + self.skep(x)
+
+
+class ExportedAdapterXL(nn.Module):
+    """
+    `Adapter_XL` with folded blocks and an optional channels_last body, returns the same features. Built from a copy of
+    `adapter`, which is left as is (same weights, memory format and requires_grad).
+    """
+
+    def __init__(self, adapter: Adapter_XL, channels_last=True):
+        super().__init__()
+        adapter = copy.deepcopy(adapter)
+        self.unshuffle = adapter.unshuffle
+        self.conv_in = adapter.conv_in
+        self.body = nn.ModuleList([ExportedResnetBlock(block) for block in adapter.body])
+        self.nums_rb = adapter.nums_rb
+        self.channels_last = channels_last
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    def forward(self, x) -> List[torch.Tensor]:
+        x = self.unshuffle(x)
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = self.conv_in(x)
+        features: List[torch.Tensor] = []
+        for i, block in enumerate(self.body):
+            x = block(x)
+            if (i + 1) % self.nums_rb == 0:
+                # the UNet runs contiguous (NCHW) activations
+                features.append(x.contiguous())
+        return features
+
+
+def export_adapter_xl(adapter, backend='script', channels_last=True):
+    """
+    Inference-optimized copy of a loaded `Adapter_XL`, see `ExportedAdapterXL`; `adapter` itself is not modified.
+    backend:
+        eager    the folded module as is
+        script   TorchScript, frozen (constants inlined, conv + relu fusion where the backend supports it)
+        compile  torch.compile, compiled on the first call for every new input shape
+    """
+    assert backend in EXPORT_BACKENDS, backend
+    model = ExportedAdapterXL(adapter, channels_last=channels_last).eval()
+    for p in model.parameters():
+        p.requires_grad_(False)
+    if backend == 'script':
+        model = torch.jit.freeze(torch.jit.script(model))
+    elif backend == 'compile':
+        model = torch.compile(model)
+    return model
@@ -0,0 +1,145 @@
+import contextlib
+import time
+from collections import OrderedDict
+
+import torch
+
+
+PLACEMENT_MODES = ('all_on_device', 'encoder_offload', 'sequential_offload')
+
+
+def same_device(a, b):
+    return a.type == b.type and (a.index is None or b.index is None or a.index == b.index)
+
+
+def module_nbytes(modules):
+    return sum(t.numel() * t.element_size() for m in modules for t in list(m.parameters()) + list(m.buffers()))
+
+
+class PlacementPolicy:
+    """
+    Decides where the SDXL components (text encoders, UNet, VAE) live and moves them on demand.
+
+    mode:
+        all_on_device       everything is moved to `device` once and stays there (fast path)
+        encoder_offload     UNet and VAE stay on `device`, the text encoders only visit it while encoding
+        sequential_offload  only the component in use is on `device`, for small-VRAM hosts
+    memory_budget: optional bytes; before a component is moved in, the least recently used components that are not
+        in use are offloaded until the resident ones fit.
+
+    Every module's `.to()` is timed on its own (synchronized), `report()` prints the measured load (to `device`) and
+    offload times per component and module, and the total load time of the mode.
+    """
+
+    def __init__(self, mode='all_on_device', device='cuda', offload_device='cpu', memory_budget=None, verbose=False):
+        assert mode in PLACEMENT_MODES, mode
+        self.mode = mode
+        self.device = torch.device(device)
+        self.offload_device = torch.device(offload_device)
+        self.memory_budget = memory_budget
+        self.verbose = verbose
+        self.components = OrderedDict()    # name => list of modules, most recently used last
+        self.on_device = set()
+        self.in_use = set()
+        self.transfers = {}                 # name => {'load' / 'offload': [count, seconds]}
+        self.module_loads = {}              # name => per module [count, seconds] of its loads
+
+    def pinned(self, name):
+        if self.mode == 'all_on_device':
+            return True
+        if self.mode == 'encoder_offload':
+            return not name.startswith('text_encoder')
+        return False
+
+    def register(self, name, modules):
+        modules = modules if isinstance(modules, (list, tuple)) else [modules]
+        self.components[name] = list(modules)
+        self.transfers[name] = {'load': [0, 0.], 'offload': [0, 0.]}
+        self.module_loads[name] = [[0, 0.] for _ in modules]
+        if self.pinned(name):
+            self._move(name, self.device)
+        else:
+            self._move(name, self.offload_device)
+
+    def _sync(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def _move(self, name, device):
+        modules = self.components[name]
+        if all(same_device(t.device, device) for m in modules for t in m.parameters()):
+            if device == self.device:
+                self.on_device.add(name)
+            return
+        loading = same_device(device, self.device)
+        seconds = 0.
+        self._sync()
+        for m, stats in zip(modules, self.module_loads[name]):
+            start = time.perf_counter()
+            m.to(device)
+            self._sync()
+            elapsed = time.perf_counter() - start
+            seconds += elapsed
+            if loading:
+                stats[0] += 1
+                stats[1] += elapsed
+        transfers = self.transfers[name]['load' if loading else 'offload']
+        transfers[0] += 1
+        transfers[1] += seconds
+        if loading:
+            self.on_device.add(name)
+        else:
+            self.on_device.discard(name)
+        if self.verbose:
+            print(f'[placement] {name} => {device}: {module_nbytes(modules) / 2**30:.2f} GiB in {seconds:.2f} s')
+
+    def resident_bytes(self):
+        return sum(module_nbytes(self.components[name]) for name in self.on_device)
+
+    def _make_room(self, name):
+        if self.mode == 'sequential_offload':
+            for other in list(self.on_device):
+                if other != name and other not in self.in_use:
+                    self._move(other, self.offload_device)
+        if self.memory_budget is None:
+            return
+        incoming = module_nbytes(self.components[name])
+        for other in list(self.components):
+            if self.resident_bytes() + incoming <= self.memory_budget:
+                break
+            if other != name and other in self.on_device and other not in self.in_use:
+                self._move(other, self.offload_device)
+
+    @contextlib.contextmanager
+    def use(self, name):
+        """make sure `name` is on the device while the block runs"""
+        self.components.move_to_end(name)
+        if name not in self.on_device:
+            self._make_room(name)
+            self._move(name, self.device)
+        self.in_use.add(name)
+        try:
+            yield
+        finally:
+            self.in_use.discard(name)
+            if self.mode == 'encoder_offload' and not self.pinned(name):
+                self._move(name, self.offload_device)
+
+    def report(self):
+        load_seconds = sum(transfers['load'][1] for transfers in self.transfers.values())
+        offload_seconds = sum(transfers['offload'][1] for transfers in self.transfers.values())
+        lines = [f'[placement] mode {self.mode}, resident {self.resident_bytes() / 2**30:.2f} GiB, '
+                 f'load time {load_seconds:.2f} s, offload time {offload_seconds:.2f} s']
+        for name, transfers in self.transfers.items():
+            modules = self.components[name]
+            size = module_nbytes(modules) / 2**30
+            where = self.device if name in self.on_device else self.offload_device
+            (loads, load_s), (offloads, offload_s) = transfers['load'], transfers['offload']
+            lines.append(f'  {name}: {size:.2f} GiB on {where}, {loads} loads {load_s:.2f} s'
+                         f'{f" ({size * loads / load_s:.1f} GiB/s)" if load_s > 0 else ""}, '
+                         f'{offloads} offloads {offload_s:.2f} s')
+            if len(modules) > 1:
+                for m, (count, seconds) in zip(modules, self.module_loads[name]):
+                    lines.append(f'    {type(m).__name__}: {module_nbytes([m]) / 2**30:.2f} GiB, '
+                                 f'{count} loads {seconds:.2f} s')
+        print('\n'.join(lines))
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+NULL_PROMPT = ''
+
+
+class PromptEmbeddingCache:
+    """
+    Bounded LRU cache of the SDXL text encoder outputs, one (prompt_embeds, pooled_prompt_embeds) pair per caption,
+    kept on the device the encoders produced them on. Keys are (tokenizer, encoder id, encoder dtype) of both
+    encoders plus the caption, so reloading or casting an encoder never serves stale embeds. The null prompt used
+    as negative prompt and for classifier-free guidance is pinned outside the LRU once computed.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def encoder_key(tokenizers, text_encoders):
+        return tuple(
+            (tokenizer.name_or_path, id(text_encoder), text_encoder.dtype)
+            for tokenizer, text_encoder in zip(tokenizers, text_encoders)
+        )
+
+    def _get(self, key):
+        if key in self.pinned:
+            return self.pinned[key]
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def _put(self, key, value):
+        if key[1] == NULL_PROMPT:
+            self.pinned[key] = value
+            return
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def encode(self, tokenizers, text_encoders, captions, encode_fn):
+        """
+        Return the embeds of `captions` like `encode_fn(captions)` would, encoding only the captions that are not
+        cached (each distinct one once).
+        """
+        encoder_key = self.encoder_key(tokenizers, text_encoders)
+        with self.lock:
+            results = [self._get((encoder_key, caption)) for caption in captions]
+            num_hits = sum(result is not None for result in results)
+            self.hits += num_hits
+            self.misses += len(captions) - num_hits
+        missing = list(dict.fromkeys(caption for caption, result in zip(captions, results) if result is None))
+
+        if missing:
+            prompt_embeds, pooled_prompt_embeds = encode_fn(missing)
+            encoded = {
+                caption: (prompt_embeds[i:i + 1].clone(), pooled_prompt_embeds[i:i + 1].clone())
+                for i, caption in enumerate(missing)
+            }
+            with self.lock:
+                for caption, value in encoded.items():
+                    self._put((encoder_key, caption), value)
+            results = [encoded[caption] if result is None else result for caption, result in zip(captions, results)]
+
+        return torch.cat([r[0] for r in results]), torch.cat([r[1] for r in results])
+
+    def warmup(self, tokenizers, text_encoders, encode_fn):
+        """precompute the null prompt"""
+        self.encode(tokenizers, text_encoders, [NULL_PROMPT], encode_fn)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'pinned': len(self.pinned)}
@@ -0,0 +1,50 @@
+import inspect
+
+from diffusers import (
+    DDIMScheduler,
+    DDPMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    UniPCMultistepScheduler,
+)
+
+
+# name => (scheduler class, config overrides), all built from the scheduler config of the SDXL checkpoint
+SCHEDULERS = {
+    'ddpm': (DDPMScheduler, {}),
+    'ddim': (DDIMScheduler, {}),
+    'unipc': (UniPCMultistepScheduler, {}),
+    'dpm++2m': (DPMSolverMultistepScheduler, {'algorithm_type': 'dpmsolver++', 'solver_order': 2}),
+    'dpm++2m_karras': (
+        DPMSolverMultistepScheduler, {'algorithm_type': 'dpmsolver++', 'solver_order': 2, 'use_karras_sigmas': True}),
+    'euler_a': (EulerAncestralDiscreteScheduler, {}),
+}
+
+# step counts at which each scheduler reaches about the quality of 50 DDPM steps
+STEP_PRESETS = {
+    'ddpm': 50,
+    'ddim': 50,
+    'unipc': 20,
+    'dpm++2m': 25,
+    'dpm++2m_karras': 20,
+    'euler_a': 30,
+}
+
+
+def build_scheduler(name, config):
+    """`config`: the scheduler config of the checkpoint, e.g. `DDPMScheduler.load_config(model_id, subfolder=...)`"""
+    if name not in SCHEDULERS:
+        raise ValueError(f'unknown scheduler {name}, choose from {list(SCHEDULERS)}')
+    scheduler_cls, overrides = SCHEDULERS[name]
+    return scheduler_cls.from_config(config, **overrides)
+
+
+def resolve_steps(name, steps=None):
+    return STEP_PRESETS[name] if steps is None else steps
+
+
+def step_kwargs(scheduler, generator=None):
+    """only the stochastic schedulers take a generator in `step`"""
+    if generator is not None and 'generator' in inspect.signature(scheduler.step).parameters:
+        return {'generator': generator}
+    return {}
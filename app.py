@@ -1,4 +1,3 @@
-import copy
 import gradio as gr
 import torch
 from basicsr.utils import tensor2img
@@ -7,14 +6,13 @@ from huggingface_hub import hf_hub_url
 import subprocess
 import shlex
 import cv2
-from omegaconf import OmegaConf
 
 from demo import create_demo_sketch, create_demo_canny, create_demo_pose
 from Adapter.Sampling import diffusion_inference
-from configs.utils import instantiate_from_config
-from Adapter.extra_condition.api import get_cond_model, ExtraCondition
+from Adapter.batching import BatchingEngine
 from Adapter.extra_condition import api
 from Adapter.inference_base import get_base_argument_parser
+from Adapter.model_registry import ModelRegistry
 
 torch.set_grad_enabled(False)
 
@@ -38,6 +36,24 @@ for repo in urls:
             subprocess.run(shlex.split(f'wget {url} -O {save_path}'))
 
 parser = get_base_argument_parser()
+parser.add_argument(
+    '--model_cache_gb',
+    type=float,
+    default=None,
+    help='VRAM budget for the resident adapters and condition models, least recently used ones are evicted beyond it',
+)
+parser.add_argument(
+    '--max_batch_size',
+    type=int,
+    default=4,
+    help='max number of concurrent requests denoised as one UNet batch',
+)
+parser.add_argument(
+    '--batch_window_ms',
+    type=float,
+    default=50,
+    help='how long the batching engine waits for compatible requests before running a batch',
+)
 global_opt = parser.parse_args()
 global_opt.device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
 
@@ -48,17 +64,31 @@ DESCRIPTION += f'<p>Gradio demo for **T2I-Adapter-XL**: [[GitHub]](https://githu
 # DESCRIPTION += f'<p>For faster inference without waiting in queue, you may duplicate the space and upgrade to GPU in settings. <a href="https://huggingface.co/spaces/Adapter/T2I-Adapter?duplicate=true"><img style="display: inline; margin-top: 0em; margin-bottom: 0em" src="https://bit.ly/3gLdBN6" alt="Duplicate Space" /></a></p>'
 
 # diffusion sampler creation
-sampler = diffusion_inference('stabilityai/stable-diffusion-xl-base-1.0')
+sampler = diffusion_inference(
+    'stabilityai/stable-diffusion-xl-base-1.0',
+    placement=global_opt.placement,
+    memory_budget=None if global_opt.memory_budget_gb is None else int(global_opt.memory_budget_gb * 2**30),
+    vae_tile_size=global_opt.vae_tile_size,
+    dtype=global_opt.dtype,
+    upcast_vae=not global_opt.no_vae_upcast,
+    scheduler=global_opt.sampler,
+)
+engine = BatchingEngine(sampler, max_batch_size=global_opt.max_batch_size, window=global_opt.batch_window_ms / 1000)
+
+# adapters and condition models are loaded once and served warm
+registry = ModelRegistry(
+    global_opt,
+    vram_budget=None if global_opt.model_cache_gb is None else int(global_opt.model_cache_gb * 2**30),
+    dtype=sampler.dtype,
+    adapter_export=global_opt.adapter_export,
+)
+registry.preload(['sketch', 'canny', 'openpose'])
 
 def run(input_image, in_type, prompt, a_prompt, n_prompt, ddim_steps, scale, seed, cond_name, con_strength):
     in_type = in_type.lower()
     prompt = prompt+', '+a_prompt
-    config = OmegaConf.load(f'configs/inference/Adapter-XL-{cond_name}.yaml')
-    # Adapter creation
-    adapter_config = config.model.params.adapter_config
-    adapter = instantiate_from_config(adapter_config).cuda()
-    adapter.load_state_dict(torch.load(config.model.params.adapter_config.pretrained))
-    cond_model = get_cond_model(global_opt, getattr(ExtraCondition, cond_name))
+    adapter = registry.get_adapter(cond_name)
+    cond_model = registry.get_cond_model(cond_name)
     process_cond_module = getattr(api, f'get_cond_{cond_name}')
 
     # diffusion generation
@@ -69,19 +99,18 @@ def run(input_image, in_type, prompt, a_prompt, n_prompt, ddim_steps, scale, see
         cond_model = cond_model
     )
     with torch.no_grad():
-        adapter_features = adapter(cond)
+        adapter_features = adapter(cond.to(sampler.dtype))
 
-        for i in range(len(adapter_features)):
-            adapter_features[i] = adapter_features[i]*con_strength
-
-        result = sampler.inference(
+        result = engine.submit(
             prompt = prompt, 
             prompt_n = n_prompt,
             steps = ddim_steps,
-            adapter_features = copy.deepcopy(adapter_features), 
+            adapter_features = adapter_features, 
             guidance_scale = scale,
             size = (cond.shape[-2], cond.shape[-1]),
             seed= seed,
+            additional_scale = con_strength,
+            guidance_interval = global_opt.guidance_interval,
         )
     im_cond = tensor2img(cond)
 
@@ -97,5 +126,6 @@ with gr.Blocks(css='style.css') as demo:
         with gr.TabItem('Keypoint guided'):
             create_demo_pose(run)
 
-demo.queue(concurrency_count=3, max_size=20)
+# enough concurrent workers to fill a batch, the denoising itself is serialized by the engine
+demo.queue(concurrency_count=max(3, global_opt.max_batch_size), max_size=20)
 demo.launch(server_name="0.0.0.0")
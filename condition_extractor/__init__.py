@@ -1,2 +1,3 @@
 from .depth_multi import process_depth, DPTModel
-from .lineart_multi import process_lineart, LineartDetector
\ No newline at end of file
+from .lineart_multi import process_lineart, LineartDetector
+from .sketch_multi import process_sketch, SketchDetector
\ No newline at end of file
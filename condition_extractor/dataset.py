@@ -18,7 +18,9 @@ class CondExtractorDataset(Dataset):
         return len(self.img_paths)
 
     def __getitem__(self, idx):
-        path = self.img_paths[idx]
+        return self.load(self.img_paths[idx])
+
+    def load(self, path):
         image = Image.open(path)
         if image.mode != 'RGB':
             image = image.convert('RGB')
@@ -30,12 +32,26 @@ class CondExtractorDataset(Dataset):
                 'error': False,
             }
         except OSError as e:
-            info = f"OSError for sample at index {idx}: {e}"
+            info = f"OSError for sample {path}: {e}"
             logging.error(info)
             print(info)
-            print(path)
             return {
                 'data': np.random.randint(0, 256, size=(self.resolution, self.resolution, 3), dtype=np.uint8),
                 'path': path,
                 'error': True,
             }
+
+
+class WorkUnitDataset(CondExtractorDataset):
+    """
+    Indexed by the (index, path) items of `pipeline.UnitBatchSampler` instead of an int, so the paths are not copied
+    into every dataloader worker.
+    """
+    def __init__(self, resolution):
+        super().__init__(None, resolution)
+
+    def __getitem__(self, item):
+        index, path = item
+        sample = self.load(path)
+        sample['index'] = index
+        return sample
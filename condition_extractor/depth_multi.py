@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 from PIL import Image
 import numpy as np
 import argparse
@@ -17,70 +18,124 @@ sys.path.append(os.path.dirname(current_dir))
 
 
 class DPTModel:
-    def __init__(self, ):
-        self._load_model()
+    """
+    DPT depth estimation with the whole pre- and post-processing as batched tensor ops on the GPU: the
+    `DPTFeatureExtractor` resize / rescale / normalize, the upsampling back to the input size, the per-sample
+    normalization and the uint8 quantization. Only the uint8 maps are copied back to the host.
 
-    def _load_model(self, ):
-        self.model = DPTForDepthEstimation.from_pretrained("Intel/dpt-hybrid-midas").to('cuda')
-        self.feature_extractor = DPTFeatureExtractor.from_pretrained("Intel/dpt-hybrid-midas")
+    norm: 'max' divides by the per-sample maximum (the format of the existing depth maps), 'minmax' stretches each
+    map to the full [0, 255] range.
+    """
+    def __init__(self, model_name_or_path="Intel/dpt-hybrid-midas", norm='max'):
+        assert norm in ('max', 'minmax'), norm
+        self.norm = norm
+        self._load_model(model_name_or_path)
 
-    def __call__(self, image):
-        # print(image.shape)      # {batch_size, 1024, 1024, 3}
-        inputs = self.feature_extractor(images=image, return_tensors="pt")
-        inputs = inputs.to('cuda')
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            predicted_depths = outputs.predicted_depth      # {batch_size, 384, 384}
+    def _load_model(self, model_name_or_path):
+        self.model = DPTForDepthEstimation.from_pretrained(model_name_or_path).to('cuda').eval()
+        self.feature_extractor = DPTFeatureExtractor.from_pretrained(model_name_or_path)
+
+        # the inputs are square center crops (CondExtractorDataset), so keep_aspect_ratio does not change the size
+        size = self.feature_extractor.size
+        self.input_size = (size['height'], size['width']) if isinstance(size, dict) else (size, size)
+        self.resample = {2: 'bilinear', 3: 'bicubic'}.get(int(self.feature_extractor.resample), 'bilinear')
+        self.rescale_factor = getattr(self.feature_extractor, 'rescale_factor', 1 / 255)
+        self.mean = torch.tensor(self.feature_extractor.image_mean, device='cuda').view(1, 3, 1, 1)
+        self.std = torch.tensor(self.feature_extractor.image_std, device='cuda').view(1, 3, 1, 1)
+
+    def preprocess(self, image):
+        # {batch_size, H, W, 3} uint8 => {batch_size, 3, 384, 384} normalized, same steps as DPTFeatureExtractor
+        pixel_values = image.permute(0, 3, 1, 2).float() * self.rescale_factor
+        pixel_values = torch.nn.functional.interpolate(
+            pixel_values, size=self.input_size, mode=self.resample, align_corners=False, antialias=True
+        )
+        return (pixel_values - self.mean) / self.std
 
+    def normalize(self, depths):
+        # {batch_size, H, W} => uint8, one reduction per sample for the whole batch
+        depth_max = depths.flatten(1).amax(dim=1).view(-1, 1, 1)
+        if self.norm == 'minmax':
+            depth_min = depths.flatten(1).amin(dim=1).view(-1, 1, 1)
+            depths = (depths - depth_min) / (depth_max - depth_min).clamp(min=1e-8)
+        else:
+            depths = depths / depth_max.clamp(min=1e-8)
+        # truncation like the former `.astype("uint8")`, the clamp catches the bicubic overshoot
+        return (depths * 255).clamp(0, 255).to(torch.uint8)
+
+    def __call__(self, image, output_type='pil'):
+        """output_type: 'pil' for a list of PIL images, 'np' for a uint8 {batch_size, H, W} array"""
+        with torch.no_grad():
+            if image.device.type != 'cuda':
+                image = image.to('cuda')
+            predicted_depths = self.model(pixel_values=self.preprocess(image)).predicted_depth  # {batch_size, 384, 384}
             predictions = torch.nn.functional.interpolate(
                 predicted_depths.unsqueeze(1),
-                # size=image.size[::-1],
-                size=tuple(image[0].shape[:2]),
+                size=tuple(image.shape[1:3]),
                 mode="bicubic",
                 align_corners=False,
             )
+            depths = self.normalize(predictions.squeeze(1)).cpu().numpy()
 
-        print('prapare prediction......')
-        depths = []
-        for i, prediction in tqdm(enumerate(predictions)):
-            output = prediction.squeeze().cpu().numpy()
-            formatted = (output * 255 / np.max(output)).astype("uint8")
-            depth = Image.fromarray(formatted)
-            depths.append(depth)
-
-        return depths
+        if output_type == 'np':
+            return depths
+        return [Image.fromarray(depth) for depth in depths]
 
 
-def process_depth(images_per_process, args, gpu_id, model_type="dpt-hybrid-midas"):
+def process_depth(work, args, gpu_id, model_type="dpt-hybrid-midas"):
+    """
+    Same three overlapping stages as `process_lineart`: dataloader workers decode and resize, this process runs DPT
+    with its pre- and post-processing on the GPU, the writer threads encode and save the PNGs.
+    """
     torch.cuda.set_device(gpu_id)
-    # accelerator = Accelerator()
+    from .dataset import WorkUnitDataset
+    from .pipeline import AsyncImageWriter, ThroughputMeter, UnitBatchSampler
+    from .scheduler import CompletionLog
 
     # prepare data
-    # test_dataset = CondExtractorDataset(args.input_path)
-    from .dataset import CondExtractorDataset
-    test_dataset = CondExtractorDataset(images_per_process)
-    test_loader = DataLoader(test_dataset, shuffle=False, batch_size=16)
+    test_loader = DataLoader(
+        WorkUnitDataset(resolution=args.resolution),
+        batch_sampler=UnitBatchSampler(work, args.batch_size),
+        num_workers=args.num_workers,
+        pin_memory=True,
+        persistent_workers=args.num_workers > 0,
+    )
 
     # preprocess
-    # device = accelerator.device
     os.makedirs(args.output_path, exist_ok=True)
-    model = DPTModel()
-
-    # Send everything through `accelerator.prepare`
-    # test_loader, model = accelerator.prepare(test_loader, model)
+    model = DPTModel(norm=args.depth_norm)
+    completion_log = CompletionLog(args.output_path, gpu_id)
+    meter = ThroughputMeter(f'depth {gpu_id}')
+    writer = AsyncImageWriter(
+        num_threads=args.num_writers, max_queue=4 * args.batch_size, meter=meter, on_written=completion_log.mark
+    )
 
     # Run
     with torch.no_grad():
         print('running .....')
+        print(f'depth maps will save in ==> {args.output_path}')
+        start = time.perf_counter()
         for data in tqdm(test_loader):
-            images = data['data'].to('cuda')
             paths = data['path']
-            depth_imgs = model(images)
-            print('saving the image......')
-            for i, depth_img in tqdm(enumerate(depth_imgs)):
-                save_dir = os.path.join(args.output_path, os.path.basename(os.path.dirname(paths[i])))
-                os.makedirs(save_dir, exist_ok=True)
-                save_path = os.path.join(
-                    save_dir, os.path.splitext(os.path.basename(paths[i]))[0] + '-' + model_type + '.png'
-                )
-                depth_img.save(save_path)
+            meter.add('load', time.perf_counter() - start, len(paths))
+
+            if True in data['error']:
+                print(f'something error happening,so throw all the batch pic')
+            else:
+                gpu_start = time.perf_counter()
+                depth_imgs = model(data['data'].to('cuda', non_blocking=True), output_type='np')
+                meter.add('gpu', time.perf_counter() - gpu_start, len(paths))
+
+                submit_start = time.perf_counter()
+                for depth_img, path, index in zip(depth_imgs, paths, data['index'].tolist()):
+                    save_path = os.path.join(
+                        args.output_path, os.path.basename(os.path.dirname(path)),
+                        os.path.splitext(os.path.basename(path))[0] + '-' + model_type + '.png'
+                    )
+                    writer.submit(depth_img, save_path, index)
+                meter.add('write_wait', time.perf_counter() - submit_start, len(paths))
+
+            meter.report(write_queue=f'{writer.qsize()}/{writer.queue.maxsize}')
+            start = time.perf_counter()
+
+    writer.close()
+    meter.report(force=True)
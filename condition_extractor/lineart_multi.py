@@ -2,6 +2,7 @@
 # MIT License
 
 import os
+import time
 import torch
 import numpy as np
 from PIL import Image
@@ -104,7 +105,8 @@ class LineartDetector:
         model = model.cuda()
         return model
 
-    def __call__(self, input_image, coarse):
+    def __call__(self, input_image, coarse, output_type='pil'):
+        """output_type: 'pil' for a list of PIL images, 'np' for a uint8 {batch_size, H, W} array quantized on device"""
         model = self.model_coarse if coarse else self.model
 
         # verify validity
@@ -121,6 +123,10 @@ class LineartDetector:
                 image = image.permute(0, 3, 1, 2)
             outputs = model(image)
 
+        if output_type == 'np':
+            # same truncation as ToPILImage, only uint8 goes back to the host
+            return (torch.clamp(outputs, 0, 1).squeeze(1) * 255).to(torch.uint8).cpu().numpy()
+
         # transformer output side by side
         res = []
         for output in torch.clamp(outputs, 0, 1):
@@ -130,92 +136,68 @@ class LineartDetector:
         return res
 
 
-def process_lineart(list_per_process, args, gpu_id):
-    # # TODO: debug
-    # if gpu_id != 0:
-    #     exit(0)
+def process_lineart(work, args, gpu_id):
+    """
+    `work` is either the shared queue of (index, path) units filled by multi_main_v2.py, or a static list of image
+    dirs / image paths as passed by multi_main.py.
 
+    Three overlapping stages: `args.num_workers` dataloader workers decode and resize, this process runs the model,
+    `args.num_writers` threads encode and save the PNGs.
+    """
     torch.cuda.set_device(gpu_id)
-    test_sample = list_per_process[0]
-    if os.path.isdir(test_sample):
-        images_per_process = []
-        for img_dir in tqdm(list_per_process):
-            img_paths = [os.path.join(img_dir, name) for name in os.listdir(img_dir) if name.endswith('.jpg')]
-            images_per_process += img_paths
-    elif os.path.isfile(test_sample) and test_sample.endswith('.jpg'):
-        images_per_process = list_per_process
-    else:
-        ValueError("funcation of 'list_per_process' must input Uion[image dirs list / image paths list] !!")
-        exit(1)
-
-    _images_per_process = images_per_process[args.start_index*args.batch_size:]
-    print(f'Test:\t{int(len(images_per_process)/args.batch_size)+1} '
-          f'==> {int(len(_images_per_process)/args.batch_size)+1}')
-    # exit(0)
-
-    # # Number of doka statistical datasets
-    # print(f'{gpu_id}:\t{len(images_per_process)}')
-    # exit(0)
+    from .dataset import WorkUnitDataset
+    from .pipeline import AsyncImageWriter, ThroughputMeter, UnitBatchSampler
+    from .scheduler import CompletionLog
 
     # prepare data
-    from .dataset import CondExtractorDataset
-    test_dataset = CondExtractorDataset(
-        _images_per_process,
-        resolution=args.resolution,
-    )
     test_loader = DataLoader(
-        test_dataset,
-        shuffle=False,
-        batch_size=args.batch_size,
-        collate_fn=None
+        WorkUnitDataset(resolution=args.resolution),
+        batch_sampler=UnitBatchSampler(work, args.batch_size),
+        num_workers=args.num_workers,
+        pin_memory=True,
+        persistent_workers=args.num_workers > 0,
     )
 
     # preprocess
     os.makedirs(args.output_path, exist_ok=True)
     model = LineartDetector()
+    completion_log = CompletionLog(args.output_path, gpu_id)
+    meter = ThroughputMeter(f'lineart {gpu_id}')
+    writer = AsyncImageWriter(
+        num_threads=args.num_writers, max_queue=4 * args.batch_size, meter=meter, on_written=completion_log.mark
+    )
 
     # Run
     with torch.no_grad():
         print('running .....')
         print(f'images result will save in ==> {args.output_path}')
-        progress_bar = tqdm(test_loader)
-        for index, data in enumerate(progress_bar):
-            # if index < args.start_index:
-            #     print(f'{index} < {args.start_index}')
-            #     continue
-            images = data['data'].to('cuda')
+        start = time.perf_counter()
+        for data in tqdm(test_loader):
             paths = data['path']
-            error = data['error']
+            meter.add('load', time.perf_counter() - start, len(paths))
 
-            if True in error:
+            if True in data['error']:
                 print(f'something error happening,so throw all the batch pic')
-                continue
-
-            # skip
-            all_finish = True
-            for path in paths:
-                cond_dir = os.path.join(args.output_path, os.path.basename(os.path.dirname(path)))
-                os.makedirs(cond_dir, exist_ok=True)
-                cond_path = os.path.join(
-                    cond_dir, os.path.splitext(os.path.basename(path))[0] + '.png'
-                )
-                if not os.path.exists(cond_path):
-                    all_finish = False
-                    break
-            if all_finish:
-                # print(cond_path)
-                print(f'{gpu_id}:\tskipping...... {index+args.start_index}|{len(test_loader)+args.start_index}')
-                continue
-
-            lineart_images = model(images, coarse=False)
-            # print('saving the image......')
-            for i, lineart_image in enumerate(lineart_images):
-                save_dir = os.path.join(args.output_path, os.path.basename(os.path.dirname(paths[i])))
-                os.makedirs(save_dir, exist_ok=True)
-                save_path = os.path.join(
-                    save_dir, os.path.splitext(os.path.basename(paths[i]))[0] + '.png'
-                )
-                lineart_image.save(save_path)
+            else:
+                gpu_start = time.perf_counter()
+                images = data['data'].to('cuda', non_blocking=True)
+                lineart_images = model(images, coarse=False, output_type='np')
+                meter.add('gpu', time.perf_counter() - gpu_start, len(paths))
+
+                submit_start = time.perf_counter()
+                for lineart_image, path, index in zip(lineart_images, paths, data['index'].tolist()):
+                    save_path = os.path.join(
+                        args.output_path, os.path.basename(os.path.dirname(path)),
+                        os.path.splitext(os.path.basename(path))[0] + '.png'
+                    )
+                    writer.submit(lineart_image, save_path, index)
+                meter.add('write_wait', time.perf_counter() - submit_start, len(paths))
+
+            meter.report(write_queue=f'{writer.qsize()}/{writer.queue.maxsize}')
+            start = time.perf_counter()
+
+    writer.close()
+    meter.report(force=True)
 
     # model = LineartDetector()
     # image_path = r'/mnt/nfs/file_server/public/mingjiahui/data/inference_test/000000000285.jpg'
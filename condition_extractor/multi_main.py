@@ -49,6 +49,7 @@ def main(args, process):
         images_per_process = image_list[i * num:] \
             if i == args.num_processes - 1 else image_list[i * num: (i + 1) * num]
         print(f'{i}/{gpu_id}: {i * num} ~ {i * num + len(images_per_process)}')
+        # a static list is one work unit of untracked images (index -1), see scheduler.iter_work_units
         p = multiprocessing.Process(target=process, args=(images_per_process, args, i))
         processes.append(p)
 
@@ -86,6 +87,30 @@ if __name__ == '__main__':
         type=int,
         required=True,
     )
+    parser.add_argument(
+        '--resolution',
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=8,
+        help='dataloader workers per process for decoding and resizing',
+    )
+    parser.add_argument(
+        '--num_writers',
+        type=int,
+        default=8,
+        help='png encoder / writer threads per process',
+    )
+    parser.add_argument(
+        '--depth_norm',
+        type=str,
+        default='max',
+        choices=['max', 'minmax'],
+        help="depth only: divide by the per-image max (format of the existing maps) or stretch min-max to [0, 255]",
+    )
     args = parser.parse_args()
 
     from condition_extractor import process_depth, process_lineart
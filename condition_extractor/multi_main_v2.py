@@ -34,30 +34,33 @@ def main(args, process):
     # image_list = _get_img_path(args.input_path)
     print(f"Input path:\t{args.input_path}\n"
           f"Output path:\t{args.output_path}")
-    img_dirs_list = [os.path.join(args.input_path, name) for name in os.listdir(args.input_path)
-                     if os.path.isdir(os.path.join(args.input_path, name))]
-    # img_dirs_list = [os.path.join(args.input_path, name) for name in os.listdir(args.input_path)
-    #                 if os.path.isdir(os.path.join(args.input_path, name)) and int(name) < 200]
-    num = len(img_dirs_list) // args.num_processes
+    from condition_extractor.scheduler import build_work_list, get_pending_units
+    images = build_work_list(args.input_path, args.output_path)
+    unit_size = args.batch_size * args.batches_per_unit
+    pending_units = get_pending_units(images, args.output_path, unit_size)
+    print(f'{len(images)} images, {sum(len(unit) for unit in pending_units)} left in {len(pending_units)} units')
 
     # get gpu ids
     cuda_visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
     gpu_ids = [int(num) for num in cuda_visible_devices.split(',')[:-1]]
     assert len(gpu_ids) == args.num_processes
 
-    # prepare multi processes
+    # prepare multi processes, every process pulls the next unit from the shared queue when it is done with the last
+    work_queue = multiprocessing.Queue(maxsize=4 * args.num_processes)
     processes = []
     for i in range(args.num_processes):
-        gpu_id = gpu_ids[i]
-        image_dirs_per_process = img_dirs_list[i * num:] \
-            if i == args.num_processes - 1 else img_dirs_list[i * num: (i + 1) * num]
-        print(f'{i}/{gpu_id}: {i * num} ~ {i * num + len(image_dirs_per_process)}')
-        p = multiprocessing.Process(target=process, args=(image_dirs_per_process, args, i))
+        print(f'{i}/{gpu_ids[i]}: pulling from the work queue')
+        p = multiprocessing.Process(target=process, args=(work_queue, args, i))
         processes.append(p)
 
     for p in processes:
         p.start()
 
+    for unit in tqdm(pending_units, desc='units dispatched'):
+        work_queue.put(unit)
+    for _ in processes:
+        work_queue.put(None)
+
     for p in processes:
         p.join()
 
@@ -90,9 +93,29 @@ if __name__ == '__main__':
         required=True,
     )
     parser.add_argument(
-        '--start_index',
+        '--batches_per_unit',
+        type=int,
+        default=8,
+        help='batches per work unit, the granularity of scheduling',
+    )
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=8,
+        help='dataloader workers per process for decoding and resizing',
+    )
+    parser.add_argument(
+        '--num_writers',
         type=int,
-        default=0,
+        default=8,
+        help='png encoder / writer threads per process',
+    )
+    parser.add_argument(
+        '--depth_norm',
+        type=str,
+        default='max',
+        choices=['max', 'minmax'],
+        help="depth only: divide by the per-image max (format of the existing maps) or stretch min-max to [0, 255]",
     )
     parser.add_argument(
         '--resolution',
@@ -101,10 +124,11 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
-    from condition_extractor import process_depth, process_lineart
+    from condition_extractor import process_depth, process_lineart, process_sketch
     process_dict = {
         'depth': process_depth,
         'lineart': process_lineart,
+        'sketch': process_sketch,
     }
     process = process_dict[args.cond_type]
 
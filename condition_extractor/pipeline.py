@@ -0,0 +1,119 @@
+"""
+Pipelined extraction: DataLoader workers decode and resize the images, the GPU process only runs the model, and a
+pool of writer threads encodes and saves the PNGs (PIL releases the GIL while compressing). All hand-offs are bounded
+queues, so a slow stage applies back-pressure instead of piling images up in memory, and `ThroughputMeter` reports
+which stage is the bottleneck.
+"""
+import collections
+import os
+import queue
+import threading
+import time
+
+from PIL import Image
+from torch.utils.data import Sampler
+
+from .scheduler import iter_work_units
+
+
+class UnitBatchSampler(Sampler):
+    """
+    Turn the stream of work units into batches of (index, path) items for `WorkUnitDataset`. Units are pulled
+    lazily, so one DataLoader serves the whole run and its workers stay alive across units.
+    """
+
+    def __init__(self, work, batch_size):
+        self.work = work
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for unit in iter_work_units(self.work):
+            for start in range(0, len(unit), self.batch_size):
+                yield unit[start: start + self.batch_size]
+
+
+class ThroughputMeter:
+    """busy time and image count per stage, printed every `interval` seconds"""
+
+    def __init__(self, name, interval=60.):
+        self.name = name
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.busy = collections.defaultdict(float)
+        self.count = collections.defaultdict(int)
+        self.start = self.last_report = time.perf_counter()
+
+    def add(self, stage, seconds, num):
+        with self.lock:
+            self.busy[stage] += seconds
+            self.count[stage] += num
+
+    def report(self, force=False, **extra):
+        now = time.perf_counter()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        with self.lock:
+            stages = [f'{stage} {self.count[stage] / max(busy, 1e-6):.1f} img/s ({busy / (now - self.start):.0%})'
+                      for stage, busy in self.busy.items()]
+            done = self.count.get('write', 0)
+        extra = [f'{key} {value}' for key, value in extra.items()]
+        print(f'[{self.name}] {done} imgs, {done / (now - self.start):.1f} img/s | ' + ' | '.join(stages + extra))
+
+
+class AsyncImageWriter:
+    """
+    Thread pool that saves uint8 arrays as PNG. `submit` blocks once `max_queue` images are waiting, and
+    `on_written(index)` is called (under a lock) for every image once it is on disk.
+    """
+
+    def __init__(self, num_threads=8, max_queue=64, meter=None, on_written=None):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.meter = meter
+        self.on_written = on_written
+        self.lock = threading.Lock()
+        self.made_dirs = set()
+        self.error = None
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _makedirs(self, save_dir):
+        if save_dir in self.made_dirs:
+            return
+        os.makedirs(save_dir, exist_ok=True)
+        with self.lock:
+            self.made_dirs.add(save_dir)
+
+    def _run(self):
+        for array, save_path, index in iter(self.queue.get, None):
+            start = time.perf_counter()
+            try:
+                self._makedirs(os.path.dirname(save_path))
+                Image.fromarray(array).save(save_path)
+            except Exception as e:
+                self.error = e
+                continue
+            if self.meter is not None:
+                self.meter.add('write', time.perf_counter() - start, 1)
+            if self.on_written is not None:
+                with self.lock:
+                    self.on_written(index)
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('saving an image failed') from self.error
+
+    def submit(self, array, save_path, index=-1):
+        self._check()
+        self.queue.put((array, save_path, index))
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self._check()
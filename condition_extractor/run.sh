@@ -11,5 +11,7 @@ export OUTPUT='/mnt/nfs/file_server/public/mingjiahui/data/LAION12M-highreso/lin
       --num_processes=7 \
       --cond_type=lineart \
       --resolution=1024 \
-      --start_index=5200 \
+      --batches_per_unit=8 \
+      --num_workers=8 \
+      --num_writers=8 \
 #      --data_num=123
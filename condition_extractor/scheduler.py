@@ -0,0 +1,106 @@
+"""
+Dynamic work distribution for the condition extractors.
+
+The main process splits the image list into fixed-size work units and feeds them through a shared queue, so every
+GPU process pulls a new unit as soon as it is done with the previous one and a slow directory or GPU no longer holds
+back the whole job. Finished images are recorded by input index in an append-only log (one file per process) under
+`<output_path>/.progress`, together with the frozen work list, so a restarted job skips exactly the finished images
+without listing the input directories or checking a single output file.
+"""
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+
+def progress_dir(output_path):
+    return os.path.join(output_path, '.progress')
+
+
+def expand_image_list(list_per_process):
+    """accept either a list of image dirs or a list of image paths"""
+    test_sample = list_per_process[0]
+    if os.path.isdir(test_sample):
+        images = []
+        for img_dir in tqdm(list_per_process):
+            images += sorted(os.path.join(img_dir, name) for name in os.listdir(img_dir) if name.endswith('.jpg'))
+        return images
+    elif os.path.isfile(test_sample) and test_sample.endswith('.jpg'):
+        return list_per_process
+    raise ValueError("funcation of 'list_per_process' must input Uion[image dirs list / image paths list] !!")
+
+
+def build_work_list(input_path, output_path):
+    """list the images once and freeze the order, later runs read the list instead of walking the input dirs"""
+    os.makedirs(progress_dir(output_path), exist_ok=True)
+    list_path = os.path.join(progress_dir(output_path), 'worklist.txt')
+    if os.path.exists(list_path):
+        with open(list_path, 'r') as f:
+            return f.read().splitlines()
+
+    img_dirs = sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                      if os.path.isdir(os.path.join(input_path, name)))
+    images = expand_image_list(img_dirs)
+    with open(list_path + '.tmp', 'w') as f:
+        f.write('\n'.join(images))
+    os.replace(list_path + '.tmp', list_path)
+    return images
+
+
+class CompletionLog:
+    """
+    Append-only log of the finished input indices (int64, position in the frozen work list), one file per process so
+    no locking is needed. Indices are appended as the outputs land, a restart turns all logs into a bitmap and
+    filters the work list in memory instead of checking the outputs on disk.
+    """
+
+    def __init__(self, output_path, rank):
+        os.makedirs(progress_dir(output_path), exist_ok=True)
+        self.path = os.path.join(progress_dir(output_path), f'done-{rank}.bin')
+        self.file = None
+
+    def mark(self, indices):
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        # images of a static per-process list carry index -1 and are not tracked
+        indices = indices[indices >= 0]
+        if len(indices) == 0:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.write(indices.astype('<i8').tobytes())
+        self.file.flush()
+
+    @staticmethod
+    def completed(output_path, num_images):
+        done = np.zeros(num_images, dtype=bool)
+        root = progress_dir(output_path)
+        if not os.path.isdir(root):
+            return done
+        for name in os.listdir(root):
+            if name.startswith('done-') and name.endswith('.bin'):
+                with open(os.path.join(root, name), 'rb') as f:
+                    data = f.read()
+                # a torn last record from a killed process is simply not counted
+                indices = np.frombuffer(data[:len(data) // 8 * 8], dtype='<i8')
+                done[indices[indices < num_images]] = True
+        return done
+
+
+def get_pending_units(images, output_path, unit_size):
+    """split the unfinished images into units of (index, path) items"""
+    done = CompletionLog.completed(output_path, len(images))
+    pending = np.flatnonzero(~done).tolist()
+    return [[(index, images[index]) for index in pending[start: start + unit_size]]
+            for start in range(0, len(pending), unit_size)]
+
+
+def iter_work_units(work):
+    """
+    Yield the units of (index, path) items from a shared queue until its sentinel, or a single unit with index -1
+    for a static per-process list.
+    """
+    if isinstance(work, (list, tuple)):
+        yield [(-1, path) for path in expand_image_list(work)]
+        return
+    for unit in iter(work.get, None):
+        yield unit
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import torch
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.dirname(current_dir))
+
+
+class SketchDetector:
+    """
+    PiDiNet soft-edge extractor used by train_sketch.py. The raw sigmoid output is kept (no threshold) so that the
+    training loader can still apply `random_threshold` as a cheap augmentation.
+    """
+    def __init__(self, ckpt_path='checkpoints/table5_pidinet.pth'):
+        from Adapter.extra_condition.model_edge import load_pidinet
+        self.model = load_pidinet(ckpt_path)
+        self.model = self.model.eval().cuda()
+
+    def __call__(self, input_image):
+        """{batch_size, H, W, 3} uint8 RGB => uint8 {batch_size, H, W} soft edge maps"""
+        # {batch_size, 3, H, W} in [0, 1], same input as in train_sketch.py
+        assert input_image.shape[-1] == 3
+        with torch.no_grad():
+            image = input_image.permute(0, 3, 1, 2).float() / 255.
+            edges = self.model(image)[-1]
+
+        # quantize on device, only uint8 goes back to the host
+        return (edges.squeeze(1).clamp(0, 1) * 255.).round().to(torch.uint8).cpu().numpy()
+
+
+def process_sketch(work, args, gpu_id):
+    """
+    Same pipeline as `process_lineart`: dataloader workers decode and resize, this process runs PiDiNet, the writer
+    threads save the PNGs. `tool/make_cond_manifest.py` turns the finished maps into the training json.
+    """
+    torch.cuda.set_device(gpu_id)
+    from .dataset import WorkUnitDataset
+    from .pipeline import AsyncImageWriter, ThroughputMeter, UnitBatchSampler
+    from .scheduler import CompletionLog
+
+    # prepare data
+    test_loader = DataLoader(
+        WorkUnitDataset(resolution=args.resolution),
+        batch_sampler=UnitBatchSampler(work, args.batch_size),
+        num_workers=args.num_workers,
+        pin_memory=True,
+        persistent_workers=args.num_workers > 0,
+    )
+
+    # preprocess
+    os.makedirs(args.output_path, exist_ok=True)
+    model = SketchDetector()
+    completion_log = CompletionLog(args.output_path, gpu_id)
+    meter = ThroughputMeter(f'sketch {gpu_id}')
+    writer = AsyncImageWriter(
+        num_threads=args.num_writers, max_queue=4 * args.batch_size, meter=meter, on_written=completion_log.mark
+    )
+
+    # Run
+    with torch.no_grad():
+        print(f'soft edge maps will save in ==> {args.output_path}')
+        start = time.perf_counter()
+        for data in tqdm(test_loader):
+            paths = data['path']
+            meter.add('load', time.perf_counter() - start, len(paths))
+
+            if True in data['error']:
+                print(f'something error happening,so throw all the batch pic')
+            else:
+                gpu_start = time.perf_counter()
+                images = data['data'].to('cuda', non_blocking=True)
+                edge_images = model(images)
+                meter.add('gpu', time.perf_counter() - gpu_start, len(paths))
+
+                submit_start = time.perf_counter()
+                for edge_image, path, index in zip(edge_images, paths, data['index'].tolist()):
+                    save_path = os.path.join(
+                        args.output_path, os.path.basename(os.path.dirname(path)),
+                        os.path.splitext(os.path.basename(path))[0] + '.png'
+                    )
+                    writer.submit(edge_image, save_path, index)
+                meter.add('write_wait', time.perf_counter() - submit_start, len(paths))
+
+            meter.report(write_queue=f'{writer.qsize()}/{writer.queue.maxsize}')
+            start = time.perf_counter()
+
+    writer.close()
+    meter.report(force=True)
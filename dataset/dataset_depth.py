@@ -4,13 +4,29 @@ import os
 from tqdm import tqdm
 from PIL import Image
 
+from dataset.manifest import Manifest, is_manifest
+
 
 class DepthDataset():
-    def __init__(self, meta_file, transforms):
+    def __init__(self, meta_file, transforms, load_image=True, load_cond=True, cond_process=None):
         super(DepthDataset, self).__init__()
 
-        self.files = []
         print('loading the data......')
+        if is_manifest(meta_file):
+            # memory-mapped manifest of tool/convert_manifest.py, nothing is loaded up front
+            self.files = Manifest(meta_file)
+        else:
+            self.files = self._load_json(meta_file)
+        self.transforms = transforms
+        # the image / condition can be skipped when they come from a precomputed cache
+        self.load_image = load_image
+        self.load_cond = load_cond
+        # optional augmentation on the loaded sample, e.g. dataset.utils.RandomThreshold for soft edge maps
+        self.cond_process = cond_process
+
+    @staticmethod
+    def _load_json(meta_file):
+        files = []
         with open(meta_file, 'r') as f:
             data = json.load(f)
             for key in tqdm(list(data.keys())):
@@ -18,39 +34,46 @@ class DepthDataset():
                 depth_img_path = data[key]['depth']
                 txt_path = data[key]['txt']
 
-                self.files.append(
+                files.append(
                     {
                         'img_path': img_path,
                         'depth_path': depth_img_path,
                         'txt_path': txt_path,
                         'img_id': os.path.dirname(key),
                     })
-        self.transforms = transforms
+        return files
 
     def __getitem__(self, idx):
         file = self.files[idx]
+        sample = {}
 
         # print(f"Test: {file['img_path']}")
         # print(f"Type: {type(file['img_path'])}")
 
         # img
-        im = Image.open(file['img_path']).convert("RGB")
-        im = self.transforms(im)
-        # im = img2tensor(np.array(im), bgr2rgb=True, float32=True) / 255.
+        if self.load_image:
+            im = Image.open(file['img_path']).convert("RGB")
+            sample['jpg'] = self.transforms(im)
+            # im = img2tensor(np.array(im), bgr2rgb=True, float32=True) / 255.
 
         # depth
-        depth = Image.open(file['depth_path']).convert('L')
-        depth = self.transforms(depth)     # [:,:,0]
-        # depth = img2tensor(np.array(depth), bgr2rgb=True, float32=True) / 255.  # [0].unsqueeze(0)#/255.
+        if self.load_cond:
+            depth = Image.open(file['depth_path']).convert('L')
+            sample['depth'] = self.transforms(depth)     # [:,:,0]
+            # depth = img2tensor(np.array(depth), bgr2rgb=True, float32=True) / 255.  # [0].unsqueeze(0)#/255.
 
         # txt
         with open(file['txt_path'], 'r') as fs:
             sentence = fs.readline().strip()
 
         # img id
-        id = file['img_id']
+        sample['txt'] = sentence
+        sample['im_name'] = file['img_id']
+
+        if self.cond_process is not None and self.load_cond:
+            sample = self.cond_process(sample)
 
-        return {'jpg': im, 'depth': depth, 'txt': sentence, 'im_name': id}
+        return sample
 
     def __len__(self):
         return len(self.files)
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import braceexpand
 import numpy as np
 import os
+import random
 import pytorch_lightning as pl
 import torch
 import webdataset as wds
+from torch.utils.data import IterableDataset
 from torchvision.transforms import transforms
 
 from configs.utils import instantiate_from_config
 from dataset.dataset_depth import DepthDataset
+from dataset.latent_cache import LatentCacheDataset
 
 
 def dict_collation_fn(samples, combine_tensors=True, combine_scalars=True):
@@ -42,9 +46,55 @@ def dict_collation_fn(samples, combine_tensors=True, combine_scalars=True):
     return result
 
 
+class ResumableShardList(IterableDataset):
+    """
+    Endless stream of tar shard urls, reshuffled with a seeded order every epoch. All nodes and workers build the
+    same order, so the node / worker splitters hand out disjoint shards, and `start_shard` skips the shards already
+    consumed before a restart.
+    """
+
+    def __init__(self, urls, shuffle=True, seed=0, start_shard=0):
+        super().__init__()
+        self.urls = [url for pattern in urls for url in braceexpand.braceexpand(pattern)]
+        self.shuffle = shuffle
+        self.seed = seed
+        self.start_shard = start_shard
+
+    def __iter__(self):
+        epoch, start = divmod(self.start_shard, len(self.urls))
+        while True:
+            urls = list(self.urls)
+            if self.shuffle:
+                random.Random(self.seed + epoch).shuffle(urls)
+            for url in urls[start:]:
+                yield dict(url=url)
+            epoch += 1
+            start = 0
+
+
+class WebSampleProcess(object):
+    """turn a decoded tar sample (jpg, cond.png, txt) into the same dict as DepthDataset"""
+
+    def __init__(self, image_transforms, cond_process=None):
+        self.image_transforms = image_transforms
+        self.cond_process = cond_process
+
+    def __call__(self, x):
+        sample = {
+            'jpg': self.image_transforms(x['jpg'].convert('RGB')),
+            'depth': self.image_transforms(x['cond.png'].convert('L')),
+            'txt': x['txt'].strip().split('\n')[0],
+            'im_name': x['__key__'],
+        }
+        if self.cond_process is not None:
+            sample = self.cond_process(sample)
+        return sample
+
+
 class WebDataModuleFromConfig_Laion_Lexica(pl.LightningDataModule):
 
     def __init__(self,
+                 tar_base=None,
                  # tar_base1,
                  # tar_base2,
                  # batch_size,
@@ -55,6 +105,7 @@ class WebDataModuleFromConfig_Laion_Lexica(pl.LightningDataModule):
                  multinode=True,
                  min_size=None,
                  max_pwatermark=1.0,
+                 seed=0,
                  **kwargs):
         super().__init__()
         # print(f'Setting tar base to {tar_base1} and {tar_base2}')
@@ -68,60 +119,85 @@ class WebDataModuleFromConfig_Laion_Lexica(pl.LightningDataModule):
         self.multinode = multinode
         self.min_size = min_size  # filter out very small images
         self.max_pwatermark = max_pwatermark  # filter out watermarked images
-
-    # def make_loader(self, dataset_config):
-    #     image_transforms = [instantiate_from_config(tt) for tt in dataset_config.image_transforms]
-    #     image_transforms = transforms.Compose(image_transforms)
-    #
-    #     process = instantiate_from_config(dataset_config['process'])
-    #
-    #     shuffle = dataset_config.get('shuffle', 0)
-    #     shardshuffle = shuffle > 0
-    #
-    #     nodesplitter = wds.shardlists.split_by_node if self.multinode else wds.shardlists.single_node_only
-    #
-        # # make dataset for laion
-        # tars_1 = os.path.join(self.tar_base1, dataset_config.shards1)
-        #
-        # dset1 = wds.WebDataset(
-        #     tars_1, nodesplitter=nodesplitter, shardshuffle=shardshuffle,
-        #     handler=wds.warn_and_continue).repeat().shuffle(shuffle)
-        # print(f'Loading webdataset with {len(dset1.pipeline[0].urls)} shards.')
-        #
-        # dset1 = (
-        #     dset1.select(self.filter_keys).decode('pil',
-        #                                           handler=wds.warn_and_continue).select(self.filter_size).map_dict(
-        #                                               jpg=image_transforms, handler=wds.warn_and_continue).map(process))
-        # dset1 = (dset1.batched(self.batch_size, partial=False, collation_fn=dict_collation_fn))
-    #
-    #     # make dataset for lexica
-    #     tars_2 = os.path.join(self.tar_base2, dataset_config.shards2)
-    #
-    #     dset2 = wds.WebDataset(
-    #         tars_2, nodesplitter=nodesplitter, shardshuffle=shardshuffle,
-    #         handler=wds.warn_and_continue).repeat().shuffle(shuffle)
-    #
-    #     dset2 = (
-    #         dset2.decode('pil',
-    #                      handler=wds.warn_and_continue).map_dict(jpg=image_transforms,
-    #                                                              handler=wds.warn_and_continue).map(process))
-    #     dset2 = (dset2.batched(self.batch_size, partial=False, collation_fn=dict_collation_fn))
-    #
-    #     # get the corresponding prob
-    #     shards1_prob = dataset_config.get('shards1_prob', 0)
-    #     shards2_prob = dataset_config.get('shards2_prob', 0)
-    #     dataset = wds.RandomMix([dset1, dset2], [shards1_prob, shards2_prob])
-    #
-    #     loader = wds.WebLoader(dataset, batch_size=None, shuffle=False, num_workers=self.num_workers)
-    #
-    #     return loader
-
+        self.tar_base = tar_base
+        self.seed = seed
+        self.resume_samples = 0
+        self.resume_processes = 1
+
+    def resume_from(self, samples_seen, num_processes=1):
+        """
+        skip the tar shards that were already consumed before a restart (streaming mode only). `samples_seen` counts
+        all processes, each of which reads its own shards (wds.split_by_node)
+        """
+        self.resume_samples = samples_seen
+        self.resume_processes = num_processes
+
+    def is_streaming(self):
+        """the train loader streams tar shards, already split per node, and must not be sharded again"""
+        return self.train.get('shards', None) is not None
+
+    def samples_per_step(self, num_processes=1, gradient_accumulation_steps=1):
+        """training samples consumed per optimizer step, with the batch size the train loader actually uses"""
+        return self.train.batch_size * num_processes * gradient_accumulation_steps
+
+    def make_web_loader(self, dataset_config):
+        if dataset_config.get('latent_cache', None) is not None:
+            raise ValueError('the latent cache is indexed by the json manifest, it can not be used with tar shards')
+        image_transforms = [instantiate_from_config(tt) for tt in dataset_config.image_transforms]
+        image_transforms = transforms.Compose(image_transforms+[transforms.ToTensor()])
+        cond_process = dataset_config.get('cond_process', None)
+        cond_process = instantiate_from_config(cond_process) if cond_process is not None else None
+
+        shards = dataset_config.shards
+        shards = [shards] if isinstance(shards, str) else list(shards)
+        if self.tar_base is not None:
+            shards = [os.path.join(self.tar_base, pattern) for pattern in shards]
+
+        # shard cursor: every shard holds `samples_per_shard` samples (see tool/make_wds_shards.py). split_by_node
+        # deals the shard order out round-robin, so every node has read samples_seen / num_nodes samples of its share;
+        # the cursor stays a multiple of num_nodes to keep each node on its own shards
+        samples_per_shard = dataset_config.get('samples_per_shard', None)
+        num_nodes = self.resume_processes if self.multinode else 1
+        start_shard = self.resume_samples // num_nodes // samples_per_shard * num_nodes if samples_per_shard else 0
+
+        nodesplitter = wds.split_by_node if self.multinode else wds.single_node_only
+        pipeline = [
+            ResumableShardList(
+                shards, shuffle=dataset_config.get('shardshuffle', True), seed=self.seed, start_shard=start_shard),
+            nodesplitter,
+            wds.split_by_worker,
+            wds.tarfile_to_samples(handler=wds.warn_and_continue),
+            wds.select(self.filter_keys),
+        ]
+        shuffle_buffer = dataset_config.get('shuffle_buffer', 0)
+        if shuffle_buffer > 0:
+            pipeline.append(wds.shuffle(shuffle_buffer))
+        pipeline += [
+            wds.decode('pil', handler=wds.warn_and_continue),
+            wds.map(WebSampleProcess(image_transforms, cond_process), handler=wds.warn_and_continue),
+            wds.batched(dataset_config.batch_size, partial=False, collation_fn=dict_collation_fn),
+        ]
+        dataset = wds.DataPipeline(*pipeline)
+
+        return wds.WebLoader(dataset, batch_size=None, shuffle=False, num_workers=self.num_workers)
 
     def make_loader(self, dataset_config):
+        if dataset_config.get('shards', None) is not None:
+            return self.make_web_loader(dataset_config)
+
         image_transforms = [instantiate_from_config(tt) for tt in dataset_config.image_transforms]
         image_transforms = transforms.Compose(image_transforms+[transforms.ToTensor()])
 
-        dataset = DepthDataset(dataset_config.data_json, image_transforms)
+        latent_cache = dataset_config.get('latent_cache', None)
+        cond_process = dataset_config.get('cond_process', None)
+        dataset = DepthDataset(
+            dataset_config.data_json, image_transforms,
+            load_image=dataset_config.get('load_image', latent_cache is None),
+            load_cond=dataset_config.get('load_cond', True),
+            cond_process=instantiate_from_config(cond_process) if cond_process is not None else None,
+        )
+        if latent_cache is not None:
+            dataset = LatentCacheDataset(dataset, latent_cache)
         dataloader = torch.utils.data.DataLoader(
             dataset,
             batch_size=dataset_config.batch_size,
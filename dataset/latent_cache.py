@@ -0,0 +1,181 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+
+CACHE_FIELDS = ('latent_params', 'prompt_embeds', 'pooled_prompt_embeds')
+
+
+def shard_dir(cache_dir, shard_idx):
+    return os.path.join(cache_dir, f'shard-{shard_idx:05d}')
+
+
+def shard_rows(num_samples, shard_size, shard_idx):
+    return min(shard_size, num_samples - shard_idx * shard_size)
+
+
+def shard_row_count(cache_dir, shard_idx):
+    """rows held by every field of the shard, None if a field is missing, unreadable or the fields disagree"""
+    root = shard_dir(cache_dir, shard_idx)
+    counts = set()
+    for field in CACHE_FIELDS:
+        try:
+            counts.add(np.load(os.path.join(root, f'{field}.npy'), mmap_mode='r').shape[0])
+        except (ValueError, OSError):
+            return None
+    return counts.pop() if len(counts) == 1 else None
+
+
+def is_shard_complete(cache_dir, shard_idx, num_rows=None):
+    """all fields of the shard are in place and, given `num_rows`, hold that many rows"""
+    if num_rows is None:
+        root = shard_dir(cache_dir, shard_idx)
+        return all(os.path.exists(os.path.join(root, f'{field}.npy')) for field in CACHE_FIELDS)
+    return shard_row_count(cache_dir, shard_idx) == num_rows
+
+
+def missing_shards(cache_dir, num_samples, shard_size, row_counts=None):
+    """shards that are absent or do not hold their rows, read from the files unless `row_counts` are given"""
+    num_shards = (num_samples + shard_size - 1) // shard_size
+    if row_counts is None:
+        row_counts = [shard_row_count(cache_dir, shard_idx) for shard_idx in range(num_shards)]
+    return [
+        shard_idx for shard_idx in range(num_shards)
+        if shard_idx >= len(row_counts) or row_counts[shard_idx] != shard_rows(num_samples, shard_size, shard_idx)
+    ]
+
+
+def write_cache_index(cache_dir, num_samples, shard_size, **meta):
+    """
+    write the cache description once every shard is complete, with the row count of every shard (readers check the
+    cache against it without opening the shards) and the field shapes of the first shard. Several processes may do
+    so concurrently, they write the same content and the last rename wins.
+    """
+    num_shards = (num_samples + shard_size - 1) // shard_size
+    row_counts = [shard_row_count(cache_dir, shard_idx) for shard_idx in range(num_shards)]
+    missing = missing_shards(cache_dir, num_samples, shard_size, row_counts)
+    if missing:
+        raise ValueError(f'latent cache {cache_dir} misses or has incomplete shards {missing}')
+    root = shard_dir(cache_dir, 0)
+    shapes = {field: np.load(os.path.join(root, f'{field}.npy'), mmap_mode='r').shape[1:] for field in CACHE_FIELDS}
+    index = {
+        'num_samples': num_samples,
+        'shard_size': shard_size,
+        'num_shards': num_shards,
+        'shard_rows': row_counts,
+        'fields': {k: list(v) for k, v in shapes.items()},
+        'dtype': 'float16',
+    }
+    index.update(meta)
+    tmp_path = os.path.join(cache_dir, f'index.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, 'index.json'))
+
+
+class LatentShardWriter():
+    """
+    Write the frozen-encoder outputs of one shard (VAE latent distribution parameters, prompt embeds and pooled
+    prompt embeds) into memory-mappable .npy files. Files are written under a temporary name and renamed on close,
+    so a shard is either complete or absent.
+    """
+
+    def __init__(self, cache_dir, shard_idx, num_rows):
+        self.root = shard_dir(cache_dir, shard_idx)
+        os.makedirs(self.root, exist_ok=True)
+        self.num_rows = num_rows
+        self.cursor = 0
+        self.arrays = {}
+
+    def write(self, **batch):
+        bsz = None
+        for field in CACHE_FIELDS:
+            value = batch[field].detach().to('cpu', dtype=torch.float16).numpy()
+            if field not in self.arrays:
+                self.arrays[field] = np.lib.format.open_memmap(
+                    os.path.join(self.root, f'{field}.tmp.npy'), mode='w+', dtype=np.float16,
+                    shape=(self.num_rows,) + value.shape[1:])
+            bsz = value.shape[0]
+            self.arrays[field][self.cursor:self.cursor + bsz] = value
+        self.cursor += bsz
+
+    def close(self):
+        assert self.cursor == self.num_rows, f'shard {self.root} got {self.cursor}/{self.num_rows} rows'
+        shapes = {}
+        for field, array in self.arrays.items():
+            shapes[field] = array.shape[1:]
+            array.flush()
+            del array
+            os.replace(os.path.join(self.root, f'{field}.tmp.npy'), os.path.join(self.root, f'{field}.npy'))
+        self.arrays = {}
+        return shapes
+
+
+class LatentCache():
+    """
+    Read-only view of a cache written by tool/prepare_latent_cache.py. Shards are memory-mapped lazily, so each
+    dataloader worker only maps the shards it actually touches. The shard row counts come from the index, a shard
+    is checked against its count when it is first mapped.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'index.json'), 'r') as f:
+            self.index = json.load(f)
+        self.num_samples = self.index['num_samples']
+        self.shard_size = self.index['shard_size']
+        # caches indexed before the row counts were recorded are checked shard by shard
+        self.row_counts = self.index.get('shard_rows', None)
+        missing = missing_shards(cache_dir, self.num_samples, self.shard_size, self.row_counts)
+        if missing:
+            raise ValueError(
+                f'latent cache {cache_dir} misses or has incomplete shards {missing}, '
+                f'finish it with tool/prepare_latent_cache.py')
+        self.scaling_factor = self.index.get('scaling_factor', None)
+        self.shards = {}
+
+    def _get_shard(self, shard_idx):
+        if shard_idx not in self.shards:
+            root = shard_dir(self.cache_dir, shard_idx)
+            num_rows = shard_rows(self.num_samples, self.shard_size, shard_idx)
+            try:
+                shard = {field: np.load(os.path.join(root, f'{field}.npy'), mmap_mode='r') for field in CACHE_FIELDS}
+            except (ValueError, OSError) as e:
+                raise ValueError(f'latent cache shard {root} can not be read, rebuild it with '
+                                 f'tool/prepare_latent_cache.py') from e
+            if any(array.shape[0] != num_rows for array in shard.values()):
+                raise ValueError(f'latent cache shard {root} does not hold its {num_rows} rows, rebuild it with '
+                                 f'tool/prepare_latent_cache.py')
+            self.shards[shard_idx] = shard
+        return self.shards[shard_idx]
+
+    def __getitem__(self, idx):
+        shard = self._get_shard(idx // self.shard_size)
+        row = idx % self.shard_size
+        return {field: torch.from_numpy(np.array(shard[field][row])) for field in CACHE_FIELDS}
+
+    def __len__(self):
+        return self.num_samples
+
+
+class LatentCacheDataset():
+    """Join a manifest dataset with its precomputed latents and text embeddings, index by index."""
+
+    def __init__(self, dataset, cache_dir):
+        super(LatentCacheDataset, self).__init__()
+        self.dataset = dataset
+        self.cache = LatentCache(cache_dir)
+        if len(self.cache) != len(self.dataset):
+            raise ValueError(
+                f'latent cache {cache_dir} holds {len(self.cache)} samples but the dataset has {len(self.dataset)}, '
+                f'rebuild it with tool/prepare_latent_cache.py')
+
+    def __getitem__(self, idx):
+        sample = self.dataset[idx]
+        sample.update(self.cache[idx])
+        return sample
+
+    def __len__(self):
+        return len(self.dataset)
@@ -0,0 +1,96 @@
+import json
+import mmap
+import os
+
+import numpy as np
+
+
+MANIFEST_FIELDS = ('img', 'depth', 'txt')
+
+
+def write_manifest(data, output_dir):
+    """
+    Convert the {img_path: {'depth': path, 'txt': path}} dict of tool/get_data_v2.py into a columnar manifest:
+        dirs.json       the deduplicated directory table
+        dir_ids.npy     int32 [N, 3] directory id of the img / depth / txt path of every entry
+        offsets.npy     int64 [3N + 1] offsets of the file names in names.bin, entry i field j is string 3i + j
+        names.bin       utf-8 file names, concatenated
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    dirs = {}
+    num = len(data)
+    dir_ids = np.empty((num, len(MANIFEST_FIELDS)), dtype=np.int32)
+    offsets = np.empty(num * len(MANIFEST_FIELDS) + 1, dtype=np.int64)
+    offsets[0] = 0
+    with open(os.path.join(output_dir, 'names.bin'), 'wb') as names:
+        cursor = 0
+        for i, (img_path, entry) in enumerate(data.items()):
+            for j, path in enumerate((img_path, entry['depth'], entry['txt'])):
+                dir_name, name = os.path.split(path)
+                dir_ids[i, j] = dirs.setdefault(dir_name, len(dirs))
+                name = name.encode('utf-8')
+                names.write(name)
+                cursor += len(name)
+                offsets[i * len(MANIFEST_FIELDS) + j + 1] = cursor
+    np.save(os.path.join(output_dir, 'dir_ids.npy'), dir_ids)
+    np.save(os.path.join(output_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(output_dir, 'dirs.json'), 'w') as f:
+        json.dump({'num_entries': num, 'fields': MANIFEST_FIELDS, 'dirs': list(dirs.keys())}, f)
+
+
+def is_manifest(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'dirs.json'))
+
+
+class Manifest():
+    """
+    Read-only, memory-mapped view of a manifest written by `write_manifest`. Opening it does not touch the entries,
+    and the pages are shared by all dataloader workers instead of being copied into every forked process. The files
+    are mapped lazily on first access so the object stays cheap to pickle into spawned workers.
+    """
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = manifest_dir
+        with open(os.path.join(manifest_dir, 'dirs.json'), 'r') as f:
+            meta = json.load(f)
+        self.dirs = meta['dirs']
+        self.num_entries = meta['num_entries']
+        self.dir_ids = None
+        self.offsets = None
+        self.names = None
+
+    def _open(self):
+        self.dir_ids = np.load(os.path.join(self.manifest_dir, 'dir_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.manifest_dir, 'offsets.npy'), mmap_mode='r')
+        with open(os.path.join(self.manifest_dir, 'names.bin'), 'rb') as f:
+            self.names = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(dir_ids=None, offsets=None, names=None)
+        return state
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.num_entries
+        if not 0 <= idx < self.num_entries:
+            raise IndexError(idx)
+        if self.names is None:
+            self._open()
+
+        num_fields = len(MANIFEST_FIELDS)
+        dir_ids = self.dir_ids[idx].tolist()
+        offsets = self.offsets[idx * num_fields: (idx + 1) * num_fields + 1].tolist()
+        img_path, depth_path, txt_path = [
+            os.path.join(self.dirs[dir_ids[j]], self.names[offsets[j]:offsets[j + 1]].decode('utf-8'))
+            for j in range(num_fields)
+        ]
+        return {
+            'img_path': img_path,
+            'depth_path': depth_path,
+            'txt_path': txt_path,
+            'img_id': self.dirs[dir_ids[0]],
+        }
+
+    def __len__(self):
+        return self.num_entries
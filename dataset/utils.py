@@ -22,6 +22,21 @@ class AddEqual_fp16(object):
         return sample
 
 
+class RandomThreshold(object):
+    """binarize a precomputed soft edge map with a random threshold, same as `random_threshold` in train_sketch.py"""
+
+    def __init__(self, low_threshold=0.3, high_threshold=0.8, key='depth'):
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.key = key
+
+    def __call__(self, sample):
+        # sample[key] is the [0, 1] tensor of the soft edge map
+        threshold = round(random.uniform(self.low_threshold, self.high_threshold), 1)
+        sample[self.key] = (sample[self.key] > threshold).float()
+        return sample
+
+
 class AddCannyRandomThreshold(object):
 
     def __init__(self, low_threshold=100, high_threshold=200, shift_range=50):
@@ -3,7 +3,9 @@ import torch
 from omegaconf import OmegaConf
 
 from ldm.models.diffusion.ddim import DDIMSampler
+from ldm.models.diffusion.dpm_solver import DPMSolverSampler
 from ldm.models.diffusion.plms import PLMSSampler
+from ldm.modules.attention import BasicTransformerBlock, set_attention_backend
 from ldm.modules.encoders.adapter import Adapter, StyleAdapter, Adapter_light
 from ldm.modules.extra_condition.api import ExtraCondition
 from ldm.util import fix_cond_shapes, load_model_from_config, read_state_dict
@@ -56,8 +58,8 @@ def get_base_argument_parser() -> argparse.ArgumentParser:
         '--sampler',
         type=str,
         default='ddim',
-        choices=['ddim', 'plms'],
-        help='sampling algorithm, currently, only ddim and plms are supported, more are on the way',
+        choices=['ddim', 'plms', 'dpm'],
+        help='sampling algorithm, ddim, plms or dpm (DPM-Solver++ 2M, which needs only 15-20 steps)',
     )
 
     parser.add_argument(
@@ -167,15 +169,53 @@ def get_base_argument_parser() -> argparse.ArgumentParser:
         help='# of samples to generate',
     )
 
+    parser.add_argument(
+        '--attn_backend',
+        type=str,
+        default=None,
+        choices=['auto'] + list(BasicTransformerBlock.ATTENTION_MODES),
+        help='attention of the UNet transformer blocks, defaults to the ATTN_BACKEND environment variable (auto: '
+        'xformers if installed, else torch sdpa)',
+    )
+
+    parser.add_argument(
+        '--vae_attn_type',
+        type=str,
+        default=None,
+        choices=['vanilla', 'vanilla-dense', 'vanilla-sdpa', 'vanilla-chunked'],
+        help='attention of the VAE mid block, overrides the attn_type of the ddconfig (vanilla: xformers if '
+        'installed, else torch sdpa)',
+    )
+
+    parser.add_argument(
+        '--attn_chunk_size',
+        type=int,
+        default=None,
+        help='queries per slice of the softmax-sliced attention backend and of the vanilla-chunked VAE attention',
+    )
+
     return parser
 
 
+def apply_attention_options(opt, config):
+    """--attn_backend, --vae_attn_type and --attn_chunk_size, applied before the model is built from `config`"""
+    chunk_size = getattr(opt, 'attn_chunk_size', None)
+    if getattr(opt, 'attn_backend', None) is not None:
+        set_attention_backend(opt.attn_backend, chunk_size=chunk_size)
+    ddconfig = config.model.params.first_stage_config.params.ddconfig
+    if getattr(opt, 'vae_attn_type', None) is not None:
+        ddconfig.attn_type = opt.vae_attn_type
+    if ddconfig.get('attn_type', None) == 'vanilla-chunked' and chunk_size is not None:
+        ddconfig.attn_kwargs = {'chunk_size': chunk_size}
+
+
 def get_sd_models(opt):
     """
     build stable diffusion model, sampler
     """
     # SD
     config = OmegaConf.load(f"{opt.config}")
+    apply_attention_options(opt, config)
     model = load_model_from_config(config, opt.sd_ckpt, opt.vae_ckpt)
     sd_model = model.to(opt.device)
 
@@ -184,6 +224,8 @@ def get_sd_models(opt):
         sampler = PLMSSampler(model)
     elif opt.sampler == 'ddim':
         sampler = DDIMSampler(model)
+    elif opt.sampler == 'dpm':
+        sampler = DPMSolverSampler(model)
     else:
         raise NotImplementedError
 
@@ -192,6 +234,7 @@ def get_sd_models(opt):
 
 def get_t2i_adapter_models(opt):
     config = OmegaConf.load(f"{opt.config}")
+    apply_attention_options(opt, config)
     model = load_model_from_config(config, opt.sd_ckpt, opt.vae_ckpt)
     adapter_ckpt_path = getattr(opt, f'{opt.which_cond}_adapter_ckpt', None)
     if adapter_ckpt_path is None:
@@ -215,6 +258,8 @@ def get_t2i_adapter_models(opt):
         sampler = PLMSSampler(model)
     elif opt.sampler == 'ddim':
         sampler = DDIMSampler(model)
+    elif opt.sampler == 'dpm':
+        sampler = DPMSolverSampler(model)
     else:
         raise NotImplementedError
 
@@ -46,6 +46,10 @@ class DPMSolverSampler(object):
                unconditional_guidance_scale=1.,
                unconditional_conditioning=None,
                # this has to come in the same format as the conditioning, # e.g. as encoded tokens, ...
+               features_adapter=None,
+               append_to_context=None,
+               cond_tau=0.4,
+               style_cond_tau=1.0,
                **kwargs
                ):
         if conditioning is not None:
@@ -71,8 +75,26 @@ class DPMSolverSampler(object):
 
         ns = NoiseScheduleVP('discrete', alphas_cumprod=self.alphas_cumprod)
 
+        guided = unconditional_conditioning is not None and unconditional_guidance_scale != 1.
+        num_timesteps = self.model.num_timesteps
+
+        def apply_model(x, t, c):
+            # same windows as DDIM: the adapter (style context) is only used for the first `cond_tau`
+            # (`style_cond_tau`) part of the trajectory, here measured on the model input time t in [0, 1000)
+            progress = 1. - t[0].item() / num_timesteps
+            if append_to_context is not None and progress <= style_cond_tau:
+                pad_len = append_to_context.size(1)
+                if guided:
+                    uc, c = c.chunk(2)
+                    uc = torch.cat([uc, uc[:, -pad_len:, :]], dim=1)
+                    c = torch.cat([uc, torch.cat([c, append_to_context], dim=1)])
+                else:
+                    c = torch.cat([c, append_to_context], dim=1)
+            features = features_adapter if progress <= cond_tau else None
+            return self.model.apply_model(x, t, c, features_adapter=features)
+
         model_fn = model_wrapper(
-            lambda x, t, c: self.model.apply_model(x, t, c),
+            apply_model,
             ns,
             model_type=MODEL_TYPES[self.model.parameterization],
             guidance_type="classifier-free",
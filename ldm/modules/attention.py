@@ -23,6 +23,11 @@ _ATTN_PRECISION = os.environ.get("ATTN_PRECISION", "fp32")
 if os.environ.get("DISABLE_XFORMERS", "false").lower() == 'true':
     XFORMERS_IS_AVAILBLE = False
 
+# CrossAttn backend of the transformer blocks, one of BasicTransformerBlock.ATTENTION_MODES or "auto", see
+# set_attention_backend; the chunk size is the number of queries per slice of "softmax-sliced"
+_ATTN_BACKEND = os.environ.get("ATTN_BACKEND", "auto")
+_ATTN_CHUNK_SIZE = int(os.environ.get("ATTN_CHUNK_SIZE", 1024))
+
 
 def exists(val):
     return val is not None
@@ -173,6 +178,13 @@ class CrossAttention(nn.Module):
         v = self.to_v(context)
 
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> (b h) n d', h=h), (q, k, v))
+        out = self.attend(q, k, v, mask)
+        out = rearrange(out, '(b h) n d -> b n (h d)', h=h)
+        return self.to_out(out)
+
+    def attend(self, q, k, v, mask=None):
+        """softmax(q k^T * scale) v of the (b h) n d heads, materializes the full (b h) x n x m similarity matrix"""
+        h = self.heads
 
         # force cast to fp32 to avoid overflowing
         if _ATTN_PRECISION =="fp32":
@@ -193,9 +205,43 @@ class CrossAttention(nn.Module):
         # attention, what we cannot get enough of
         sim = sim.softmax(dim=-1)
 
-        out = einsum('b i j, b j d -> b i d', sim, v)
-        out = rearrange(out, '(b h) n d -> b n (h d)', h=h)
-        return self.to_out(out)
+        return einsum('b i j, b j d -> b i d', sim, v)
+
+
+class SDPACrossAttention(CrossAttention):
+    """
+    `CrossAttention` through torch.nn.functional.scaled_dot_product_attention, which picks a flash / memory-efficient
+    kernel where it can and never materializes the similarity matrix then. ATTN_PRECISION=fp32 (the default) is kept:
+    half precision q, k, v are upcast, as sdpa takes a single dtype, so only the memory-efficient kernel applies;
+    ATTN_PRECISION=fp16 lets half precision runs use the flash kernel.
+    """
+
+    def attend(self, q, k, v, mask=None):
+        dtype = v.dtype
+        q, k, v = map(lambda t: t.unflatten(0, (-1, self.heads)), (q, k, v))
+        if exists(mask):
+            mask = rearrange(mask, 'b ... -> b () () (...)')
+        # the default scale of sdpa, 1 / sqrt(dim_head), is self.scale
+        if _ATTN_PRECISION == "fp32":
+            # force cast to fp32 to avoid overflowing, like the default backend
+            with torch.autocast(enabled=False, device_type=q.device.type):
+                out = F.scaled_dot_product_attention(q.float(), k.float(), v.float(), attn_mask=mask)
+        else:
+            out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        return out.flatten(0, 1).to(dtype)
+
+
+class SlicedCrossAttention(CrossAttention):
+    """`CrossAttention` over slices of ATTN_CHUNK_SIZE queries, the similarity matrix is at most (b h) x chunk x m"""
+
+    def attend(self, q, k, v, mask=None):
+        chunk_size = _ATTN_CHUNK_SIZE
+        if q.shape[1] <= chunk_size:
+            return super().attend(q, k, v, mask)
+        out = []
+        for i in range(0, q.shape[1], chunk_size):
+            out.append(super().attend(q[:, i:i + chunk_size], k, v, mask))
+        return torch.cat(out, dim=1)
 
 
 class MemoryEfficientCrossAttention(nn.Module):
@@ -250,12 +296,14 @@ class MemoryEfficientCrossAttention(nn.Module):
 class BasicTransformerBlock(nn.Module):
     ATTENTION_MODES = {
         "softmax": CrossAttention,  # vanilla attention
-        "softmax-xformers": MemoryEfficientCrossAttention
+        "softmax-xformers": MemoryEfficientCrossAttention,
+        "softmax-sdpa": SDPACrossAttention,  # torch scaled_dot_product_attention
+        "softmax-sliced": SlicedCrossAttention,  # vanilla attention over slices of the queries
     }
     def __init__(self, dim, n_heads, d_head, dropout=0., context_dim=None, gated_ff=True, checkpoint=True,
                  disable_self_attn=False):
         super().__init__()
-        attn_mode = "softmax-xformers" if XFORMERS_IS_AVAILBLE else "softmax"
+        attn_mode = get_attention_backend()
         assert attn_mode in self.ATTENTION_MODES
         attn_cls = self.ATTENTION_MODES[attn_mode]
         self.disable_self_attn = disable_self_attn
@@ -269,6 +317,17 @@ class BasicTransformerBlock(nn.Module):
         self.norm3 = nn.LayerNorm(dim)
         self.checkpoint = checkpoint
 
+    def set_attention(self, attn_cls):
+        """rebuilds attn1 and attn2 as `attn_cls`, with the same weights"""
+        for name in ('attn1', 'attn2'):
+            attn = getattr(self, name)
+            if type(attn) is attn_cls:
+                continue
+            new_attn = attn_cls(query_dim=attn.to_q.in_features, context_dim=attn.to_k.in_features, heads=attn.heads,
+                                dim_head=attn.to_q.out_features // attn.heads, dropout=attn.to_out[1].p)
+            new_attn.load_state_dict(attn.state_dict())
+            setattr(self, name, new_attn.to(attn.to_q.weight).train(attn.training))
+
     def forward(self, x, context=None):
         return checkpoint(self._forward, (x, context), self.parameters(), self.checkpoint)
 
@@ -279,6 +338,40 @@ class BasicTransformerBlock(nn.Module):
         return x
 
 
+def get_attention_backend():
+    """the resolved backend: "auto" is xformers if available, else torch sdpa (torch >= 2.0), else vanilla"""
+    if _ATTN_BACKEND != "auto":
+        return _ATTN_BACKEND
+    if XFORMERS_IS_AVAILBLE:
+        return "softmax-xformers"
+    if hasattr(F, "scaled_dot_product_attention"):
+        return "softmax-sdpa"
+    return "softmax"
+
+
+def set_attention_backend(backend, chunk_size=None, model=None):
+    """
+    API counterpart of the ATTN_BACKEND / ATTN_CHUNK_SIZE environment variables: selects the attention of the
+    transformer blocks built from now on and, given a `model`, switches the blocks it already has.
+    backend: "auto" or one of BasicTransformerBlock.ATTENTION_MODES
+    chunk_size: queries per slice of "softmax-sliced"
+    """
+    global _ATTN_BACKEND, _ATTN_CHUNK_SIZE
+    if backend != "auto" and backend not in BasicTransformerBlock.ATTENTION_MODES:
+        raise ValueError(f'unknown attention backend {backend}, choose from '
+                         f'{["auto"] + list(BasicTransformerBlock.ATTENTION_MODES)}')
+    if backend == "softmax-xformers" and not XFORMERS_IS_AVAILBLE:
+        raise ValueError('the softmax-xformers attention backend needs xformers')
+    _ATTN_BACKEND = backend
+    if chunk_size is not None:
+        _ATTN_CHUNK_SIZE = chunk_size
+    if model is not None:
+        attn_cls = BasicTransformerBlock.ATTENTION_MODES[get_attention_backend()]
+        for module in model.modules():
+            if isinstance(module, BasicTransformerBlock):
+                module.set_attention(attn_cls)
+
+
 class SpatialTransformer(nn.Module):
     """
     Transformer block for image-like data.
@@ -2,6 +2,7 @@
 import math
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 from einops import rearrange
 from typing import Optional, Any
@@ -183,6 +184,13 @@ class AttnBlock(nn.Module):
         k = self.k(h_)
         v = self.v(h_)
 
+        h_ = self.attend(q, k, v)
+        h_ = self.proj_out(h_)
+
+        return x+h_
+
+    def attend(self, q, k, v):
+        """single-head attention over the h*w positions of b,c,h,w q, k, v, with a dense b,hw,hw weight matrix"""
         # compute attention
         b,c,h,w = q.shape
         q = q.reshape(b,c,h*w)
@@ -196,11 +204,45 @@ class AttnBlock(nn.Module):
         v = v.reshape(b,c,h*w)
         w_ = w_.permute(0,2,1)   # b,hw,hw (first hw of k, second of q)
         h_ = torch.bmm(v,w_)     # b, c,hw (hw of q) h_[b,c,j] = sum_i v[b,c,i] w_[b,i,j]
-        h_ = h_.reshape(b,c,h,w)
+        return h_.reshape(b,c,h,w)
 
-        h_ = self.proj_out(h_)
 
-        return x+h_
+class SDPAAttnBlock(AttnBlock):
+    """
+    `AttnBlock` through torch.nn.functional.scaled_dot_product_attention: with a flash / memory-efficient kernel the
+    hw x hw weights are never materialized, memory grows linearly with the number of positions
+    """
+    def attend(self, q, k, v):
+        b,c,h,w = q.shape
+        # the fused kernels need the channels contiguous, a strided view falls back to the dense math
+        q, k, v = map(lambda t: rearrange(t, 'b c h w -> b 1 (h w) c').contiguous(), (q, k, v))
+        # the default scale of sdpa is c**(-0.5)
+        h_ = F.scaled_dot_product_attention(q, k, v)
+        return rearrange(h_, 'b 1 (h w) c -> b c h w', h=h, w=w)
+
+
+class ChunkedAttnBlock(AttnBlock):
+    """
+    `AttnBlock` over chunks of `chunk_size` query positions: the weights are at most b x chunk_size x hw at a time,
+    same math as the dense block otherwise
+    """
+    def __init__(self, in_channels, chunk_size=4096):
+        super().__init__(in_channels)
+        self.chunk_size = chunk_size
+
+    def attend(self, q, k, v):
+        b,c,h,w = q.shape
+        q = q.reshape(b,c,h*w)
+        q = q.permute(0,2,1)   # b,hw,c
+        k = k.reshape(b,c,h*w) # b,c,hw
+        v = v.reshape(b,c,h*w)
+        h_ = torch.empty_like(v)
+        for i in range(0, h*w, self.chunk_size):
+            w_ = torch.bmm(q[:, i:i + self.chunk_size], k)     # b,chunk,hw
+            w_ = w_ * (int(c)**(-0.5))
+            w_ = torch.nn.functional.softmax(w_, dim=2)
+            h_[:, :, i:i + self.chunk_size] = torch.bmm(v, w_.permute(0,2,1))     # b,c,chunk
+        return h_.reshape(b,c,h,w)
 
 class MemoryEfficientAttnBlock(nn.Module):
     """
@@ -278,13 +320,25 @@ class MemoryEfficientCrossAttentionWrapper(MemoryEfficientCrossAttention):
 
 
 def make_attn(in_channels, attn_type="vanilla", attn_kwargs=None):
-    assert attn_type in ["vanilla", "vanilla-xformers", "memory-efficient-cross-attn", "linear", "none"], f'attn_type {attn_type} unknown'
+    """
+    attn_type "vanilla" builds the xformers block if xformers is installed, else the torch sdpa one (torch >= 2.0);
+    "vanilla-dense" always builds the dense AttnBlock, "vanilla-chunked" takes attn_kwargs=dict(chunk_size=...)
+    """
+    assert attn_type in ["vanilla", "vanilla-dense", "vanilla-xformers", "vanilla-sdpa", "vanilla-chunked",
+                         "memory-efficient-cross-attn", "linear", "none"], f'attn_type {attn_type} unknown'
     if XFORMERS_IS_AVAILBLE and attn_type == "vanilla":
         attn_type = "vanilla-xformers"
+    elif hasattr(F, "scaled_dot_product_attention") and attn_type == "vanilla":
+        attn_type = "vanilla-sdpa"
     print(f"making attention of type '{attn_type}' with {in_channels} in_channels")
-    if attn_type == "vanilla":
+    if attn_type in ["vanilla", "vanilla-dense"]:
         assert attn_kwargs is None
         return AttnBlock(in_channels)
+    elif attn_type == "vanilla-sdpa":
+        assert attn_kwargs is None
+        return SDPAAttnBlock(in_channels)
+    elif attn_type == "vanilla-chunked":
+        return ChunkedAttnBlock(in_channels, **(attn_kwargs or {}))
     elif attn_type == "vanilla-xformers":
         print(f"building MemoryEfficientAttnBlock with {in_channels} in_channels...")
         return MemoryEfficientAttnBlock(in_channels)
@@ -300,7 +354,7 @@ def make_attn(in_channels, attn_type="vanilla", attn_kwargs=None):
 class Model(nn.Module):
     def __init__(self, *, ch, out_ch, ch_mult=(1,2,4,8), num_res_blocks,
                  attn_resolutions, dropout=0.0, resamp_with_conv=True, in_channels,
-                 resolution, use_timestep=True, use_linear_attn=False, attn_type="vanilla"):
+                 resolution, use_timestep=True, use_linear_attn=False, attn_type="vanilla", attn_kwargs=None):
         super().__init__()
         if use_linear_attn: attn_type = "linear"
         self.ch = ch
@@ -343,7 +397,7 @@ class Model(nn.Module):
                                          dropout=dropout))
                 block_in = block_out
                 if curr_res in attn_resolutions:
-                    attn.append(make_attn(block_in, attn_type=attn_type))
+                    attn.append(make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs))
             down = nn.Module()
             down.block = block
             down.attn = attn
@@ -358,7 +412,7 @@ class Model(nn.Module):
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
                                        dropout=dropout)
-        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type)
+        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs)
         self.mid.block_2 = ResnetBlock(in_channels=block_in,
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
@@ -380,7 +434,7 @@ class Model(nn.Module):
                                          dropout=dropout))
                 block_in = block_out
                 if curr_res in attn_resolutions:
-                    attn.append(make_attn(block_in, attn_type=attn_type))
+                    attn.append(make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs))
             up = nn.Module()
             up.block = block
             up.attn = attn
@@ -453,7 +507,7 @@ class Encoder(nn.Module):
     def __init__(self, *, ch, out_ch, ch_mult=(1,2,4,8), num_res_blocks,
                  attn_resolutions, dropout=0.0, resamp_with_conv=True, in_channels,
                  resolution, z_channels, double_z=True, use_linear_attn=False, attn_type="vanilla",
-                 **ignore_kwargs):
+                 attn_kwargs=None, **ignore_kwargs):
         super().__init__()
         if use_linear_attn: attn_type = "linear"
         self.ch = ch
@@ -486,7 +540,7 @@ class Encoder(nn.Module):
                                          dropout=dropout))
                 block_in = block_out
                 if curr_res in attn_resolutions:
-                    attn.append(make_attn(block_in, attn_type=attn_type))
+                    attn.append(make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs))
             down = nn.Module()
             down.block = block
             down.attn = attn
@@ -501,7 +555,7 @@ class Encoder(nn.Module):
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
                                        dropout=dropout)
-        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type)
+        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs)
         self.mid.block_2 = ResnetBlock(in_channels=block_in,
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
@@ -547,7 +601,7 @@ class Decoder(nn.Module):
     def __init__(self, *, ch, out_ch, ch_mult=(1,2,4,8), num_res_blocks,
                  attn_resolutions, dropout=0.0, resamp_with_conv=True, in_channels,
                  resolution, z_channels, give_pre_end=False, tanh_out=False, use_linear_attn=False,
-                 attn_type="vanilla", **ignorekwargs):
+                 attn_type="vanilla", attn_kwargs=None, **ignorekwargs):
         super().__init__()
         if use_linear_attn: attn_type = "linear"
         self.ch = ch
@@ -580,7 +634,7 @@ class Decoder(nn.Module):
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
                                        dropout=dropout)
-        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type)
+        self.mid.attn_1 = make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs)
         self.mid.block_2 = ResnetBlock(in_channels=block_in,
                                        out_channels=block_in,
                                        temb_channels=self.temb_ch,
@@ -599,7 +653,7 @@ class Decoder(nn.Module):
                                          dropout=dropout))
                 block_in = block_out
                 if curr_res in attn_resolutions:
-                    attn.append(make_attn(block_in, attn_type=attn_type))
+                    attn.append(make_attn(block_in, attn_type=attn_type, attn_kwargs=attn_kwargs))
             up = nn.Module()
             up.block = block
             up.attn = attn
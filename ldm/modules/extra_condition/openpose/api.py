@@ -9,13 +9,15 @@ import torch
 
 from . import util
 from .body import Body
+from .hand import Hand
 
 remote_model_path = "https://huggingface.co/TencentARC/T2I-Adapter/blob/main/third-party-models/body_pose_model.pth"
+remote_hand_model_path = "https://huggingface.co/lllyasviel/Annotators/resolve/main/hand_pose_model.pth"
 
 
 class OpenposeInference(nn.Module):
 
-    def __init__(self):
+    def __init__(self, hand=False):
         super().__init__()
         body_modelpath = os.path.join('models', "body_pose_model.pth")
 
@@ -25,11 +27,45 @@ class OpenposeInference(nn.Module):
 
         self.body_estimation = Body(body_modelpath)
 
+        self.hand_estimation = None
+        if hand:
+            hand_modelpath = os.path.join('models', "hand_pose_model.pth")
+            if not os.path.exists(hand_modelpath):
+                from basicsr.utils.download_util import load_file_from_url
+                load_file_from_url(remote_hand_model_path, model_dir='models')
+            self.hand_estimation = Hand(hand_modelpath)
+
     def forward(self, x):
-        x = x[:, :, ::-1].copy()
+        return self.batch([x])[0]
+
+    def batch(self, images):
+        """
+        Pose maps of a list of HWC RGB numpy images, in order. The body model runs once per batch (and scale); with
+        `hand=True` the hand crops of all images are gathered into one batched pass of the hand model.
+        """
+        images = [x[:, :, ::-1].copy() for x in images]
         with torch.no_grad():
-            candidate, subset = self.body_estimation(x)
-            canvas = np.zeros_like(x)
-            canvas = util.draw_bodypose(canvas, candidate, subset)
-            canvas = cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR)
-        return canvas
+            poses = self.body_estimation.batch(images)
+
+            all_hand_peaks = [[] for _ in images]
+            if self.hand_estimation is not None:
+                crops, owners = [], []
+                for i, (x, (candidate, subset)) in enumerate(zip(images, poses)):
+                    for x0, y0, w, is_left in util.handDetect(candidate, subset, x):
+                        crops.append(x[y0:y0 + w, x0:x0 + w, :])
+                        owners.append((i, x0, y0))
+                for peaks, (i, x0, y0) in zip(self.hand_estimation.batch(crops), owners):
+                    # undetected keypoints stay at [0, 0]
+                    peaks[:, 0] = np.where(peaks[:, 0] == 0, peaks[:, 0], peaks[:, 0] + x0)
+                    peaks[:, 1] = np.where(peaks[:, 1] == 0, peaks[:, 1], peaks[:, 1] + y0)
+                    all_hand_peaks[i].append(peaks)
+
+            canvases = []
+            for x, (candidate, subset), hand_peaks in zip(images, poses, all_hand_peaks):
+                canvas = np.zeros_like(x)
+                canvas = util.draw_bodypose(canvas, candidate, subset)
+                if hand_peaks:
+                    canvas = util.draw_handpose(canvas, hand_peaks)
+                canvas = cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR)
+                canvases.append(canvas)
+        return canvases
@@ -3,6 +3,8 @@ import math
 import cv2
 import matplotlib
 import numpy as np
+import torch
+import torch.nn.functional as F
 
 
 def padRightDownCorner(img, stride, padValue):
@@ -28,6 +30,39 @@ def padRightDownCorner(img, stride, padValue):
     return img_padded, pad
 
 
+def stack_padded(images, stride, padValue):
+    """
+    Batch counterpart of `padRightDownCorner`: pads the images right and down with `padValue` to the size of the
+    largest one, rounded up to a multiple of `stride`, and stacks them into the normalized N x 3 x H x W float tensor
+    the networks take. Returns the batch and the (h, w) of every image in it.
+    """
+    h = max(img.shape[0] for img in images)
+    w = max(img.shape[1] for img in images)
+    h, w = h + (-h % stride), w + (-w % stride)
+    batch = np.full((len(images), h, w, 3), padValue, dtype=np.float32)
+    for i, img in enumerate(images):
+        batch[i, :img.shape[0], :img.shape[1]] = img
+    batch = np.ascontiguousarray(np.transpose(batch, (0, 3, 1, 2))) / 256 - 0.5
+    return torch.from_numpy(batch), [img.shape[:2] for img in images]
+
+
+def upsample_map(maps, size, out_size, stride):
+    """
+    The resizes of a network output: upsamples the 1 x C x h x w `maps` by `stride`, removes the padding (crops to the
+    `size` of the image in the batch) and resizes to the (H, W) `out_size` of the original image, all bicubic. Runs on
+    the device of `maps`, with cv2 on cpu (faster there, and the maps stay HWC in memory). Returns C x H x W.
+    """
+    if maps.device.type == 'cpu':
+        maps = np.transpose(maps[0].numpy(), (1, 2, 0))
+        maps = cv2.resize(maps, (0, 0), fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
+        maps = maps[:size[0], :size[1], :]
+        maps = cv2.resize(maps, (out_size[1], out_size[0]), interpolation=cv2.INTER_CUBIC)
+        return torch.from_numpy(maps).permute(2, 0, 1)
+    maps = F.interpolate(maps, scale_factor=stride, mode='bicubic', align_corners=False)
+    maps = maps[:, :, :size[0], :size[1]]
+    return F.interpolate(maps, size=tuple(out_size), mode='bicubic', align_corners=False)[0]
+
+
 # transfer caffe model to pytorch which will match the layer name
 def transfer(model, model_weights):
     transfered_model_weights = {}
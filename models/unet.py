@@ -17,7 +17,7 @@ class UNet(UNet2DConditionModel):
         mid_block_additional_residual: Optional[torch.Tensor] = None,
         encoder_attention_mask: Optional[torch.Tensor] = None,
         return_dict: bool = True,
-        additional_scale: float = 1,
+        additional_scale: Union[float, List[float]] = 1,
     ) -> Union[UNet2DConditionOutput, Tuple]:
         r"""
         The [`UNet2DConditionModel`] forward method.
@@ -40,6 +40,11 @@ class UNet(UNet2DConditionModel):
             added_cond_kwargs: (`dict`, *optional*):
                 A kwargs dictionary containin additional embeddings that if specified are added to the embeddings that
                 are passed along to the UNet blocks.
+            down_block_additional_residuals (`list` or `tuple` of `torch.Tensor`, *optional*):
+                T2I-Adapter feature pyramid. The residuals are only read by index and never modified, so the same list
+                can be passed on every denoising step without copying it.
+            additional_scale (`float` or `list` of `float`, *optional*, defaults to 1):
+                Scale applied to the adapter residuals, either one value for all levels or one value per level.
 
         Returns:
             [`~models.unet_2d_condition.UNet2DConditionOutput`] or `tuple`:
@@ -213,13 +218,25 @@ class UNet(UNet2DConditionModel):
 
         down_block_res_samples = (sample,)
 
+        # adapter residuals are consumed by index so the caller's pyramid is left untouched
+        adapter_idx = 0
+
+        def next_adapter_residual():
+            nonlocal adapter_idx
+            if not is_adapter or adapter_idx >= len(down_block_additional_residuals):
+                return None
+            residual = down_block_additional_residuals[adapter_idx]
+            scale = additional_scale[adapter_idx] if isinstance(additional_scale, (list, tuple)) else additional_scale
+            adapter_idx += 1
+            return residual if scale == 1 else residual * scale
+
         for i, downsample_block in enumerate(self.down_blocks):
             if hasattr(downsample_block, "has_cross_attention") and downsample_block.has_cross_attention:
                 # For t2i-adapter CrossAttnDownBlock2D
                 additional_residuals = {}
-                if is_adapter and len(down_block_additional_residuals) > 0:
-                    additional_residuals["additional_residuals"] = down_block_additional_residuals.pop(0)
-                    # additional_residuals["additional_scale"] = additional_scale
+                residual = next_adapter_residual()
+                if residual is not None:
+                    additional_residuals["additional_residuals"] = residual
 
                 sample, res_samples = downsample_block(
                     hidden_states=sample,
@@ -233,8 +250,9 @@ class UNet(UNet2DConditionModel):
             else:
                 sample, res_samples = downsample_block(hidden_states=sample, temb=emb)
 
-                if is_adapter and len(down_block_additional_residuals) > 0:
-                    sample += down_block_additional_residuals.pop(0) * additional_scale
+                residual = next_adapter_residual()
+                if residual is not None:
+                    sample += residual
 
             down_block_res_samples += res_samples
 
@@ -260,8 +278,9 @@ class UNet(UNet2DConditionModel):
                 encoder_attention_mask=encoder_attention_mask,
             )
             # only add this two lines to support T2I-Adapter-XL 
-            if is_adapter and len(down_block_additional_residuals) > 0:
-                sample += down_block_additional_residuals.pop(0) * additional_scale
+            residual = next_adapter_residual()
+            if residual is not None:
+                sample += residual
 
         if is_controlnet:
             sample = sample + mid_block_additional_residual
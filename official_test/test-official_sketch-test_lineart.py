@@ -7,7 +7,6 @@ import datetime
 from huggingface_hub import hf_hub_url
 import subprocess
 import shlex
-import copy
 import numpy as np
 from PIL import Image
 from basicsr.utils import tensor2img
@@ -169,7 +168,7 @@ if __name__ == '__main__':
                 prompt = prompt,
                 prompt_n = global_opt.neg_prompt,
                 steps = global_opt.steps,
-                adapter_features = copy.deepcopy(adapter_features),
+                adapter_features = adapter_features,
                 guidance_scale = global_opt.scale,
                 size = (cond.shape[-2], cond.shape[-1]),
                 seed= global_opt.seed,
@@ -1,12 +1,12 @@
 from omegaconf import OmegaConf
 import torch
+import torch.nn.functional as F
 import os
 import cv2
 import datetime
 from huggingface_hub import hf_hub_url
 import subprocess
 import shlex
-import copy
 from basicsr.utils import tensor2img
 
 from Adapter.Sampling import diffusion_inference
@@ -14,6 +14,8 @@ from configs.utils import instantiate_from_config
 from Adapter.inference_base import get_base_argument_parser
 from Adapter.extra_condition.api import get_cond_model, ExtraCondition
 from Adapter.extra_condition import api
+from Adapter.composer import AdapterComposer
+from Adapter.models.adapter_export import export_adapter_xl
 
 urls = {
     'TencentARC/T2I-Adapter':[
@@ -45,55 +47,94 @@ parser.add_argument(
 parser.add_argument(
     '--config',
     type=str,
-    default='configs/inference/Adapter-XL-depth.yaml',
-    help='config path to T2I-Adapter',
+    nargs='+',
+    default=['configs/inference/Adapter-XL-depth.yaml'],
+    help='config path to T2I-Adapter, several configs compose their adapters',
 )
 parser.add_argument(
     '--path_source',
     type=str,
-    default='examples/dog.png',
-    help='config path to the source image',
+    nargs='+',
+    default=['examples/dog.png'],
+    help='config path to the source image, one for all adapters or one per config',
 )
 parser.add_argument(
     '--in_type',
     type=str,
-    default='image',
-    help='config path to the source image',
+    nargs='+',
+    default=['image'],
+    help='config path to the source image, one for all adapters or one per config',
 )
 global_opt = parser.parse_args()
 global_opt.device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
 
 if __name__ == '__main__':
-    config = OmegaConf.load(global_opt.config)
+    num_adapters = len(global_opt.config)
+    for name in ('path_source', 'in_type', 'cond_weight'):
+        if len(getattr(global_opt, name)) not in (1, num_adapters):
+            parser.error(f'--{name} takes one value for all adapters or one per --config ({num_adapters})')
+    path_sources = global_opt.path_source * num_adapters if len(global_opt.path_source) == 1 else global_opt.path_source
+    in_types = global_opt.in_type * num_adapters if len(global_opt.in_type) == 1 else global_opt.in_type
+    cond_weights = global_opt.cond_weight * num_adapters if len(global_opt.cond_weight) == 1 else global_opt.cond_weight
+
     # Adapter creation
-    cond_name = config.model.params.adapter_config.name
-    adapter_config = config.model.params.adapter_config
-    adapter = instantiate_from_config(adapter_config).cuda()
-    adapter.load_state_dict(torch.load(config.model.params.adapter_config.pretrained))
-    cond_model = get_cond_model(global_opt, getattr(ExtraCondition, cond_name))
-    process_cond_module = getattr(api, f'get_cond_{cond_name}')
+    cond_names, adapters, conds = [], [], []
+    for config_path, path_source, in_type, cond_weight in zip(global_opt.config, path_sources, in_types, cond_weights):
+        config = OmegaConf.load(config_path)
+        cond_name = config.model.params.adapter_config.name
+        adapter_config = config.model.params.adapter_config
+        adapter = instantiate_from_config(adapter_config).cuda()
+        adapter.load_state_dict(torch.load(config.model.params.adapter_config.pretrained))
+        if global_opt.adapter_export is not None:
+            adapter = export_adapter_xl(adapter, backend=global_opt.adapter_export)
+        cond_model = get_cond_model(global_opt, getattr(ExtraCondition, cond_name))
+        process_cond_module = getattr(api, f'get_cond_{cond_name}')
+        cond = process_cond_module(
+            global_opt,
+            path_source,
+            cond_inp_type = in_type,
+            cond_model = cond_model
+        )
+        cond_names.append(cond_name)
+        adapters.append({'model': adapter, 'cond_weight': cond_weight})
+        conds.append(cond)
+    cond_name = '+'.join(cond_names)
+    composer = AdapterComposer()
+
+    # the pyramids are summed, so every adapter needs the same input size: conditions from sources of another aspect
+    # ratio are resized to the first one
+    size = tuple(conds[0].shape[-2:])
+    for i, (name, path_source) in enumerate(zip(cond_names, path_sources)):
+        if tuple(conds[i].shape[-2:]) != size:
+            print(f'{name} condition of {path_source} is {conds[i].shape[-1]}x{conds[i].shape[-2]}, '
+                  f'resized to {size[1]}x{size[0]} to match {cond_names[0]}')
+            conds[i] = F.interpolate(conds[i], size=size, mode='bilinear', align_corners=False)
 
     # diffusion sampler creation
-    sampler = diffusion_inference(global_opt.model_id)
+    sampler = diffusion_inference(
+        global_opt.model_id,
+        placement=global_opt.placement,
+        memory_budget=None if global_opt.memory_budget_gb is None else int(global_opt.memory_budget_gb * 2**30),
+        vae_tile_size=global_opt.vae_tile_size,
+        dtype=global_opt.dtype,
+        upcast_vae=not global_opt.no_vae_upcast,
+        scheduler=global_opt.sampler,
+    )
     
     # diffusion generation
-    cond = process_cond_module(
-        global_opt,
-        global_opt.path_source, 
-        cond_inp_type = global_opt.in_type, 
-        cond_model = cond_model
-    )
     with torch.no_grad():
-        adapter_features = adapter(cond)
+        adapter_features = composer(conds, adapters)
         result = sampler.inference(
             prompt = global_opt.prompt, 
             prompt_n = global_opt.neg_prompt,
             steps = global_opt.steps,
-            adapter_features = copy.deepcopy(adapter_features), 
+            adapter_features = adapter_features, 
             guidance_scale = global_opt.scale,
-            size = (cond.shape[-2], cond.shape[-1]),
+            size = size,
             seed= global_opt.seed,
+            guidance_interval = global_opt.guidance_interval,
         )
+    sampler.placement.report()
 
     # save results
     root_results = os.path.join('results', cond_name)
@@ -102,6 +143,8 @@ if __name__ == '__main__':
     now = datetime.datetime.now()
     formatted_date = now.strftime("%Y-%m-%d")
     formatted_time = now.strftime("%H:%M:%S")
-    im_cond = tensor2img(cond)
     cv2.imwrite(os.path.join(root_results, formatted_date+'-'+formatted_time+'_image.png'), result)
-    cv2.imwrite(os.path.join(root_results, formatted_date+'-'+formatted_time+'_condition.png'), im_cond)
+    for name, cond in zip(cond_names, conds):
+        im_cond = tensor2img(cond)
+        suffix = '_condition.png' if num_adapters == 1 else f'_condition_{name}.png'
+        cv2.imwrite(os.path.join(root_results, formatted_date+'-'+formatted_time+suffix), im_cond)
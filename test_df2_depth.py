@@ -10,7 +10,6 @@ import datetime
 from huggingface_hub import hf_hub_url
 import subprocess
 import shlex
-import copy
 from basicsr.utils import tensor2img
 
 from Adapter.Sampling import diffusion_inference
@@ -125,7 +124,7 @@ if __name__ == '__main__':
                 prompt=global_opt.prompt,
                 # prompt_n=global_opt.neg_prompt,
                 steps=global_opt.steps,
-                adapter_features=copy.deepcopy(adapter_features),
+                adapter_features=adapter_features,
                 guidance_scale=global_opt.scale,
                 size=(cond.shape[-2], cond.shape[-1]),
                 seed=global_opt.seed,
@@ -0,0 +1,97 @@
+"""
+Parity and CPU latency of the inference exports of Adapter_XL (Adapter.models.adapter_export) against the plain
+module, with the shipped adapter settings (cin=256, ksize=1, sk=True, use_conv=False). Random weights unless
+`--config` points to an adapter inference config with a checkpoint. Exits non-zero if any export differs from the
+plain module by more than `--tolerance` (max abs, relative to the feature scale), or if exporting changed the source
+adapter (its weights, their memory format or requires_grad).
+
+    python tool/benchmark/adapter_export.py --resolution 1024 --threads 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Adapter.models.adapter_export import EXPORT_BACKENDS, export_adapter_xl
+from Adapter.models.adapters import Adapter_XL
+from configs.utils import instantiate_from_config
+
+
+def time_forward(model, x, iters, warmup=2):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+    return (time.perf_counter() - start) / iters * 1000
+
+
+def snapshot(module):
+    return {name: (p.detach().clone(), p.stride(), p.requires_grad) for name, p in module.named_parameters()}
+
+
+def unchanged(module, before):
+    after = snapshot(module)
+    return after.keys() == before.keys() and all(
+        torch.equal(after[name][0], p) and after[name][1:] == (stride, requires_grad)
+        for name, (p, stride, requires_grad) in before.items())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default=None, help='adapter inference config to load the weights from')
+    parser.add_argument('--resolution', type=int, default=1024)
+    parser.add_argument('--cond_channels', type=int, default=1, help='1 for sketch / canny, 3 for rgb conditions')
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--no_channels_last', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    opt = parser.parse_args()
+
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    torch.manual_seed(0)
+    if opt.config is None:
+        adapter = Adapter_XL(cin=256 * opt.cond_channels, channels=[320, 640, 1280, 1280], nums_rb=2, ksize=1, sk=True,
+                             use_conv=False)
+    else:
+        adapter_config = OmegaConf.load(opt.config).model.params.adapter_config
+        adapter = instantiate_from_config(adapter_config)
+        adapter.load_state_dict(torch.load(adapter_config.pretrained, map_location='cpu'))
+    adapter.eval()
+    source = snapshot(adapter)
+    x = torch.rand(1, adapter.conv_in.in_channels // 256, opt.resolution, opt.resolution)
+
+    with torch.no_grad():
+        reference = adapter(x)
+    ms_plain = time_forward(adapter, x, opt.iters)
+    print(f'[plain] {opt.resolution}px, {torch.get_num_threads()} threads: {ms_plain:.1f} ms')
+
+    passed = True
+    for backend in EXPORT_BACKENDS:
+        try:
+            model = export_adapter_xl(adapter, backend=backend, channels_last=not opt.no_channels_last)
+            with torch.no_grad():
+                features = model(x)
+        except Exception as e:
+            print(f'[{backend}] failed: {type(e).__name__}: {e}')
+            continue
+        err = max(((f - r).abs().max() / r.abs().max()).item() for f, r in zip(features, reference))
+        ms = time_forward(model, x, opt.iters)
+        same_source = unchanged(adapter, source)
+        ok = err <= opt.tolerance and [f.shape for f in features] == [r.shape for r in reference] and same_source
+        passed = passed and ok
+        print(f'[{backend}] {ms:.1f} ms (x{ms_plain / ms:.2f}), max rel err {err:.2e}, source adapter '
+              f'{"unchanged" if same_source else "modified"} ==> {"PASS" if ok else "FAIL"}')
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
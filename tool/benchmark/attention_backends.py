@@ -0,0 +1,121 @@
+"""
+Latency and peak memory of the CrossAttention backends of ldm/modules/attention.py
+(BasicTransformerBlock.ATTENTION_MODES) on the first-level self-attention of the SD1.x UNet (320 channels, 8 heads of
+40) at `--resolution` px, plus its cross-attention to 77 text tokens. The outputs are compared with the vanilla einsum
+attention. Peak memory is torch.cuda.max_memory_allocated on gpu; on cpu, the peak RSS growth of a child process
+running that backend alone.
+
+    python tool/benchmark/attention_backends.py --resolution 768 --batch_size 2 --chunk_size 1024
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from ldm.modules import attention
+from ldm.modules.attention import BasicTransformerBlock, set_attention_backend
+
+
+def make_inputs(opt, device):
+    torch.manual_seed(0)
+    tokens = (opt.resolution // 8) ** 2
+    x = torch.randn(opt.batch_size, tokens, 320, device=device)
+    context = torch.randn(opt.batch_size, 77, 768, device=device)
+    self_attn = attention.CrossAttention(320, heads=8, dim_head=40).to(device).eval()
+    cross_attn = attention.CrossAttention(320, context_dim=768, heads=8, dim_head=40).to(device).eval()
+    return x, context, self_attn, cross_attn
+
+
+def run_backend(opt, backend, result=None):
+    device = torch.device(opt.device)
+    set_attention_backend(backend, chunk_size=opt.chunk_size)
+    x, context, self_attn, cross_attn = make_inputs(opt, device)
+    attn_cls = BasicTransformerBlock.ATTENTION_MODES[backend]
+    modules = []
+    for reference in (self_attn, cross_attn):
+        module = attn_cls(query_dim=320, context_dim=reference.to_k.in_features, heads=8, dim_head=40).to(device)
+        module.load_state_dict(reference.state_dict())
+        modules.append(module.eval())
+
+    def forward():
+        with torch.no_grad():
+            out = (modules[0](x), modules[1](x, context))
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        return out
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    out = forward()
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+
+    start = time.perf_counter()
+    for _ in range(opt.iters):
+        forward()
+    ms = (time.perf_counter() - start) / opt.iters * 1000
+
+    if opt.check:
+        with torch.no_grad():
+            reference = (self_attn(x), cross_attn(x, context))
+        err = max((o - r).abs().max().item() for o, r in zip(out, reference))
+    else:
+        err = float('nan')
+    stats = {'ms': ms, 'peak': peak, 'err': err}
+    if result is not None:
+        result.update(stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolution', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=2, help='2 = one image with classifier-free guidance')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='queries per slice of softmax-sliced')
+    parser.add_argument('--backends', type=str, nargs='+', default=None)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--no_check', dest='check', action='store_false',
+                        help='skip the comparison with vanilla attention (it needs the full similarity matrix)')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+
+    backends = opt.backends
+    if backends is None:
+        backends = [b for b in BasicTransformerBlock.ATTENTION_MODES
+                    if b != 'softmax-xformers' or attention.XFORMERS_IS_AVAILBLE]
+    print(f'{opt.batch_size} x {(opt.resolution // 8) ** 2} tokens ({opt.resolution}px), {opt.device}')
+    for backend in backends:
+        if opt.device == 'cpu':
+            # a fresh process per backend, so its peak RSS is its own
+            with multiprocessing.Manager() as manager:
+                result = manager.dict()
+                process = multiprocessing.get_context('spawn').Process(target=run_backend, args=(opt, backend, result))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f'[{backend}] failed (exit code {process.exitcode}, out of memory?)')
+                    continue
+                stats = dict(result)
+        else:
+            try:
+                stats = run_backend(opt, backend)
+            except torch.cuda.OutOfMemoryError:
+                print(f'[{backend}] out of memory')
+                torch.cuda.empty_cache()
+                continue
+        diff = f', max abs diff to softmax {stats["err"]:.1e}' if opt.check else ''
+        print(f'[{backend}] {stats["ms"]:.1f} ms, peak +{stats["peak"] / 2 ** 20:.0f} MiB{diff}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Throughput of the DPT depth extraction in condition_extractor/depth_multi.py: the former path (DPTFeatureExtractor on
+the host, per-sample `np.max` normalization and a PIL image per sample) against the batched GPU path of `DPTModel`,
+plus the difference between the uint8 maps of both.
+
+    python tool/benchmark/depth_extract.py --resolution 1024 --batch_size 16 --steps 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from condition_extractor.depth_multi import DPTModel
+
+
+def legacy_depth(dpt, images):
+    # the former DPTModel.__call__
+    inputs = dpt.feature_extractor(images=list(images.cpu().numpy()), return_tensors="pt").to('cuda')
+    with torch.no_grad():
+        predicted_depths = dpt.model(**inputs).predicted_depth
+        predictions = torch.nn.functional.interpolate(
+            predicted_depths.unsqueeze(1),
+            size=tuple(images[0].shape[:2]),
+            mode="bicubic",
+            align_corners=False,
+        )
+    depths = []
+    for prediction in predictions:
+        output = prediction.squeeze().cpu().numpy()
+        depths.append(Image.fromarray((output * 255 / np.max(output)).astype("uint8")))
+    return depths
+
+
+def time_steps(fn, steps):
+    fn()
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='Intel/dpt-hybrid-midas')
+    parser.add_argument('--resolution', type=int, default=1024)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--image', type=str, default=None, help='optional real image for the parity check')
+    opt = parser.parse_args()
+
+    dpt = DPTModel(opt.model)
+    if opt.image is not None:
+        image = Image.open(opt.image).convert('RGB').resize((opt.resolution, opt.resolution), Image.BICUBIC)
+        images = torch.from_numpy(np.array(image))[None].repeat(opt.batch_size, 1, 1, 1)
+    else:
+        images = torch.randint(0, 256, (opt.batch_size, opt.resolution, opt.resolution, 3), dtype=torch.uint8)
+    images = images.pin_memory()
+
+    legacy = np.stack([np.array(depth) for depth in legacy_depth(dpt, images.cuda())])
+    batched = dpt(images.cuda(), output_type='np')
+    diff = np.abs(legacy.astype(np.int16) - batched.astype(np.int16))
+    print(f'[parity] max abs diff {diff.max()}, mean abs diff {diff.mean():.3f} (uint8 levels)')
+
+    num = opt.batch_size * opt.steps
+    t_legacy = time_steps(lambda: legacy_depth(dpt, images.cuda(non_blocking=True)), opt.steps)
+    t_batched = time_steps(lambda: dpt(images.cuda(non_blocking=True), output_type='np'), opt.steps)
+    print(f'[{opt.resolution}px bs={opt.batch_size}] legacy: {num / t_legacy:.1f} img/s | '
+          f'gpu batched: {num / t_batched:.1f} img/s | speedup x{t_legacy / t_batched:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Parity and throughput of the `dtype` option of Adapter.Sampling.diffusion_inference: the same prompt, seed and
+(optional) adapter condition are sampled in fp32 and in half precision, and the images are compared. Exits non-zero
+if their PSNR is below `--min_psnr` (sampling amplifies rounding differences over the steps, so the images are close
+rather than equal; a broken half-precision path, e.g. NaNs or an overflowing VAE, lands far below it).
+
+    python tool/benchmark/half_precision.py --dtype fp16 --steps 30
+    python tool/benchmark/half_precision.py --dtype bf16 --config configs/inference/Adapter-XL-sketch.yaml \
+        --cond_path examples/sketch.png --cond_inp_type sketch
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Adapter.Sampling import diffusion_inference
+from configs.utils import instantiate_from_config
+
+
+def get_adapter_features(opt):
+    if opt.config is None:
+        return None, (opt.resolution, opt.resolution)
+    from Adapter.extra_condition import api
+    from Adapter.extra_condition.api import ExtraCondition, get_cond_model
+
+    opt.device = torch.device('cuda')
+    opt.max_resolution = opt.resolution * opt.resolution
+    opt.resize_short_edge = None
+    adapter_config = OmegaConf.load(opt.config).model.params.adapter_config
+    adapter = instantiate_from_config(adapter_config).cuda().eval()
+    adapter.load_state_dict(torch.load(adapter_config.pretrained, map_location='cpu'))
+    cond_model = get_cond_model(opt, getattr(ExtraCondition, adapter_config.name))
+    cond = getattr(api, f'get_cond_{adapter_config.name}')(
+        opt, opt.cond_path, cond_inp_type=opt.cond_inp_type, cond_model=cond_model)
+    with torch.no_grad():
+        return adapter(cond), (cond.shape[-2], cond.shape[-1])
+
+
+def run(opt, dtype, adapter_features, size):
+    sampler = diffusion_inference(opt.model_id, dtype=dtype, upcast_vae=not opt.no_vae_upcast)
+    kwargs = dict(prompt=opt.prompt, size=size, adapter_features=adapter_features, seed=opt.seed, steps=opt.steps)
+    sampler.inference(**dict(kwargs, steps=2))     # warm-up
+
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    image = sampler.inference(**kwargs)[0]
+    torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated()
+
+    del sampler
+    gc.collect()
+    torch.cuda.empty_cache()
+    return image, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_id', type=str, default='stabilityai/stable-diffusion-xl-base-1.0')
+    parser.add_argument('--dtype', type=str, default='fp16', choices=['fp16', 'bf16'])
+    parser.add_argument('--no_vae_upcast', action='store_true')
+    parser.add_argument('--prompt', type=str, default='a photo of a dog sitting on a bench, best quality')
+    parser.add_argument('--resolution', type=int, default=1024)
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--config', type=str, default=None, help='optional adapter inference config')
+    parser.add_argument('--cond_path', type=str, default=None)
+    parser.add_argument('--cond_inp_type', type=str, default='image')
+    parser.add_argument('--outdir', type=str, default=None, help='save both images here')
+    parser.add_argument('--min_psnr', type=float, default=25.0, help='PSNR (dB) of the half image vs fp32 to pass')
+    opt = parser.parse_args()
+
+    adapter_features, size = get_adapter_features(opt)
+    results = {dtype: run(opt, dtype, adapter_features, size) for dtype in ('fp32', opt.dtype)}
+    for dtype, (_, seconds, peak) in results.items():
+        print(f'[{dtype}] {opt.steps} steps {size[0]}x{size[1]}: {seconds:.2f} s '
+              f'({opt.steps / seconds:.2f} it/s), peak {peak / 2**30:.2f} GiB')
+
+    reference, half = results['fp32'][0].astype(np.float64), results[opt.dtype][0].astype(np.float64)
+    mse = np.mean((reference - half) ** 2)
+    psnr = 10 * np.log10(255 ** 2 / mse) if mse > 0 else float('inf')
+    passed = bool(psnr >= opt.min_psnr)
+    print(f'[parity] {opt.dtype} vs fp32: mean abs {np.abs(reference - half).mean():.2f} / 255, PSNR {psnr:.1f} dB '
+          f'(min {opt.min_psnr}) ==> {"PASS" if passed else "FAIL"} | '
+          f'speedup x{results["fp32"][1] / results[opt.dtype][1]:.2f}')
+
+    if opt.outdir is not None:
+        import cv2
+        os.makedirs(opt.outdir, exist_ok=True)
+        for dtype, (image, _, _) in results.items():
+            cv2.imwrite(os.path.join(opt.outdir, f'{dtype}.png'), image)
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
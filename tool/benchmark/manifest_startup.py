@@ -0,0 +1,91 @@
+"""
+Startup time, resident memory and lookup latency of DepthDataset with the json manifest and with the
+memory-mapped manifest of dataset/manifest.py. Each variant runs in a fresh process.
+
+    python tool/benchmark/manifest_startup.py --num 1000000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def rss_mb():
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+
+def make_json(path, num, per_dir=10000):
+    # same layout as tool/get_data_v2.py
+    img_root = '/mnt/nfs/file_server/public/lipengxiang/improved_aesthetics_6plus_out'
+    cond_root = '/mnt/nfs/file_server/public/mingjiahui/data/LAION12M-highreso/lineart_align_controlnet'
+    data = {}
+    for i in range(num):
+        dir_name, name = f'{i // per_dir:05d}', f'{i:09d}'
+        data[os.path.join(img_root, dir_name, name + '.jpg')] = {
+            'txt': os.path.join(img_root, dir_name, name + '.txt'),
+            'depth': os.path.join(cond_root, dir_name, name + '.png'),
+        }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def measure(meta_file, queue):
+    from dataset.dataset_depth import DepthDataset
+    base = rss_mb()
+    start = time.perf_counter()
+    dataset = DepthDataset(meta_file, transforms=None)
+    startup = time.perf_counter() - start
+    rss = rss_mb() - base
+
+    indices = [random.randrange(len(dataset.files)) for _ in range(100000)]
+    start = time.perf_counter()
+    for idx in indices:
+        dataset.files[idx]
+    lookup_us = (time.perf_counter() - start) / len(indices) * 1e6
+    queue.put((len(dataset), startup, rss, lookup_us))
+
+
+def run(meta_file):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    p = ctx.Process(target=measure, args=(meta_file, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=1000000)
+    parser.add_argument('--workdir', type=str, default=None)
+    opt = parser.parse_args()
+
+    from dataset.manifest import write_manifest
+    with tempfile.TemporaryDirectory(dir=opt.workdir) as workdir:
+        json_path = os.path.join(workdir, 'data.json')
+        manifest_dir = os.path.join(workdir, 'data.manifest')
+        make_json(json_path, opt.num)
+        with open(json_path, 'r') as f:
+            write_manifest(json.load(f), manifest_dir)
+        sizes = {
+            'json': os.path.getsize(json_path),
+            'manifest': sum(os.path.getsize(os.path.join(manifest_dir, n)) for n in os.listdir(manifest_dir)),
+        }
+        for name, path in (('json', json_path), ('manifest', manifest_dir)):
+            num, startup, rss, lookup_us = run(path)
+            print(f'[{name:8s}] entries: {num} | on disk: {sizes[name] / 2**20:.1f} MiB | startup: {startup:.2f} s | '
+                  f'RSS: +{rss:.1f} MiB | lookup: {lookup_us:.2f} us')
+
+
+if __name__ == '__main__':
+    main()
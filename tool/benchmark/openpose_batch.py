@@ -0,0 +1,109 @@
+"""
+Throughput of batched OpenPose body inference (`Body.batch` in ldm/modules/extra_condition/openpose) against the
+former one-image-per-call path (per-image forward, cv2 resizes of the maps on the host, kept below as `legacy_call`),
+and whether both find the same people. With `--mixed_sizes` the images are rescaled to different sizes, so the batch
+is padded; the network then sees a larger zero border than in single-image calls, which may move peaks near the
+right and bottom edges. Random weights unless `--ckpt` is given (the keypoints are only meaningful with it).
+
+    python tool/benchmark/openpose_batch.py --ckpt models/body_pose_model.pth --image examples/dog.png --batch_size 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from ldm.modules.extra_condition.openpose import util
+from ldm.modules.extra_condition.openpose.body import Body, assemble_people, find_peaks, score_limbs
+from ldm.modules.extra_condition.openpose.model import bodypose_model
+
+
+def load_body(ckpt, device):
+    body = Body.__new__(Body)
+    body.model = bodypose_model()
+    if ckpt is not None:
+        body.model.load_state_dict(util.transfer(body.model, torch.load(ckpt, map_location='cpu')))
+    body.model = body.model.to(device).eval()
+    return body
+
+
+def legacy_call(body, oriImg):
+    scale_search = [0.5]
+    boxsize = 368
+    stride = 8
+    padValue = 128
+    device = next(body.model.parameters()).device
+    multiplier = [x * boxsize / oriImg.shape[0] for x in scale_search]
+    heatmap_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 19))
+    paf_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 38))
+    for scale in multiplier:
+        imageToTest = cv2.resize(oriImg, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        imageToTest_padded, pad = util.padRightDownCorner(imageToTest, stride, padValue)
+        im = np.transpose(np.float32(imageToTest_padded[:, :, :, np.newaxis]), (3, 2, 0, 1)) / 256 - 0.5
+        data = torch.from_numpy(np.ascontiguousarray(im)).float().to(device)
+        with torch.no_grad():
+            Mconv7_stage6_L1, Mconv7_stage6_L2 = body.model(data)
+        for output, avg in ((Mconv7_stage6_L2, heatmap_avg), (Mconv7_stage6_L1, paf_avg)):
+            maps = np.transpose(np.squeeze(output.cpu().numpy()), (1, 2, 0))
+            maps = cv2.resize(maps, (0, 0), fx=stride, fy=stride, interpolation=cv2.INTER_CUBIC)
+            maps = maps[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
+            maps = cv2.resize(maps, (oriImg.shape[1], oriImg.shape[0]), interpolation=cv2.INTER_CUBIC)
+            avg += maps / len(multiplier)
+    all_peaks = find_peaks(heatmap_avg, 0.1, device=device if device.type == 'cuda' else None)
+    connection_all, special_k = score_limbs(all_peaks, paf_avg, oriImg.shape[0], 0.05)
+    return assemble_people(all_peaks, connection_all, special_k)
+
+
+def compare(legacy, batched):
+    """number of images with the same people, and the largest keypoint shift among them (pixels)"""
+    same, shift = 0, 0.
+    for (cand_a, subset_a), (cand_b, subset_b) in zip(legacy, batched):
+        if cand_a.shape == cand_b.shape and np.array_equal(subset_a[:, :18], subset_b[:, :18]):
+            same += 1
+            if len(cand_a):
+                shift = max(shift, np.abs(cand_a[:, :2] - cand_b[:, :2]).max())
+    return same, shift
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ckpt', type=str, default=None, help='body_pose_model.pth')
+    parser.add_argument('--image', type=str, default='examples/dog.png')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--mixed_sizes', action='store_true')
+    parser.add_argument('--iters', type=int, default=2)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+
+    body = load_body(opt.ckpt, torch.device(opt.device))
+    image = cv2.imread(opt.image)
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(opt.batch_size):
+        scale = rng.uniform(0.7, 1.0) if opt.mixed_sizes else 1.0
+        images.append(cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+
+    def timed(fn):
+        fn()
+        start = time.perf_counter()
+        for _ in range(opt.iters):
+            result = fn()
+        if opt.device.startswith('cuda'):
+            torch.cuda.synchronize()
+        return result, (time.perf_counter() - start) / opt.iters
+
+    legacy, s_legacy = timed(lambda: [legacy_call(body, img) for img in images])
+    batched, s_batched = timed(lambda: body.batch(images))
+    same, shift = compare(legacy, batched)
+    print(f'{len(images)} x {image.shape[1]}x{image.shape[0]}{" (mixed sizes)" if opt.mixed_sizes else ""} on '
+          f'{opt.device}: per image {len(images) / s_legacy:.2f} img/s, batched {len(images) / s_batched:.2f} img/s '
+          f'(x{s_legacy / s_batched:.2f})')
+    print(f'[parity] same people in {same}/{len(images)} images, max keypoint shift {shift:.0f} px')
+
+
+if __name__ == '__main__':
+    main()
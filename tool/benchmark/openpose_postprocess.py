@@ -0,0 +1,215 @@
+"""
+Parity and per-image latency of the tensorized OpenPose post-processing in Adapter/extra_condition/openpose/body.py
+(find_peaks + score_limbs) against the original per-part scipy blur / shifted-copy NMS / per-pair PAF loops, kept
+below as `legacy_peaks_and_limbs`. Runs on synthetic multi-person heatmaps and PAFs, or, with `--image`, on the
+network outputs for a real image (needs checkpoints/body_pose_model.pth). `--device` runs the peak search on a torch
+device (as `Body` does on gpu) instead of the host path. Exits non-zero unless the keypoints and connections are
+identical.
+
+    python tool/benchmark/openpose_postprocess.py --people 8 --resolution 1024
+    python tool/benchmark/openpose_postprocess.py --image examples/openpose.png --device cuda
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Adapter.extra_condition.openpose.body import find_peaks, limbSeq, mapIdx, score_limbs
+
+
+def legacy_peaks_and_limbs(heatmap_avg, paf_avg, image_height, thre1=0.1, thre2=0.05):
+    all_peaks = []
+    peak_counter = 0
+
+    for part in range(18):
+        map_ori = heatmap_avg[:, :, part]
+        one_heatmap = gaussian_filter(map_ori, sigma=3)
+
+        map_left = np.zeros(one_heatmap.shape)
+        map_left[1:, :] = one_heatmap[:-1, :]
+        map_right = np.zeros(one_heatmap.shape)
+        map_right[:-1, :] = one_heatmap[1:, :]
+        map_up = np.zeros(one_heatmap.shape)
+        map_up[:, 1:] = one_heatmap[:, :-1]
+        map_down = np.zeros(one_heatmap.shape)
+        map_down[:, :-1] = one_heatmap[:, 1:]
+
+        peaks_binary = np.logical_and.reduce((one_heatmap >= map_left, one_heatmap >= map_right,
+                                              one_heatmap >= map_up, one_heatmap >= map_down, one_heatmap > thre1))
+        peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
+        peaks_with_score = [x + (map_ori[x[1], x[0]], ) for x in peaks]
+        peak_id = range(peak_counter, peak_counter + len(peaks))
+        peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i], ) for i in range(len(peak_id))]
+
+        all_peaks.append(peaks_with_score_and_id)
+        peak_counter += len(peaks)
+
+    # find connection in the specified sequence, center 29 is in the position 15
+    limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
+               [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
+               [1, 16], [16, 18], [3, 17], [6, 18]]
+    # the middle joints heatmap correpondence
+    mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
+              [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
+              [55, 56], [37, 38], [45, 46]]
+
+    connection_all = []
+    special_k = []
+    mid_num = 10
+
+    for k in range(len(mapIdx)):
+        score_mid = paf_avg[:, :, [x - 19 for x in mapIdx[k]]]
+        candA = all_peaks[limbSeq[k][0] - 1]
+        candB = all_peaks[limbSeq[k][1] - 1]
+        nA = len(candA)
+        nB = len(candB)
+        indexA, indexB = limbSeq[k]
+        if (nA != 0 and nB != 0):
+            connection_candidate = []
+            for i in range(nA):
+                for j in range(nB):
+                    vec = np.subtract(candB[j][:2], candA[i][:2])
+                    norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1])
+                    norm = max(0.001, norm)
+                    vec = np.divide(vec, norm)
+
+                    startend = list(zip(np.linspace(candA[i][0], candB[j][0], num=mid_num), \
+                                        np.linspace(candA[i][1], candB[j][1], num=mid_num)))
+
+                    vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0] \
+                                      for I in range(len(startend))])
+                    vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1] \
+                                      for I in range(len(startend))])
+
+                    score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
+                    score_with_dist_prior = sum(score_midpts) / len(score_midpts) + min(
+                        0.5 * image_height / norm - 1, 0)
+                    criterion1 = len(np.nonzero(score_midpts > thre2)[0]) > 0.8 * len(score_midpts)
+                    criterion2 = score_with_dist_prior > 0
+                    if criterion1 and criterion2:
+                        connection_candidate.append(
+                            [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
+
+            connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
+            connection = np.zeros((0, 5))
+            for c in range(len(connection_candidate)):
+                i, j, s = connection_candidate[c][0:3]
+                if (i not in connection[:, 3] and j not in connection[:, 4]):
+                    connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
+                    if (len(connection) >= min(nA, nB)):
+                        break
+
+            connection_all.append(connection)
+        else:
+            special_k.append(k)
+            connection_all.append([])
+
+    return all_peaks, connection_all, special_k
+
+
+def synthetic_maps(num_people, resolution, seed=0):
+    """gaussian keypoint blobs and unit PAF vectors along the limbs of randomly placed skeletons, plus noise"""
+    rng = np.random.default_rng(seed)
+    H = W = resolution
+    heatmap = rng.uniform(0, 0.05, (H, W, 19))
+    paf = rng.normal(0, 0.02, (H, W, 38))
+    ys, xs = np.mgrid[:H, :W]
+    for _ in range(num_people):
+        center = rng.uniform(0.15, 0.85, 2) * resolution
+        joints = center + rng.normal(0, resolution / 12, (18, 2))
+        joints = np.clip(joints, 0, resolution - 1)
+        for part, (x, y) in enumerate(joints):
+            heatmap[:, :, part] += 0.9 * np.exp(-((xs - x) ** 2 + (ys - y) ** 2) / (2 * (resolution / 100) ** 2))
+        for (a, b), (mx, my) in zip(limbSeq, mapIdx):
+            pa, pb = joints[a - 1], joints[b - 1]
+            vec = (pb - pa) / max(np.linalg.norm(pb - pa), 1e-3)
+            for t in np.linspace(0, 1, 50):
+                x, y = (pa + t * (pb - pa)).astype(int)
+                paf[max(0, y - 3):y + 4, max(0, x - 3):x + 4, mx - 19] = vec[0]
+                paf[max(0, y - 3):y + 4, max(0, x - 3):x + 4, my - 19] = vec[1]
+    return heatmap, paf
+
+
+def network_maps(image_path):
+    import cv2
+    from Adapter.extra_condition.openpose import body
+
+    captured = {}
+
+    def capture(all_peaks_fn):
+        def fn(heatmap_avg, thre1, **kwargs):
+            captured['heatmap'] = heatmap_avg
+            return all_peaks_fn(heatmap_avg, thre1, **kwargs)
+        return fn
+
+    def capture_paf(score_fn):
+        def fn(all_peaks, paf_avg, image_height, thre2):
+            captured['paf'] = paf_avg
+            return score_fn(all_peaks, paf_avg, image_height, thre2)
+        return fn
+
+    body.find_peaks, body.score_limbs = capture(body.find_peaks), capture_paf(body.score_limbs)
+    body.Body('checkpoints/body_pose_model.pth')(cv2.imread(image_path))
+    return captured['heatmap'], captured['paf']
+
+
+def same_results(legacy, new):
+    peaks_a, conn_a, special_a = legacy
+    peaks_b, conn_b, special_b = new
+    if special_a != special_b or len(peaks_a) != len(peaks_b):
+        return False
+    for a, b in zip(peaks_a, peaks_b):
+        if len(a) != len(b) or (len(a) and not np.array_equal(np.array(a), np.array(b))):
+            return False
+    for a, b in zip(conn_a, conn_b):
+        if len(a) != len(b) or (len(a) and not np.array_equal(np.asarray(a), np.asarray(b))):
+            return False
+    return True
+
+
+def time_call(fn, iters):
+    start = time.perf_counter()
+    for _ in range(iters):
+        result = fn()
+    return result, (time.perf_counter() - start) / iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', type=str, default=None)
+    parser.add_argument('--people', type=int, default=6)
+    parser.add_argument('--resolution', type=int, default=768)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', type=str, default=None, help='torch device of the peak search, e.g. cuda')
+    opt = parser.parse_args()
+
+    if opt.image is None:
+        heatmap, paf = synthetic_maps(opt.people, opt.resolution)
+    else:
+        heatmap, paf = network_maps(opt.image)
+    height = heatmap.shape[0]
+
+    legacy, ms_legacy = time_call(lambda: legacy_peaks_and_limbs(heatmap, paf, height), opt.iters)
+
+    def tensorized():
+        all_peaks = find_peaks(heatmap, 0.1, device=opt.device)
+        return (all_peaks, ) + score_limbs(all_peaks, paf, height, 0.05)
+
+    new, ms_new = time_call(tensorized, opt.iters)
+    num_peaks = sum(len(p) for p in new[0])
+    num_connections = sum(len(c) for c in new[1])
+    passed = same_results(legacy, new)
+    print(f'{heatmap.shape[1]}x{height} ({opt.device or "host"}), {num_peaks} peaks, {num_connections} connections: '
+          f'legacy {ms_legacy:.1f} ms, tensorized {ms_new:.1f} ms (x{ms_legacy / ms_new:.2f})')
+    print(f'[parity] keypoints and connections identical ==> {"PASS" if passed else "FAIL"}')
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
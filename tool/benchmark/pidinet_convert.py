@@ -0,0 +1,63 @@
+"""
+Parity and CPU latency of the reparameterized PiDiNet (`pidinet(convert=True)` + `convert_pidinet`) against the pixel
+difference conv model used so far. Random weights unless `--ckpt` is given. Exits non-zero if any of the five edge
+maps differs by more than `--tolerance` (max abs, the maps are sigmoid outputs in [0, 1]).
+
+    python tool/benchmark/pidinet_convert.py --ckpt checkpoints/table5_pidinet.pth --resolution 512 --threads 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Adapter.extra_condition.model_edge import convert_pidinet, pidinet
+
+
+def time_forward(model, x, iters, warmup=1):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+    return (time.perf_counter() - start) / iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ckpt', type=str, default=None, help='table5_pidinet.pth')
+    parser.add_argument('--resolution', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--tolerance', type=float, default=1e-5)
+    opt = parser.parse_args()
+
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    torch.manual_seed(0)
+    model = pidinet().eval()
+    if opt.ckpt is not None:
+        ckp = torch.load(opt.ckpt, map_location='cpu')['state_dict']
+        model.load_state_dict({k.replace('module.', ''): v for k, v in ckp.items()}, strict=True)
+    converted = pidinet(convert=True).eval()
+    converted.load_state_dict(convert_pidinet(model.state_dict()), strict=True)
+
+    x = torch.rand(opt.batch_size, 3, opt.resolution, opt.resolution)
+    with torch.no_grad():
+        err = max((a - b).abs().max().item() for a, b in zip(model(x), converted(x)))
+    ms_pdc = time_forward(model, x, opt.iters)
+    ms_converted = time_forward(converted, x, opt.iters)
+    passed = err <= opt.tolerance
+    print(f'{opt.batch_size}x{opt.resolution}px, {torch.get_num_threads()} threads: pdc {ms_pdc:.1f} ms, '
+          f'converted {ms_converted:.1f} ms (x{ms_pdc / ms_converted:.2f})')
+    print(f'[parity] max abs {err:.2e} (tolerance {opt.tolerance}) ==> {"PASS" if passed else "FAIL"}')
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
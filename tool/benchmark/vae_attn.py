@@ -0,0 +1,143 @@
+"""
+Parity, latency and peak memory of the VAE mid-block attention variants of ldm/modules/diffusionmodules/model.py
+(SDPAAttnBlock, ChunkedAttnBlock) against the dense AttnBlock, at the 512 channels and (resolution / 8)^2 positions
+the SD1.x decoder sees for a `--resolution` px image. Parity is checked at `--check_resolution` (the dense block needs
+b x hw x hw weights), latency and memory at `--resolution`; on cpu every block runs in its own process, peak memory
+is its RSS growth. The blocks are built by `make_attn`, the chunked one with `--chunk_size` (default 1000, not a
+divisor of hw, so the last chunk is partial) passed as attn_kwargs; Encoder / Decoder are checked to hand it to their
+attention blocks. Exits non-zero if a variant differs from the dense block by more than `--tolerance` or the chunk
+size does not arrive.
+
+    python tool/benchmark/vae_attn.py --resolution 1024 --check_resolution 512
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from ldm.modules.diffusionmodules.model import AttnBlock, ChunkedAttnBlock, Decoder, Encoder, make_attn
+
+VARIANTS = {
+    'dense': 'vanilla-dense',
+    'sdpa': 'vanilla-sdpa',
+    'chunked': 'vanilla-chunked',
+}
+
+
+def attn_kwargs(name, opt):
+    return {'chunk_size': opt.chunk_size} if name == 'chunked' else None
+
+
+def build(name, opt, device):
+    torch.manual_seed(0)
+    reference = AttnBlock(512)
+    block = make_attn(512, attn_type=VARIANTS[name], attn_kwargs=attn_kwargs(name, opt))
+    block.load_state_dict(reference.state_dict())
+    return reference.to(device).eval(), block.to(device).eval()
+
+
+def check_chunk_size(opt):
+    """a small encoder / decoder pair built like a ddconfig with attn_type vanilla-chunked and attn_kwargs"""
+    ddconfig = dict(ch=32, out_ch=3, ch_mult=(1, 2), num_res_blocks=1, attn_resolutions=[16], in_channels=3,
+                    resolution=32, z_channels=4, double_z=True, attn_type='vanilla-chunked',
+                    attn_kwargs={'chunk_size': opt.chunk_size})
+    blocks = [m for model in (Encoder(**ddconfig), Decoder(**ddconfig)) for m in model.modules()
+              if isinstance(m, ChunkedAttnBlock)]
+    return len(blocks) > 0 and all(block.chunk_size == opt.chunk_size for block in blocks)
+
+
+def latent(resolution, opt, device):
+    torch.manual_seed(1)
+    return torch.randn(opt.batch_size, 512, resolution // 8, resolution // 8, device=device)
+
+
+def check(name, opt, device):
+    reference, block = build(name, opt, device)
+    x = latent(opt.check_resolution, opt, device)
+    with torch.no_grad():
+        return (block(x) - reference(x)).abs().max().item()
+
+
+def measure(name, opt, result=None):
+    device = torch.device(opt.device)
+    _, block = build(name, opt, device)
+    x = latent(opt.resolution, opt, device)
+
+    def forward():
+        with torch.no_grad():
+            block(x)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    forward()
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+    start = time.perf_counter()
+    for _ in range(opt.iters):
+        forward()
+    stats = {'ms': (time.perf_counter() - start) / opt.iters * 1000, 'peak': peak}
+    if result is not None:
+        result.update(stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolution', type=int, default=1024)
+    parser.add_argument('--check_resolution', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--chunk_size', type=int, default=1000)
+    parser.add_argument('--iters', type=int, default=2)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+    device = torch.device(opt.device)
+
+    passed = check_chunk_size(opt)
+    print(f'[config] Encoder / Decoder attention chunk_size {opt.chunk_size} ==> {"PASS" if passed else "FAIL"}')
+    for name in VARIANTS:
+        if name != 'dense':
+            err = check(name, opt, device)
+            ok = err <= opt.tolerance
+            passed = passed and ok
+            print(f'[parity] {name} at {opt.check_resolution}px: max abs diff {err:.2e} ==> {"PASS" if ok else "FAIL"}')
+
+    print(f'{opt.batch_size} x 512 x {opt.resolution // 8}^2 ({opt.resolution}px), {opt.device}')
+    for name in VARIANTS:
+        if device.type == 'cpu':
+            with multiprocessing.Manager() as manager:
+                result = manager.dict()
+                process = multiprocessing.get_context('spawn').Process(target=measure, args=(name, opt, result))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f'[{name}] failed (exit code {process.exitcode}, out of memory?)')
+                    continue
+                stats = dict(result)
+        else:
+            try:
+                stats = measure(name, opt)
+            except torch.cuda.OutOfMemoryError:
+                print(f'[{name}] out of memory')
+                torch.cuda.empty_cache()
+                continue
+        print(f'[{name}] {stats["ms"]:.1f} ms, peak +{stats["peak"] / 2 ** 20:.0f} MiB')
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
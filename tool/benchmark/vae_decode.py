@@ -0,0 +1,89 @@
+"""
+Peak memory and parity of the SDXL VAE decode modes of `diffusion_inference.set_vae_decode`: one full decode of the
+whole batch, per-sample slicing, and slicing plus overlapping tiles. The tiled images are compared against the full
+decode and the script exits non-zero if the mean abs difference (in [0, 1] pixel space) exceeds `--tolerance`.
+
+    python tool/benchmark/vae_decode.py --image examples/dog.png --resolution 2048 --batch_size 2 --tile_size 512
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from diffusers import AutoencoderKL
+
+
+def decode(vae, latents, slicing, tile_size, tile_overlap=0.25):
+    # same settings as diffusion_inference.set_vae_decode
+    if slicing:
+        vae.enable_slicing()
+    else:
+        vae.disable_slicing()
+    if tile_size is None:
+        vae.disable_tiling()
+    else:
+        vae.enable_tiling()
+        vae.tile_sample_min_size = tile_size
+        vae.tile_latent_min_size = tile_size // 2 ** (len(vae.config.block_out_channels) - 1)
+        vae.tile_overlap_factor = tile_overlap
+
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    with torch.no_grad():
+        images = vae.decode(latents / vae.config.scaling_factor, return_dict=False)[0]
+    torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated() - base
+    return (images / 2 + 0.5).clamp(0, 1).float().cpu(), peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_id', type=str, default='stabilityai/stable-diffusion-xl-base-1.0')
+    parser.add_argument('--image', type=str, required=True, help='encoded to get realistic latents')
+    parser.add_argument('--resolution', type=int, default=2048)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--tile_size', type=int, default=512)
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    opt = parser.parse_args()
+
+    vae = AutoencoderKL.from_pretrained(opt.model_id, subfolder='vae').cuda().eval()
+    image = Image.open(opt.image).convert('RGB').resize((opt.resolution, opt.resolution), Image.BICUBIC)
+    pixels = torch.from_numpy(np.array(image)).permute(2, 0, 1)[None].float().cuda() / 127.5 - 1
+    with torch.no_grad():
+        latents = vae.encode(pixels).latent_dist.mode() * vae.config.scaling_factor
+    latents = latents.repeat(opt.batch_size, 1, 1, 1)
+
+    results = {}
+    for name, slicing, tile_size in [
+        ('full', False, None),
+        ('sliced', True, None),
+        (f'sliced+tiled {opt.tile_size}px', True, opt.tile_size),
+    ]:
+        try:
+            results[name] = decode(vae, latents, slicing, tile_size)
+        except torch.cuda.OutOfMemoryError:
+            print(f'[{name}] out of memory')
+            torch.cuda.empty_cache()
+            continue
+        _, peak, seconds = results[name]
+        print(f'[{name}] {opt.batch_size}x{opt.resolution}px: peak {peak / 2**30:.2f} GiB, {seconds:.2f} s')
+
+    tiled_name = f'sliced+tiled {opt.tile_size}px'
+    reference = results.get('full', results.get('sliced'))
+    if reference is None or tiled_name not in results:
+        return
+    diff = (results[tiled_name][0] - reference[0]).abs()
+    passed = diff.mean().item() <= opt.tolerance
+    print(f'[parity] tiled vs full: mean abs {diff.mean().item():.4f}, max abs {diff.max().item():.4f} '
+          f'(tolerance {opt.tolerance}) ==> {"PASS" if passed else "FAIL"}')
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""
+Convert a training json manifest (tool/get_data_v2.py) into the memory-mapped manifest of dataset/manifest.py.
+Point `data_json` of the dataset config to the output directory afterwards.
+
+    python tool/convert_manifest.py --data_json ./data/train_data_v2_0.json --output_dir ./data/train_data_v2_0.manifest
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset.manifest import write_manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_json', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, required=True)
+    args = parser.parse_args()
+
+    print('loading the json......')
+    with open(args.data_json, 'r') as f:
+        data = json.load(f)
+    write_manifest(data, args.output_dir)
+    print(f'ToTal num:{len(data)} ==> {args.output_dir}')
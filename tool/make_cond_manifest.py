@@ -0,0 +1,52 @@
+"""
+Write the training json manifest (the format of tool/get_data_v2.py) for the condition maps of one
+`condition_extractor/multi_main_v2.py` run. The images and which of them are finished are read from the run's
+`.progress` directory (frozen work list and completion logs), so the output dirs are not walked; images without a
+caption are skipped. The map path goes under `--cond_key`, 'depth' being the key the training datasets read for every
+condition type.
+
+    python tool/make_cond_manifest.py --output_path /data/LAION12M-highreso/sketch_pidinet \
+        --data_json ./data/train_data_v2_sketch.json
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from condition_extractor.scheduler import CompletionLog, progress_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_path', type=str, required=True, help='--output_path of the extraction run')
+    parser.add_argument('--data_json', type=str, required=True)
+    parser.add_argument('--cond_key', type=str, default='depth')
+    args = parser.parse_args()
+
+    with open(os.path.join(progress_dir(args.output_path), 'worklist.txt'), 'r') as f:
+        images = f.read().splitlines()
+    done = CompletionLog.completed(args.output_path, len(images))
+    print(f'{done.sum()}/{len(images)} images have a condition map')
+
+    data = {}
+    loss_num = 0
+    for index in tqdm(np.flatnonzero(done)):
+        img_path = images[index]
+        txt_path = img_path.replace('.jpg', '.txt')
+        if not os.path.exists(txt_path):
+            loss_num += 1
+            continue
+        cond_path = os.path.join(args.output_path, os.path.basename(os.path.dirname(img_path)),
+                                 os.path.splitext(os.path.basename(img_path))[0] + '.png')
+        data[img_path] = {'txt': txt_path, args.cond_key: cond_path}
+    print(f'loss caption num is:{loss_num}')
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.data_json)), exist_ok=True)
+    with open(args.data_json + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(args.data_json + '.tmp', args.data_json)
+    print(f'ToTal num:{len(data)} ==> {args.data_json}')
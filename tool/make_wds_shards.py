@@ -0,0 +1,83 @@
+"""
+Pack a training manifest (the json written by tool/get_data_v2.py) into WebDataset tar shards so that training
+streams large sequential reads instead of opening three small files per sample.
+
+Every sample holds the original bytes of `jpg` (image), `cond.png` (condition map) and `txt` (caption), nothing is
+re-encoded. All shards except the last one hold exactly `--maxcount` samples, put that value into the
+`samples_per_shard` field of the dataset config so restarts can resume at the right shard.
+
+    python tool/make_wds_shards.py --data_json ./data/train_data_v2_0.json --output_dir /data/shards --maxcount 2000
+"""
+import argparse
+import json
+import os
+import random
+
+import torch
+import webdataset as wds
+from tqdm import tqdm
+
+
+class RawSampleDataset(torch.utils.data.Dataset):
+    """read the raw bytes of a manifest entry, wrapped in a DataLoader to overlap the small NFS reads"""
+
+    def __init__(self, items):
+        self.items = items
+
+    def __getitem__(self, idx):
+        img_path, entry = self.items[idx]
+        try:
+            with open(img_path, 'rb') as f:
+                jpg = f.read()
+            with open(entry['depth'], 'rb') as f:
+                cond = f.read()
+            with open(entry['txt'], 'r') as f:
+                txt = f.readline().strip()
+        except OSError as e:
+            print(f'skip {img_path}: {e}')
+            return None
+        return {'jpg': jpg, 'cond.png': cond, 'txt': txt}
+
+    def __len__(self):
+        return len(self.items)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_json', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--maxcount', type=int, default=2000, help='samples per shard')
+    parser.add_argument('--num_workers', type=int, default=16)
+    parser.add_argument('--shuffle', action='store_true', help='shuffle the manifest before packing')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.data_json, 'r') as f:
+        items = list(json.load(f).items())
+    if args.shuffle:
+        random.Random(args.seed).shuffle(items)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    loader = torch.utils.data.DataLoader(
+        RawSampleDataset(items),
+        batch_size=None,
+        shuffle=False,
+        num_workers=args.num_workers,
+        collate_fn=lambda x: x,
+    )
+    count = 0
+    with wds.ShardWriter(os.path.join(args.output_dir, '%06d.tar'), maxcount=args.maxcount) as sink:
+        for sample in tqdm(loader, total=len(items)):
+            if sample is None:
+                continue
+            sample['__key__'] = f'{count:09d}'
+            sink.write(sample)
+            count += 1
+
+    num_shards = (count + args.maxcount - 1) // args.maxcount
+    print(f'{count} samples ==> {num_shards} shards in {args.output_dir}, '
+          f"shards: '{{{0:06d}..{num_shards - 1:06d}}}.tar', samples_per_shard: {args.maxcount}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 import torch
 
 
-def save_sdxl_adapter_checkpoint(output_file, sdxl_adapter, epochs, steps):
+def save_sdxl_adapter_checkpoint(output_file, sdxl_adapter, epochs, steps, data_cursor=None):
     state_dict = {}
 
     def update_sd(prefix, sd):
@@ -25,13 +25,16 @@ def save_sdxl_adapter_checkpoint(output_file, sdxl_adapter, epochs, steps):
 
     new_ckpt["epoch"] = epochs
     new_ckpt["global_step"] = steps
+    if data_cursor is not None:
+        # training samples consumed over all processes, to resume a streaming dataloader
+        new_ckpt["data_cursor"] = data_cursor
 
     torch.save(new_ckpt, output_file)
 
     return key_count
 
 
-def load_sdxl_adapter_chaeckpoit(ckpt_path, ):
+def load_sdxl_adapter_chaeckpoit(ckpt_path, return_data_cursor=False):
     print(f'Loading the adapter pretrain ckpt...... ==>\t{ckpt_path}')
     my_dict = torch.load(ckpt_path)
 
@@ -50,6 +53,9 @@ def load_sdxl_adapter_chaeckpoit(ckpt_path, ):
     state_dict = update_sd("model.sdxl_adapter.", state_dict)
     for param_name, param_tensor in state_dict.items():
         state_dict[param_name] = param_tensor.to(torch.float16)
+    if return_data_cursor:
+        # None for checkpoints saved without it
+        return epoch, global_step, state_dict, my_dict.get('data_cursor', None)
     return epoch, global_step, state_dict
 
 
@@ -0,0 +1,119 @@
+"""
+Offline "prepare" stage for train_depth.py / train_sketch.py: run the frozen VAE and both SDXL text encoders once
+over the DepthDataset entries of a training config and store the VAE latent distribution parameters, the prompt
+embeds and the pooled prompt embeds into a sharded, memory-mappable cache. Train with `--latent_cache_dir` afterwards.
+
+The cache rows follow the order of the dataset manifest, so the image transforms of the config must be
+deterministic (Resize + CenterCrop). Shards are processed round-robin over `--num_processes` and finished shards are
+skipped, so the job can be split over several GPUs and restarted at any time. The index, which makes the cache
+usable, is written by whichever process finds all shards complete at its end.
+"""
+import argparse
+import math
+import os
+import sys
+
+import torch
+from omegaconf import OmegaConf
+from torchvision.transforms import transforms
+from tqdm import tqdm
+from transformers import AutoTokenizer
+from diffusers import AutoencoderKL
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Adapter.utils import import_model_class_from_model_name_or_path
+from configs.utils import instantiate_from_config
+from dataset.dataset_depth import DepthDataset
+from dataset.latent_cache import LatentShardWriter, is_shard_complete, missing_shards, shard_rows, write_cache_index
+from tool.sample_util import encode_prompt
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pretrained_model_name_or_path', type=str, required=True)
+    parser.add_argument('--pretrained_vae_model_name_or_path', type=str, default=None)
+    parser.add_argument('--config', type=str, default='configs/train/Adapter-XL-depth.yaml')
+    parser.add_argument('--split', type=str, default='train', help='dataset section of the config to cache')
+    parser.add_argument('--cache_dir', type=str, required=True)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--shard_size', type=int, default=4096)
+    parser.add_argument('--num_workers', type=int, default=8)
+    parser.add_argument('--num_processes', type=int, default=1)
+    parser.add_argument('--process_index', type=int, default=0)
+    parser.add_argument('--mixed_precision', type=str, default='fp16', choices=['no', 'fp16', 'bf16'],
+                        help='dtype of the text encoders, the VAE stays in fp32 unless a fixed VAE is given')
+    return parser.parse_args()
+
+
+def main(args):
+    device = 'cuda'
+    weight_dtype = {'no': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}[args.mixed_precision]
+    dataset_config = OmegaConf.load(args.config).data.params[args.split]
+    if any(tt.target.endswith('RandomCrop') for tt in dataset_config.image_transforms):
+        raise ValueError('the cached latents must be reproducible, use CenterCrop instead of RandomCrop')
+    image_transforms = [instantiate_from_config(tt) for tt in dataset_config.image_transforms]
+    image_transforms = transforms.Compose(image_transforms + [transforms.ToTensor()])
+    dataset = DepthDataset(dataset_config.data_json, image_transforms, load_cond=False)
+
+    # frozen encoders
+    tokenizers = [
+        AutoTokenizer.from_pretrained(
+            args.pretrained_model_name_or_path, subfolder=subfolder, revision=None, use_fast=False)
+        for subfolder in ('tokenizer', 'tokenizer_2')
+    ]
+    text_encoders = [
+        import_model_class_from_model_name_or_path(args.pretrained_model_name_or_path, None, subfolder=subfolder)
+        .from_pretrained(args.pretrained_model_name_or_path, subfolder=subfolder, revision=None)
+        .to(device, dtype=weight_dtype).requires_grad_(False)
+        for subfolder in ('text_encoder', 'text_encoder_2')
+    ]
+    if args.pretrained_vae_model_name_or_path is None:
+        vae = AutoencoderKL.from_pretrained(args.pretrained_model_name_or_path, subfolder='vae')
+        vae_dtype = torch.float32
+    else:
+        vae = AutoencoderKL.from_pretrained(args.pretrained_vae_model_name_or_path)
+        vae_dtype = weight_dtype
+    vae = vae.to(device, dtype=vae_dtype).requires_grad_(False)
+
+    num_shards = math.ceil(len(dataset) / args.shard_size)
+    os.makedirs(args.cache_dir, exist_ok=True)
+    for shard_idx in range(args.process_index, num_shards, args.num_processes):
+        if is_shard_complete(args.cache_dir, shard_idx, shard_rows(len(dataset), args.shard_size, shard_idx)):
+            continue
+        start = shard_idx * args.shard_size
+        end = min(start + args.shard_size, len(dataset))
+        dataloader = torch.utils.data.DataLoader(
+            torch.utils.data.Subset(dataset, range(start, end)),
+            batch_size=args.batch_size,
+            shuffle=False,
+            num_workers=args.num_workers,
+            pin_memory=True,
+        )
+        writer = LatentShardWriter(args.cache_dir, shard_idx, end - start)
+        with torch.no_grad():
+            for batch in tqdm(dataloader, desc=f'shard {shard_idx}/{num_shards}'):
+                pixel_values = (batch['jpg'].to(device) * 2. - 1.).to(dtype=vae_dtype)
+                latent_params = vae.encode(pixel_values).latent_dist.parameters
+                prompt_embeds, pooled_prompt_embeds = encode_prompt(tokenizers, text_encoders, batch['txt'], 0)
+                writer.write(
+                    latent_params=latent_params,
+                    prompt_embeds=prompt_embeds,
+                    pooled_prompt_embeds=pooled_prompt_embeds,
+                )
+        writer.close()
+
+    # the other processes may still be writing theirs, the last one to finish publishes the index
+    missing = missing_shards(args.cache_dir, len(dataset), args.shard_size)
+    if missing:
+        print(f'{len(missing)} shards are not finished yet (e.g. {missing[:8]}), the index is written once they are')
+    else:
+        write_cache_index(
+            args.cache_dir, len(dataset), args.shard_size,
+            scaling_factor=vae.config.scaling_factor,
+            data_json=dataset_config.data_json,
+            pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        )
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -2,9 +2,15 @@ import torch
 import numpy as np
 import random
 import tqdm
-import copy
 from basicsr.utils import tensor2img
 
+from Adapter.prompt_cache import PromptEmbeddingCache
+from Adapter.schedulers import build_scheduler, resolve_steps
+
+
+# validation sampling encodes the same prompts (and the empty negative prompt) again and again
+prompt_cache = PromptEmbeddingCache()
+
 
 def seed_everything(seed):
     torch.manual_seed(seed)
@@ -16,30 +22,38 @@ def seed_everything(seed):
 
 def inference(
         tokenizers, scheduler, model, vae, text_encoders, device, weight_dtype,
-        prompt, size, prompt_n='', adapter_features=None, guidance_scale=7.5, seed=-1, steps=50):
+        prompt, size, prompt_n='', adapter_features=None, guidance_scale=7.5, seed=-1, steps=50, sampler=None):
+    """
+    sampler: optional name from `Adapter.schedulers.SCHEDULERS`, sample with that scheduler (built from the config of
+        `scheduler`) instead of the training scheduler. `steps` None uses its step preset.
+    """
     prompt_batch = [prompt_n, prompt]
     prompt_embeds, unet_added_cond_kwargs = compute_embeddings(device,
         prompt_batch=prompt_batch, proportion_empty_prompts=0, text_encoders=text_encoders,
-        tokenizers=tokenizers, size=size
+        tokenizers=tokenizers, size=size, cache=prompt_cache,
     )
 
+    if sampler is not None:
+        scheduler = build_scheduler(sampler, scheduler.config)
+        steps = resolve_steps(sampler, steps)
     scheduler.set_timesteps(steps)
 
     if seed != -1:
         seed_everything(seed)
-    noisy_latents = torch.randn((1, 4, size[0] // 8, size[1] // 8)).to("cuda").to(dtype=weight_dtype)
+    noisy_latents = torch.randn((1, 4, size[0] // 8, size[1] // 8)).to("cuda") * scheduler.init_noise_sigma
+    noisy_latents = noisy_latents.to(dtype=weight_dtype)
 
     with torch.no_grad():
         for t in tqdm.tqdm(scheduler.timesteps):
             with torch.no_grad():
-                input = torch.cat([noisy_latents] * 2)
+                input = scheduler.scale_model_input(torch.cat([noisy_latents] * 2), t)
 
                 noise_pred = model(
                     input,
                     t,
                     encoder_hidden_states=prompt_embeds["prompt_embeds"],
                     added_cond_kwargs=unet_added_cond_kwargs,
-                    down_block_additional_residuals=copy.deepcopy(adapter_features),
+                    down_block_additional_residuals=adapter_features,
                 )[0]
                 noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                 noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
@@ -54,9 +68,8 @@ def inference(
     return image
 
 
-def encode_prompt(tokenizers, text_encoders, prompt_batch, proportion_empty_prompts, is_train=True):
-    prompt_embeds_list = []
-
+def encode_prompt(tokenizers, text_encoders, prompt_batch, proportion_empty_prompts, is_train=True, cache=None):
+    """`cache`: optional PromptEmbeddingCache, only the captions it does not hold go through the text encoders"""
     captions = []
     for caption in prompt_batch:
         if random.random() < proportion_empty_prompts:
@@ -67,6 +80,14 @@ def encode_prompt(tokenizers, text_encoders, prompt_batch, proportion_empty_prom
             # take a random caption if there are multiple
             captions.append(random.choice(caption) if is_train else caption[0])
 
+    if cache is not None:
+        return cache.encode(
+            tokenizers, text_encoders, captions, lambda missing: encode_captions(tokenizers, text_encoders, missing))
+    return encode_captions(tokenizers, text_encoders, captions)
+
+
+def encode_captions(tokenizers, text_encoders, captions):
+    prompt_embeds_list = []
     with torch.no_grad():
         for tokenizer, text_encoder in zip(tokenizers, text_encoders):
             text_inputs = tokenizer(
@@ -94,13 +115,14 @@ def encode_prompt(tokenizers, text_encoders, prompt_batch, proportion_empty_prom
     return prompt_embeds, pooled_prompt_embeds
 
 
-def compute_embeddings(device, prompt_batch, proportion_empty_prompts, text_encoders, tokenizers, size, is_train=True):
+def compute_embeddings(device, prompt_batch, proportion_empty_prompts, text_encoders, tokenizers, size, is_train=True,
+                       cache=None):
     original_size = size
     target_size = size
     crops_coords_top_left = (0, 0)
 
     prompt_embeds, pooled_prompt_embeds = encode_prompt(
-        tokenizers, text_encoders, prompt_batch, proportion_empty_prompts, is_train
+        tokenizers, text_encoders, prompt_batch, proportion_empty_prompts, is_train, cache=cache
     )
     add_text_embeds = pooled_prompt_embeds
 
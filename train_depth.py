@@ -49,6 +49,7 @@ from diffusers import (
     UniPCMultistepScheduler,
 )
 
+from diffusers.models.vae import DiagonalGaussianDistribution
 from diffusers.optimization import get_scheduler
 from diffusers.utils import check_min_version, is_wandb_available
 from diffusers.utils.import_utils import is_xformers_available
@@ -149,7 +150,7 @@ def inference_sample(
                 prompt=prompt,
                 prompt_n=neg_prompt,
                 steps=50,
-                adapter_features=[sample.to(dtype=weight_dtype) for sample in copy.deepcopy(adapter_features)],
+                adapter_features=[sample.to(dtype=weight_dtype) for sample in adapter_features],
                 guidance_scale=7.5,
                 size=(cond.shape[-2], cond.shape[-1]),
                 seed=42,
@@ -404,6 +405,15 @@ def parse_args(input_args=None):
             " https://pytorch.org/docs/stable/generated/torch.optim.Optimizer.zero_grad.html"
         ),
     )
+    parser.add_argument(
+        "--latent_cache_dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory written by tool/prepare_latent_cache.py. When set, VAE latents and text embeddings are read"
+            " from the cache and neither the VAE nor the text encoders are loaded."
+        ),
+    )
     parser.add_argument(
         "--proportion_empty_prompts",
         type=float,
@@ -434,6 +444,9 @@ def parse_args(input_args=None):
     if args.proportion_empty_prompts < 0 or args.proportion_empty_prompts > 1:
         raise ValueError("`--proportion_empty_prompts` must be in the range [0, 1].")
 
+    if args.latent_cache_dir is not None and args.proportion_empty_prompts > 0:
+        raise ValueError("`--proportion_empty_prompts` is not supported with `--latent_cache_dir`.")
+
     if args.resolution % 8 != 0:
         raise ValueError(
             "`--resolution` must be divisible by 8 for consistently sized encoded images between the VAE and T2I-Adapter."
@@ -550,22 +563,32 @@ def main(args):
 
     # Load scheduler and modelsdep
     noise_scheduler = DDPMScheduler.from_pretrained(args.pretrained_model_name_or_path, subfolder="scheduler")
-    text_encoder_one = text_encoder_cls_one.from_pretrained(
-        args.pretrained_model_name_or_path, subfolder="text_encoder", revision=args.revision
-    )
-    text_encoder_two = text_encoder_cls_two.from_pretrained(
-        args.pretrained_model_name_or_path, subfolder="text_encoder_2", revision=args.revision
-    )
     vae_path = (
         args.pretrained_model_name_or_path
         if args.pretrained_vae_model_name_or_path is None
         else args.pretrained_vae_model_name_or_path
     )
-    vae = AutoencoderKL.from_pretrained(
-        vae_path,
-        subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
-        revision=args.revision,
-    )
+    if args.latent_cache_dir is None:
+        text_encoder_one = text_encoder_cls_one.from_pretrained(
+            args.pretrained_model_name_or_path, subfolder="text_encoder", revision=args.revision
+        )
+        text_encoder_two = text_encoder_cls_two.from_pretrained(
+            args.pretrained_model_name_or_path, subfolder="text_encoder_2", revision=args.revision
+        )
+        vae = AutoencoderKL.from_pretrained(
+            vae_path,
+            subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
+            revision=args.revision,
+        )
+        vae_scaling_factor = vae.config.scaling_factor
+    else:
+        # latents and text embeddings are precomputed, only the VAE config is needed
+        text_encoder_one = text_encoder_two = vae = None
+        vae_scaling_factor = AutoencoderKL.load_config(
+            vae_path,
+            subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
+            revision=args.revision,
+        )["scaling_factor"]
     unet = UNet.from_pretrained(
         args.pretrained_model_name_or_path, subfolder="unet", revision=args.revision
     )
@@ -597,9 +620,10 @@ def main(args):
 
         accelerator.register_save_state_pre_hook(save_model_hook)
 
-    vae.requires_grad_(False)
-    text_encoder_one.requires_grad_(False)
-    text_encoder_two.requires_grad_(False)
+    if args.latent_cache_dir is None:
+        vae.requires_grad_(False)
+        text_encoder_one.requires_grad_(False)
+        text_encoder_two.requires_grad_(False)
 
     if args.enable_xformers_memory_efficient_attention:
         if is_xformers_available():
@@ -646,8 +670,10 @@ def main(args):
 
     start_global_step = 0
     start_epoch = 0
+    start_data_cursor = None
     if config.model.params.adapter_config.pretrained is not None:
-        start_epoch, start_global_step, state_dict = load_sdxl_adapter_chaeckpoit(config.model.params.adapter_config.pretrained)
+        start_epoch, start_global_step, state_dict, start_data_cursor = load_sdxl_adapter_chaeckpoit(
+            config.model.params.adapter_config.pretrained, return_data_cursor=True)
         adapter.load_state_dict(state_dict)
 
     params_to_optimize = adapter.parameters()
@@ -677,13 +703,14 @@ def main(args):
 
     # Move vae, unet and text_encoder to device and cast to weight_dtype
     # The VAE is in float32 to avoid NaN losses.
-    if args.pretrained_vae_model_name_or_path is not None:
-        vae.to(accelerator.device, dtype=weight_dtype)
-    else:
-        vae.to(accelerator.device, dtype=torch.float32)
     unet.to(accelerator.device, dtype=weight_dtype)
-    text_encoder_one.to(accelerator.device, dtype=weight_dtype)
-    text_encoder_two.to(accelerator.device, dtype=weight_dtype)
+    if args.latent_cache_dir is None:
+        if args.pretrained_vae_model_name_or_path is not None:
+            vae.to(accelerator.device, dtype=weight_dtype)
+        else:
+            vae.to(accelerator.device, dtype=torch.float32)
+        text_encoder_one.to(accelerator.device, dtype=weight_dtype)
+        text_encoder_two.to(accelerator.device, dtype=weight_dtype)
 
     # Here, we compute not just the text embeddings but also the additional embeddings
     # needed for the SD XL UNet to operate.
@@ -710,6 +737,23 @@ def main(args):
 
         return {"prompt_embeds": prompt_embeds}, unet_added_cond_kwargs#, **unet_added_cond_kwargs}
 
+    # Same as compute_embeddings, but the text embeddings come from the latent cache
+    def get_cached_embeddings(batch):
+        original_size = (args.resolution, args.resolution)
+        target_size = (args.resolution, args.resolution)
+        crops_coords_top_left = (args.crops_coords_top_left_h, args.crops_coords_top_left_w)
+
+        prompt_embeds = batch["prompt_embeds"].to(accelerator.device, dtype=weight_dtype)
+        add_text_embeds = batch["pooled_prompt_embeds"].to(accelerator.device, dtype=weight_dtype)
+
+        add_time_ids = list(original_size + crops_coords_top_left + target_size)
+        add_time_ids = torch.tensor([add_time_ids])
+        add_time_ids = add_time_ids.repeat(prompt_embeds.shape[0], 1)
+        add_time_ids = add_time_ids.to(accelerator.device, dtype=prompt_embeds.dtype)
+        unet_added_cond_kwargs = {"text_embeds": add_text_embeds, "time_ids": add_time_ids}
+
+        return {"prompt_embeds": prompt_embeds}, unet_added_cond_kwargs
+
     # Let's first compute all the embeddings so that we can free up the text encoders
     # from memory.
     text_encoders = [text_encoder_one, text_encoder_two]
@@ -718,7 +762,15 @@ def main(args):
     torch.cuda.empty_cache()
 
     # data
+    if args.latent_cache_dir is not None:
+        config.data.params.train.latent_cache = args.latent_cache_dir
     data = instantiate_from_config(config.data)
+    # streaming tar shards: skip the shards consumed before the restart. The cursor is saved in the checkpoint;
+    # older checkpoints only have the step, counted with the batch size of the loader
+    samples_per_step = data.samples_per_step(accelerator.num_processes, args.gradient_accumulation_steps)
+    if start_data_cursor is None:
+        start_data_cursor = start_global_step * samples_per_step
+    data.resume_from(start_data_cursor, accelerator.num_processes)
     train_dataloader = data.train_dataloader()
     test_dataloader = data.test_dataloader()
 
@@ -739,10 +791,14 @@ def main(args):
         power=args.lr_power,
     )
 
-    # Prepare everything with our `accelerator`.
-    adapter, optimizer, train_dataloader, lr_scheduler = accelerator.prepare(
-        adapter, optimizer, train_dataloader, lr_scheduler
-    )
+    # Prepare everything with our `accelerator`. The web loader already reads a per-node split of the shards: prepared,
+    # accelerate would iterate it on rank 0 only and dispatch its batches (which hold lists of str) to the other ranks
+    if data.is_streaming():
+        adapter, optimizer, lr_scheduler = accelerator.prepare(adapter, optimizer, lr_scheduler)
+    else:
+        adapter, optimizer, train_dataloader, lr_scheduler = accelerator.prepare(
+            adapter, optimizer, train_dataloader, lr_scheduler
+        )
 
     # We need to recalculate our total training steps as the size of the training dataloader may have changed.
     # num_update_steps_per_epoch = math.ceil(len(train_dataloader) / args.gradient_accumulation_steps)
@@ -784,22 +840,27 @@ def main(args):
     for epoch in range(first_epoch, args.num_train_epochs):
         for step, batch in enumerate(train_dataloader):
             with accelerator.accumulate(adapter):
-                # norm input
-                batch["jpg"] = batch["jpg"].cuda()
-                batch["jpg"] = batch["jpg"]*2.-1.       # [0, 1] transition to [-1, 1]?
                 # get depth
                 depth = batch["depth"].cuda()
 
                 # Convert images to latent space
-                if args.pretrained_vae_model_name_or_path is not None:
-                    pixel_values = batch["jpg"].to(dtype=weight_dtype)
-                else:
-                    pixel_values = batch["jpg"]
-
-                latents = vae.encode(pixel_values).latent_dist.sample()
-                latents = latents * vae.config.scaling_factor
-                if args.pretrained_vae_model_name_or_path is None:
+                if args.latent_cache_dir is not None:
+                    latent_dist = DiagonalGaussianDistribution(batch["latent_params"].cuda().float())
+                    latents = latent_dist.sample() * vae_scaling_factor
                     latents = latents.to(weight_dtype)
+                else:
+                    # norm input
+                    batch["jpg"] = batch["jpg"].cuda()
+                    batch["jpg"] = batch["jpg"]*2.-1.       # [0, 1] transition to [-1, 1]?
+                    if args.pretrained_vae_model_name_or_path is not None:
+                        pixel_values = batch["jpg"].to(dtype=weight_dtype)
+                    else:
+                        pixel_values = batch["jpg"]
+
+                    latents = vae.encode(pixel_values).latent_dist.sample()
+                    latents = latents * vae_scaling_factor
+                    if args.pretrained_vae_model_name_or_path is None:
+                        latents = latents.to(weight_dtype)
 
                 # Sample noise that we'll add to the latents
                 noise = torch.randn_like(latents)
@@ -821,9 +882,12 @@ def main(args):
                 noisy_latents = noise_scheduler.add_noise(latents, noise, timesteps)
 
                 # get text embedding
-                prompt_embeds, unet_added_cond_kwargs = compute_embeddings(
-                    batch=batch, proportion_empty_prompts=0, text_encoders=text_encoders, tokenizers=tokenizers
-                )
+                if args.latent_cache_dir is not None:
+                    prompt_embeds, unet_added_cond_kwargs = get_cached_embeddings(batch)
+                else:
+                    prompt_embeds, unet_added_cond_kwargs = compute_embeddings(
+                        batch=batch, proportion_empty_prompts=0, text_encoders=text_encoders, tokenizers=tokenizers
+                    )
 
                 # Adapter conditioning.
                 down_block_additional_residuals = adapter(
@@ -878,6 +942,7 @@ def main(args):
                         accelerator.unwrap_model(adapter),
                         epoch,
                         global_step,
+                        data_cursor=start_data_cursor + (global_step - start_global_step) * samples_per_step,
                     )
 
             logs = {"loss": loss.detach().item(), "lr": lr_scheduler.get_last_lr()[0]}
@@ -890,8 +955,8 @@ def main(args):
             #     # combined_dict = {**logs, **iter_state}
             #     logger.info(iter_state)
 
-            # sample
-            if global_step % config['logger']['sample_freq'] == 0:
+            # sample, needs the VAE and text encoders so it is skipped when training from the latent cache
+            if global_step % config['logger']['sample_freq'] == 0 and args.latent_cache_dir is None:
                 accelerator.wait_for_everyone()
                 if accelerator.is_main_process:
                     with torch.no_grad():
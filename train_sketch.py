@@ -47,13 +47,14 @@ from diffusers import (
     UNet2DConditionModel,
     UniPCMultistepScheduler,
 )
+from diffusers.models.vae import DiagonalGaussianDistribution
 from diffusers.optimization import get_scheduler
 from diffusers.utils import check_min_version, is_wandb_available
 from diffusers.utils.import_utils import is_xformers_available
 
 from configs.utils import instantiate_from_config
 from omegaconf import OmegaConf
-from Adapter.extra_condition.model_edge import pidinet
+from Adapter.extra_condition.model_edge import load_pidinet
 from models.unet import UNet
 from basicsr.utils import tensor2img
 import cv2
@@ -301,6 +302,23 @@ def parse_args(input_args=None):
             " https://pytorch.org/docs/stable/generated/torch.optim.Optimizer.zero_grad.html"
         ),
     )
+    parser.add_argument(
+        "--latent_cache_dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory written by tool/prepare_latent_cache.py. When set, VAE latents and text embeddings are read"
+            " from the cache and neither the VAE nor the text encoders are loaded."
+        ),
+    )
+    parser.add_argument(
+        "--precomputed_cond",
+        action="store_true",
+        help=(
+            "Read the PiDiNet soft edge maps written by `condition_extractor/multi_main_v2.py --cond_type sketch` from"
+            " the dataset (binarized by its `cond_process`) instead of running PiDiNet on every batch."
+        ),
+    )
     parser.add_argument(
         "--proportion_empty_prompts",
         type=float,
@@ -325,6 +343,9 @@ def parse_args(input_args=None):
     if args.proportion_empty_prompts < 0 or args.proportion_empty_prompts > 1:
         raise ValueError("`--proportion_empty_prompts` must be in the range [0, 1].")
 
+    if args.latent_cache_dir is not None and args.proportion_empty_prompts > 0:
+        raise ValueError("`--proportion_empty_prompts` is not supported with `--latent_cache_dir`.")
+
     if args.resolution % 8 != 0:
         raise ValueError(
             "`--resolution` must be divisible by 8 for consistently sized encoded images between the VAE and T2I-Adapter."
@@ -433,22 +454,32 @@ def main(args):
 
     # Load scheduler and models
     noise_scheduler = DDPMScheduler.from_pretrained(args.pretrained_model_name_or_path, subfolder="scheduler")
-    text_encoder_one = text_encoder_cls_one.from_pretrained(
-        args.pretrained_model_name_or_path, subfolder="text_encoder", revision=args.revision
-    )
-    text_encoder_two = text_encoder_cls_two.from_pretrained(
-        args.pretrained_model_name_or_path, subfolder="text_encoder_2", revision=args.revision
-    )
     vae_path = (
         args.pretrained_model_name_or_path
         if args.pretrained_vae_model_name_or_path is None
         else args.pretrained_vae_model_name_or_path
     )
-    vae = AutoencoderKL.from_pretrained(
-        vae_path,
-        subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
-        revision=args.revision,
-    )
+    if args.latent_cache_dir is None:
+        text_encoder_one = text_encoder_cls_one.from_pretrained(
+            args.pretrained_model_name_or_path, subfolder="text_encoder", revision=args.revision
+        )
+        text_encoder_two = text_encoder_cls_two.from_pretrained(
+            args.pretrained_model_name_or_path, subfolder="text_encoder_2", revision=args.revision
+        )
+        vae = AutoencoderKL.from_pretrained(
+            vae_path,
+            subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
+            revision=args.revision,
+        )
+        vae_scaling_factor = vae.config.scaling_factor
+    else:
+        # latents and text embeddings are precomputed, only the VAE config is needed
+        text_encoder_one = text_encoder_two = vae = None
+        vae_scaling_factor = AutoencoderKL.load_config(
+            vae_path,
+            subfolder="vae" if args.pretrained_vae_model_name_or_path is None else None,
+            revision=args.revision,
+        )["scaling_factor"]
     unet = UNet.from_pretrained(
         args.pretrained_model_name_or_path, subfolder="unet", revision=args.revision
     )
@@ -467,9 +498,10 @@ def main(args):
 
         accelerator.register_save_state_pre_hook(save_model_hook)
 
-    vae.requires_grad_(False)
-    text_encoder_one.requires_grad_(False)
-    text_encoder_two.requires_grad_(False)
+    if args.latent_cache_dir is None:
+        vae.requires_grad_(False)
+        text_encoder_one.requires_grad_(False)
+        text_encoder_two.requires_grad_(False)
 
     if args.enable_xformers_memory_efficient_attention:
         if is_xformers_available():
@@ -524,12 +556,11 @@ def main(args):
         eps=args.adam_epsilon,
     )
     # load sketch model
-    sketch_model = pidinet()
-    ckp = torch.load('checkpoints/table5_pidinet.pth', map_location='cpu')['state_dict']
-    sketch_model.load_state_dict({k.replace('module.', ''): v for k, v in ckp.items()}, strict=True)
-    sketch_model = sketch_model.cuda()
-    for param in sketch_model.parameters():
-        param.required_grad = False
+    if not args.precomputed_cond:
+        sketch_model = load_pidinet('checkpoints/table5_pidinet.pth')
+        sketch_model = sketch_model.cuda()
+        for param in sketch_model.parameters():
+            param.required_grad = False
 
     # For mixed precision training we cast the text_encoder and vae weights to half-precision
     # as these models are only used for inference, keeping weights in full precision is not required.
@@ -541,13 +572,14 @@ def main(args):
 
     # Move vae, unet and text_encoder to device and cast to weight_dtype
     # The VAE is in float32 to avoid NaN losses.
-    if args.pretrained_vae_model_name_or_path is not None:
-        vae.to(accelerator.device, dtype=weight_dtype)
-    else:
-        vae.to(accelerator.device, dtype=torch.float32)
     unet.to(accelerator.device, dtype=weight_dtype)
-    text_encoder_one.to(accelerator.device, dtype=weight_dtype)
-    text_encoder_two.to(accelerator.device, dtype=weight_dtype)
+    if args.latent_cache_dir is None:
+        if args.pretrained_vae_model_name_or_path is not None:
+            vae.to(accelerator.device, dtype=weight_dtype)
+        else:
+            vae.to(accelerator.device, dtype=torch.float32)
+        text_encoder_one.to(accelerator.device, dtype=weight_dtype)
+        text_encoder_two.to(accelerator.device, dtype=weight_dtype)
 
     # Here, we compute not just the text embeddings but also the additional embeddings
     # needed for the SD XL UNet to operate.
@@ -574,6 +606,23 @@ def main(args):
 
         return {"prompt_embeds": prompt_embeds}, unet_added_cond_kwargs#, **unet_added_cond_kwargs}
 
+    # Same as compute_embeddings, but the text embeddings come from the latent cache
+    def get_cached_embeddings(batch):
+        original_size = (args.resolution, args.resolution)
+        target_size = (args.resolution, args.resolution)
+        crops_coords_top_left = (args.crops_coords_top_left_h, args.crops_coords_top_left_w)
+
+        prompt_embeds = batch["prompt_embeds"].to(accelerator.device, dtype=weight_dtype)
+        add_text_embeds = batch["pooled_prompt_embeds"].to(accelerator.device, dtype=weight_dtype)
+
+        add_time_ids = list(original_size + crops_coords_top_left + target_size)
+        add_time_ids = torch.tensor([add_time_ids])
+        add_time_ids = add_time_ids.repeat(prompt_embeds.shape[0], 1)
+        add_time_ids = add_time_ids.to(accelerator.device, dtype=prompt_embeds.dtype)
+        unet_added_cond_kwargs = {"text_embeds": add_text_embeds, "time_ids": add_time_ids}
+
+        return {"prompt_embeds": prompt_embeds}, unet_added_cond_kwargs
+
     # Let's first compute all the embeddings so that we can free up the text encoders
     # from memory.
     text_encoders = [text_encoder_one, text_encoder_two]
@@ -582,6 +631,11 @@ def main(args):
     torch.cuda.empty_cache()
 
     # data
+    config.data.params.train.load_cond = args.precomputed_cond
+    if args.latent_cache_dir is not None:
+        config.data.params.train.latent_cache = args.latent_cache_dir
+        # the image is still needed when the sketch is extracted on the fly
+        config.data.params.train.load_image = not args.precomputed_cond
     data = instantiate_from_config(config.data)
     train_dataloader = data.train_dataloader()
 
@@ -648,23 +702,33 @@ def main(args):
         for step, batch in enumerate(train_dataloader):
             with accelerator.accumulate(adapter):
                 # norm input
-                batch["jpg"] = batch["jpg"].cuda()
-                batch["jpg"] = batch["jpg"]*2.-1.       # [0, 1] transition to [-1, 1]?
+                if "jpg" in batch:
+                    batch["jpg"] = batch["jpg"].cuda()
+                    batch["jpg"] = batch["jpg"]*2.-1.       # [0, 1] transition to [-1, 1]?
                 # get sketch
-                edge = 0.5 * batch['jpg'] + 0.5
-                edge = sketch_model(edge)[-1]
-                # add random threshold and random masking
-                edge = random_threshold(edge).to(dtype=weight_dtype)
+                if args.precomputed_cond:
+                    # soft edge map from condition_extractor, the random threshold is applied by the loader
+                    edge = batch["depth"].cuda().to(dtype=weight_dtype)
+                else:
+                    edge = 0.5 * batch['jpg'] + 0.5
+                    edge = sketch_model(edge)[-1]
+                    # add random threshold and random masking
+                    edge = random_threshold(edge).to(dtype=weight_dtype)
 
                 # Convert images to latent space
-                if args.pretrained_vae_model_name_or_path is not None:
-                    pixel_values = batch["jpg"].to(dtype=weight_dtype)
-                else:
-                    pixel_values = batch["jpg"]
-                latents = vae.encode(pixel_values).latent_dist.sample()
-                latents = latents * vae.config.scaling_factor
-                if args.pretrained_vae_model_name_or_path is None:
+                if args.latent_cache_dir is not None:
+                    latent_dist = DiagonalGaussianDistribution(batch["latent_params"].cuda().float())
+                    latents = latent_dist.sample() * vae_scaling_factor
                     latents = latents.to(weight_dtype)
+                else:
+                    if args.pretrained_vae_model_name_or_path is not None:
+                        pixel_values = batch["jpg"].to(dtype=weight_dtype)
+                    else:
+                        pixel_values = batch["jpg"]
+                    latents = vae.encode(pixel_values).latent_dist.sample()
+                    latents = latents * vae_scaling_factor
+                    if args.pretrained_vae_model_name_or_path is None:
+                        latents = latents.to(weight_dtype)
 
                 # Sample noise that we'll add to the latents
                 noise = torch.randn_like(latents)
@@ -680,9 +744,12 @@ def main(args):
                 noisy_latents = noise_scheduler.add_noise(latents, noise, timesteps)
 
                 # get text embedding
-                prompt_embeds, unet_added_cond_kwargs = compute_embeddings(
-                    batch=batch,proportion_empty_prompts=0,text_encoders=text_encoders,tokenizers=tokenizers
-                )
+                if args.latent_cache_dir is not None:
+                    prompt_embeds, unet_added_cond_kwargs = get_cached_embeddings(batch)
+                else:
+                    prompt_embeds, unet_added_cond_kwargs = compute_embeddings(
+                        batch=batch,proportion_empty_prompts=0,text_encoders=text_encoders,tokenizers=tokenizers
+                    )
 
                 # Adapter conditioning.
                 down_block_additional_residuals = adapter(